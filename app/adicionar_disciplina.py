@@ -1,28 +1,17 @@
 import psycopg2
 import uuid 
 from psycopg2.extras import execute_values 
-from app.config import SERVERS, ALL_SERVERS
-
-def connect_to_db(servidor_id):
-    """Conecta ao banco de dados específico."""
-    config = SERVERS.get(servidor_id)
-    if not config:
-        print(f"❌ Configuração do servidor {servidor_id} não encontrada.")
-        return None
-
-    connect_args = {k: v for k, v in config.items() if k != 'tipo'}
-    connect_args['connect_timeout'] = 5
-
-    try:
-        conn = psycopg2.connect(**connect_args)
-        return conn
-    except psycopg2.OperationalError as e:
-        return None
-
+from app.config import ALL_SERVERS, LOCAL_SERVERS, REPLICACAO_MODO
+from app.conexoes import connect_to_db, liberar_conexao
+from app.saude_lideres import filtrar_lideres_disponiveis
+from app.replicacao import novo_lote
+from app.outbox import enfileirar_pendentes
+from app.hlc import agora_hlc
 
 def _adicionar_disciplina_core(disciplina_nome: str, vagas: int):
     """
     [FUNÇÃO INTERNA] Contém a nova lógica de replicação Multi-Líder.
+    Retorna {'disciplina_id', 'nome', 'vagas', 'lideres_ok', 'pendentes'} ou {'erro': ...}.
     """
 
     print(f"--- Tentando adicionar disciplina: {disciplina_nome} ({vagas} vagas) ---")
@@ -30,28 +19,8 @@ def _adicionar_disciplina_core(disciplina_nome: str, vagas: int):
     # 1. Gerar os dados UNIVERSAIS para esta disciplina
     disciplina_uuid = str(uuid.uuid4())
     
-    # --- CORREÇÃO APLICADA AQUI ---
-    # Tenta conectar a QUALQUER líder disponível para gerar um timestamp
-    timestamp_agora = None
-    for servidor_id in ALL_SERVERS:
-        conn_check = connect_to_db(servidor_id)
-        if conn_check:
-            try:
-                cursor_check = conn_check.cursor()
-                cursor_check.execute("SELECT (NOW() AT TIME ZONE 'UTC')")
-                timestamp_agora = cursor_check.fetchone()[0]
-                cursor_check.close()
-                conn_check.close()
-                print(f"✅ Timestamp gerado via Líder {servidor_id}.")
-                break # Sai do loop assim que conseguir um timestamp
-            except Exception:
-                if conn_check: conn_check.close()
-                continue
-    
-    if timestamp_agora is None:
-         print("❌ Falha: Não foi possível conectar a NENHUM líder para gerar timestamp. (Ambos estão offline?)")
-         return
-    # --- FIM DA CORREÇÃO ---
+    # Versão HLC (app/hlc.py) gerada no próprio processo, sem ida a um líder só para ler a hora
+    timestamp_agora = agora_hlc()
 
     # Dados completos a serem replicados (de acordo com o init.sql)
     dados_disciplina = (
@@ -81,9 +50,11 @@ def _adicionar_disciplina_core(disciplina_nome: str, vagas: int):
 
     success_count = 0
     total_servers = len(ALL_SERVERS)
+    lideres_ok = []
 
-    # 3. Tentar aplicar em TODOS os líderes
-    for servidor_id in ALL_SERVERS:
+    # 3. Tentar aplicar em TODOS os líderes (exceto os que o circuit breaker já sabe estarem fora)
+    lideres_disponiveis, _ = filtrar_lideres_disponiveis(ALL_SERVERS, "replicação da disciplina")
+    for servidor_id in lideres_disponiveis:
         conn = connect_to_db(servidor_id)
 
         if not conn:
@@ -96,6 +67,7 @@ def _adicionar_disciplina_core(disciplina_nome: str, vagas: int):
             execute_values(cursor, query, [dados_disciplina])
             conn.commit()
             success_count += 1
+            lideres_ok.append(servidor_id)
 
         except psycopg2.Error as e:
             conn.rollback()
@@ -105,17 +77,26 @@ def _adicionar_disciplina_core(disciplina_nome: str, vagas: int):
         finally:
             if cursor:
                 cursor.close()
-            if conn:
-                conn.close()
+            liberar_conexao(conn)
 
+    pendentes = [s for s in ALL_SERVERS if s not in lideres_ok]
     if success_count == total_servers:
         print(f"\n✅ Sucesso: Disciplina '{disciplina_nome}' foi adicionada e replicada em TODOS os líderes.")
     elif success_count > 0:
         print(f"\n⚠ Aviso: Disciplina '{disciplina_nome}' adicionada em {success_count} de {total_servers} líderes.")
-        print("   (Rode a Opção 10 'Heal' para forçar a sincronização nos nós offline)")
+        if REPLICACAO_MODO == 'outbox':
+            lote = novo_lote()
+            lote['disciplinas'].append(dados_disciplina)
+            origem = LOCAL_SERVERS[0] if LOCAL_SERVERS and LOCAL_SERVERS[0] in lideres_ok else lideres_ok[0]
+            enfileirar_pendentes(origem, lote, pendentes, f"Nova disciplina {disciplina_nome}")
+        else:
+            print("   (Rode a Opção 10 'Heal' para forçar a sincronização nos nós offline)")
     else:
         print(f"\n❌ Falha: Disciplina '{disciplina_nome}' não foi adicionada em nenhum líder.")
-        
+        return {'erro': "disciplina não adicionada em nenhum líder", 'nome': disciplina_nome}
+    return {'disciplina_id': disciplina_uuid, 'nome': disciplina_nome, 'vagas': vagas,
+            'lideres_ok': lideres_ok, 'pendentes': pendentes}
+
 
 def adicionar_disciplina():
     """
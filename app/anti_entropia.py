@@ -0,0 +1,288 @@
+import atexit
+import random
+import threading
+import time
+from datetime import datetime, timezone
+import psycopg2
+from app.config import (
+    LOCAL_SERVERS, ANTI_ENTROPIA_INTERVALO, ANTI_ENTROPIA_JITTER, ANTI_ENTROPIA_RODADAS_MERKLE,
+    ANTI_ENTROPIA_BACKOFF_INICIAL, ANTI_ENTROPIA_BACKOFF_MAXIMO
+)
+from app.armazenamento import backend_padrao
+from app.instrumentacao import medir, registrar_valor
+from app.saude_lideres import circuito_aberto
+from app.sincronizacao import ORDEM_SYNC, MODO_INCREMENTAL, MODO_COMPLETO, MODO_MERKLE, em_silencio, sincronizar_peer
+
+# Anti-entropia contínua: em vez de um heal bloqueante ao abrir o menu, uma thread faz rodadas a cada
+# ANTI_ENTROPIA_INTERVALO segundos (± ANTI_ENTROPIA_JITTER). Cada rodada compara o resumo das tabelas
+# (linhas e maior versão) do líder local com o de cada peer, sincroniza só as tabelas que diferem (modo
+# incremental, pelas watermarks) e começa pelo peer com a mudança mais recente; a cada
+# ANTI_ENTROPIA_RODADAS_MERKLE rodadas compara todas as tabelas por digests. Um peer que falha espera um
+# backoff exponencial antes da próxima tentativa. O menu e a API nunca esperam por uma rodada: a thread usa
+# os mesmos pools, e o LWW torna seguro sincronizar em paralelo com as escritas.
+_lock = threading.Lock()
+_progresso = {'rodadas': 0, 'modo': None, 'ultima_rodada': None, 'duracao_ultima_s': None,
+              'proxima_rodada': None, 'ultimo_erro': None, 'peers': {}}
+
+
+def _peer(peer):
+    dados = _progresso['peers'].get(peer)
+    if dados is None:
+        dados = _progresso['peers'][peer] = {'situacao': 'pendente', 'tabelas': [], 'ultima_sincronizacao': None,
+                                             'falhas_consecutivas': 0, 'ultimo_erro': None, 'retomar_em': None}
+    return dados
+
+
+def _registrar_sucesso(peer, tabelas):
+    agora = datetime.now(timezone.utc)
+    with _lock:
+        _peer(peer).update(situacao='sincronizado' if tabelas else 'em_dia', tabelas=tabelas,
+                           ultima_sincronizacao=agora.isoformat(timespec='seconds'),
+                           falhas_consecutivas=0, ultimo_erro=None, retomar_em=None)
+    registrar_valor('lab_anti_entropia_falhas_consecutivas', 0, peer=peer)
+    registrar_valor('lab_anti_entropia_ultima_sincronizacao_timestamp', round(agora.timestamp(), 3), peer=peer)
+
+
+def _registrar_falha(peer, erro):
+    with _lock:
+        dados = _peer(peer)
+        dados['falhas_consecutivas'] += 1
+        espera = min(ANTI_ENTROPIA_BACKOFF_INICIAL * 2 ** (dados['falhas_consecutivas'] - 1), ANTI_ENTROPIA_BACKOFF_MAXIMO)
+        dados.update(situacao='falhou', tabelas=[], ultimo_erro=str(erro), retomar_em=time.monotonic() + espera)
+        falhas = dados['falhas_consecutivas']
+    registrar_valor('lab_anti_entropia_falhas_consecutivas', falhas, peer=peer)
+
+
+def _em_backoff(peer):
+    with _lock:
+        retomar = _progresso['peers'].get(peer, {}).get('retomar_em')
+    return retomar is not None and time.monotonic() < retomar
+
+
+def _tabelas_diferentes(resumo_local, resumo_peer):
+    return [tabela for tabela in ORDEM_SYNC if resumo_local.get(tabela) != resumo_peer.get(tabela)]
+
+
+def _mudanca_mais_recente(resumo_local, resumo_peer, tabelas):
+    versoes = [versao for tabela in tabelas for _, versao in (resumo_local[tabela], resumo_peer[tabela]) if versao is not None]
+    return max(versoes).timestamp() if versoes else 0.0
+
+
+def _sincronizar_peers(backend, conn_local, lider_local, modo, completa):
+    try:
+        backend.preparar_sincronizacao(conn_local)
+    except psycopg2.Error:
+        conn_local.rollback()
+        if modo == MODO_INCREMENTAL:
+            modo = MODO_COMPLETO
+    resumo_local = backend.resumo_tabelas(conn_local)
+
+    candidatos = []
+    for peer in backend.lideres:
+        if peer == lider_local or _em_backoff(peer):
+            continue
+        if circuito_aberto(peer):
+            _registrar_falha(peer, "circuito aberto")
+            continue
+        conn = backend.conectar(peer)
+        if not conn:
+            _registrar_falha(peer, "offline")
+            continue
+        try:
+            resumo = backend.resumo_tabelas(conn)
+        except (psycopg2.Error, ConnectionError) as e:
+            backend.liberar(conn)
+            _registrar_falha(peer, e)
+            continue
+        tabelas = list(ORDEM_SYNC) if completa else _tabelas_diferentes(resumo_local, resumo)
+        candidatos.append((_mudanca_mais_recente(resumo_local, resumo, tabelas), peer, conn, tabelas))
+
+    # O peer com a mudança mais recente primeiro: é onde uma leitura tem mais chance de ver a diferença
+    for _, peer, conn, tabelas in sorted(candidatos, key=lambda candidato: candidato[0], reverse=True):
+        try:
+            if tabelas:
+                sincronizar_peer(conn_local, conn, lider_local, peer, modo, backend, tabelas)
+            _registrar_sucesso(peer, tabelas)
+        except Exception as e:
+            _registrar_falha(peer, e)
+        finally:
+            backend.liberar(conn)
+    return modo
+
+
+@medir('anti_entropia')
+def executar_rodada(backend=None):
+    """
+    Uma rodada de anti-entropia do líder local com os peers fora de backoff. Incremental, restrita às tabelas
+    cujo resumo difere; a cada ANTI_ENTROPIA_RODADAS_MERKLE rodadas, 'merkle' em todas as tabelas ('completo'
+    no backend em memória). Retorna progresso_anti_entropia().
+    """
+    backend = backend or backend_padrao()
+    with _lock:
+        _progresso['rodadas'] += 1
+        rodada = _progresso['rodadas']
+    completa = rodada % ANTI_ENTROPIA_RODADAS_MERKLE == 0
+    modo = (MODO_MERKLE if MODO_MERKLE in backend.modos_sync else MODO_COMPLETO) if completa else MODO_INCREMENTAL
+    lider_local = LOCAL_SERVERS[0]
+    inicio, erro = time.monotonic(), None
+
+    conn_local = backend.conectar(lider_local)
+    if not conn_local:
+        erro = f"líder local {lider_local} offline"
+    else:
+        try:
+            modo = _sincronizar_peers(backend, conn_local, lider_local, modo, completa)
+        except (psycopg2.Error, ConnectionError) as e:
+            erro = str(e)
+        finally:
+            backend.liberar(conn_local)
+
+    with _lock:
+        _progresso.update(modo=modo, ultima_rodada=datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                          duracao_ultima_s=round(time.monotonic() - inicio, 3), ultimo_erro=erro)
+    registrar_valor('lab_anti_entropia_rodadas', rodada)
+    return progresso_anti_entropia()
+
+
+def _com_jitter(intervalo):
+    return intervalo * (1 + random.uniform(-ANTI_ENTROPIA_JITTER, ANTI_ENTROPIA_JITTER))
+
+
+class AntiEntropia(threading.Thread):
+    """
+    Thread em segundo plano: uma rodada logo ao iniciar (no lugar do heal do início) e depois a cada intervalo ± jitter.
+    'preparar' roda uma vez antes da primeira rodada (o menu passa aplicar_migracoes, para não esperar por ela).
+    """
+
+    def __init__(self, backend=None, intervalo=ANTI_ENTROPIA_INTERVALO, preparar=None):
+        super().__init__(name="anti-entropia", daemon=True)
+        self.backend = backend
+        self.intervalo = intervalo
+        self.preparar = preparar
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+
+    def notificar(self):
+        """Antecipa a próxima rodada."""
+        self._acordar.set()
+
+    def parar(self, timeout=5):
+        self._parar.set()
+        self._acordar.set()
+        self.join(timeout)
+
+    def run(self):
+        if self.preparar:
+            try:
+                self.preparar()
+            except Exception as e:
+                with _lock:
+                    _progresso['ultimo_erro'] = f"preparação: {e}"
+        espera = 0
+        while not self._parar.is_set():
+            if espera:
+                self._acordar.wait(espera)
+            self._acordar.clear()
+            if self._parar.is_set():
+                break
+            try:
+                with em_silencio():
+                    executar_rodada(self.backend)
+            except Exception as e:
+                with _lock:
+                    _progresso['ultimo_erro'] = str(e)
+            espera = _com_jitter(self.intervalo)
+            with _lock:
+                _progresso['proxima_rodada'] = time.monotonic() + espera
+
+
+_daemon = None
+_daemon_lock = threading.Lock()
+
+
+def iniciar_anti_entropia(backend=None, intervalo=ANTI_ENTROPIA_INTERVALO, preparar=None):
+    global _daemon
+    with _daemon_lock:
+        if _daemon is None or not _daemon.is_alive():
+            _daemon = AntiEntropia(backend, intervalo, preparar)
+            _daemon.start()
+    return _daemon
+
+
+def parar_anti_entropia():
+    if _daemon is not None and _daemon.is_alive():
+        _daemon.parar()
+
+
+atexit.register(parar_anti_entropia)
+
+
+def progresso_anti_entropia():
+    """Estado da anti-entropia (GET /anti-entropia, opção 23 do menu): rodadas, última rodada e a situação de cada peer."""
+    with _lock:
+        agora = time.monotonic()
+        peers = {}
+        for peer, dados in sorted(_progresso['peers'].items()):
+            retomar = dados['retomar_em']
+            peers[peer] = {chave: valor for chave, valor in dados.items() if chave != 'retomar_em'}
+            peers[peer]['proxima_tentativa_em_s'] = round(max(retomar - agora, 0), 1) if retomar else None
+        proxima = _progresso['proxima_rodada']
+        return {
+            'ativa': _daemon is not None and _daemon.is_alive(),
+            'rodadas': _progresso['rodadas'],
+            'modo': _progresso['modo'],
+            'ultima_rodada': _progresso['ultima_rodada'],
+            'duracao_ultima_s': _progresso['duracao_ultima_s'],
+            'proxima_rodada_em_s': round(max(proxima - agora, 0), 1) if proxima and _daemon and _daemon.is_alive() else None,
+            'ultimo_erro': _progresso['ultimo_erro'],
+            'peers': peers,
+        }
+
+
+def _linha_peer(peer, dados):
+    if dados['situacao'] == 'falhou':
+        espera = f", nova tentativa em {dados['proxima_tentativa_em_s']}s" if dados['proxima_tentativa_em_s'] else ""
+        return f"🔴 {peer}: falhou {dados['falhas_consecutivas']}x ({dados['ultimo_erro']}{espera})"
+    if dados['situacao'] == 'sincronizado':
+        return f"🔄 {peer}: sincronizado ({', '.join(dados['tabelas'])})"
+    return f"🟢 {peer}: {dados['situacao'].replace('_', ' ')}"
+
+
+def exibir_anti_entropia():
+    progresso = progresso_anti_entropia()
+    print("\n--- Anti-Entropia em Segundo Plano ---")
+    if not progresso['rodadas']:
+        print("Nenhuma rodada executada ainda" + ("." if progresso['ativa'] else " (ANTI_ENTROPIA_ATIVA = False)."))
+        return
+    print(f"{'Ativa' if progresso['ativa'] else 'Parada'} | {progresso['rodadas']} rodada(s) | última: "
+          f"{progresso['ultima_rodada']} ({progresso['modo']}, {progresso['duracao_ultima_s']}s)"
+          + (f" | próxima em {progresso['proxima_rodada_em_s']}s" if progresso['proxima_rodada_em_s'] is not None else ""))
+    if progresso['ultimo_erro']:
+        print(f"❌ Última rodada: {progresso['ultimo_erro']}")
+    for peer, dados in progresso['peers'].items():
+        print(_linha_peer(peer, dados) + (f" | última sincronização: {dados['ultima_sincronizacao']}" if dados['ultima_sincronizacao'] else ""))
+
+
+def rodar_anti_entropia(intervalo=ANTI_ENTROPIA_INTERVALO, rodadas=None, backend=None):
+    """Primeiro plano (`python main.py anti-entropia`): as mesmas rodadas, uma linha por rodada, até Ctrl+C ou 'rodadas'."""
+    progresso, rodada = None, 0
+    try:
+        while rodadas is None or rodada < rodadas:
+            if rodada:
+                time.sleep(_com_jitter(intervalo))
+            rodada += 1
+            with em_silencio():
+                progresso = executar_rodada(backend)
+            linha = f"🔁 Rodada {progresso['rodadas']} ({progresso['modo']}, {progresso['duracao_ultima_s']}s): "
+            if progresso['ultimo_erro']:
+                linha += f"❌ {progresso['ultimo_erro']}"
+            else:
+                linha += " | ".join(_linha_peer(peer, dados) for peer, dados in progresso['peers'].items())
+            print(linha)
+    except KeyboardInterrupt:
+        print("\nAnti-entropia encerrada.")
+    return progresso
+
+
+def anti_entropia_menu():
+    exibir_anti_entropia()
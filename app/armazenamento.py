@@ -0,0 +1,532 @@
+import threading
+import time
+from app.config import ALL_SERVERS
+from app.conexoes import connect_to_db, liberar_conexao, idas_por_lider
+from app.coordenacao import TravaDisciplinas
+from app.hlc import observar_hlc
+from app.instrumentacao import medir
+from app.replicacao import novo_lote, aplicar_lote, status_sem_base
+
+# Interface de armazenamento usada pela matrícula, remoção e sincronização (app/matricular.py, app/remover.py,
+# app/sincronizacao.py). As regras (FCFS, reavaliação da fila, LWW) ficam nesses módulos; o backend só
+# responde a leituras, aplica lotes e replica. BackendPostgres é o padrão; BackendMemoria simula os líderes
+# em dicionários do processo, com latência e partições injetáveis, para testes e para medir o custo dos
+# algoritmos separado do custo de rede.
+#
+# Sessão (abrir_sessao): uma transação no líder de entrada.
+#   disciplina_por_nome(nome) -> (id, vagas_totais) | (None, None)
+#   matricula_ativa(aluno, disciplina_id) -> id | None
+#   matriculas_ativas_para_remover(pares, alunos_todas) -> [(id, aluno, disciplina_nome, disciplina_id, vagas)]
+#   travar(disciplina_ids) -> trava com liberar()
+#   vagas_disponiveis(disciplina_id) -> (vagas_livres, na_fila) | None (contador da disciplina, travado até o commit)
+#   reavaliar_fila(disciplina_id, vagas, versao) -> [(id, nome, status_novo, timestamp, status_antigo, posicao)]
+#   aplicar_lote(lote), comitar_e_replicar(lote, descricao), desfazer(), fechar()
+# Backend:
+#   lideres, modos_sync, abrir_sessao(lider) -> sessão | None (offline)
+#   ler_fila(lider, disciplina_id) -> [(id, nome, timestamp, status)] (levanta ConnectionError se offline)
+#   conectar(lider) / liberar(handle): handles usados pela sincronização
+#   versoes(handle, tabela, desde=None, ids=None) -> {id: (versao,)}, ids_deletados(handle, tombstones, ids=None)
+#   copiar_linhas(handle_destino, handle_origem, tabela, ids) -> bool (upsert LWW + commit no destino)
+#   resumo_tabelas(handle) -> {tabela: (linhas, maior versão)} (a anti-entropia só sincroniza o que difere)
+#   preparar_sincronizacao(handle), carregar_watermarks(handle, peer, direcao),
+#   salvar_watermark(handle, peer, tabela, direcao, watermark)
+#   idas_por_lider() -> {lider: comandos enviados}, estado_matriculas(lider, disciplina_ids) -> {id: status} | None
+
+
+class SessaoPostgres:
+    """Transação numa conexão do pool do líder de entrada."""
+
+    def __init__(self, lider, conn):
+        self.lider = lider
+        self.conn = conn
+        self.cursor = conn.cursor()
+
+    def disciplina_por_nome(self, nome):
+        from app.matricular import obter_disciplina_id_e_vagas
+        return obter_disciplina_id_e_vagas(self.conn, nome)
+
+    def matricula_ativa(self, aluno, disciplina_id):
+        self.cursor.execute("""
+            SELECT id FROM matriculas
+            WHERE nome_aluno = %s AND disciplina_id = %s AND status != 'REMOVIDA'
+            """, (aluno, disciplina_id))
+        resultado = self.cursor.fetchone()
+        return resultado[0] if resultado else None
+
+    def matriculas_ativas_para_remover(self, pares, alunos_todas):
+        """Os pares (aluno, disciplina) explícitos e todas as disciplinas dos alunos em 'alunos_todas', numa consulta."""
+        pares = sorted(pares)
+        self.cursor.execute("""
+            SELECT m.id, m.nome_aluno, d.nome, d.id, d.vagas_totais
+            FROM matriculas m
+            JOIN disciplinas d ON d.id = m.disciplina_id
+            WHERE m.status != 'REMOVIDA' AND (d.is_deleted IS NULL OR d.is_deleted = false)
+              AND ((m.nome_aluno, d.nome) IN (SELECT * FROM unnest(%s::text[], %s::text[]))
+                   OR m.nome_aluno = ANY(%s::text[]))
+        """, ([a for a, _ in pares], [d for _, d in pares], list(alunos_todas)))
+        return self.cursor.fetchall()
+
+    @medir('travar')
+    def travar(self, disciplinas_ids):
+        return TravaDisciplinas(self.conn, disciplinas_ids).adquirir()
+
+    def vagas_disponiveis(self, disciplina_id):
+        from app.ocupacao import vagas_disponiveis
+        return vagas_disponiveis(self.conn, disciplina_id, travar=True)
+
+    @medir('reavaliar_fila')
+    def reavaliar_fila(self, disciplina_id, vagas_totais, versao):
+        from app.matricular import reavaliar_posicao_sql
+        return reavaliar_posicao_sql(self.cursor, disciplina_id, vagas_totais, versao)
+
+    def aplicar_lote(self, lote):
+        aplicar_lote(self.conn, lote, commit=False)
+
+    @medir('comitar_e_replicar')
+    def comitar_e_replicar(self, lote, descricao):
+        from app.outbox import comitar_e_replicar
+        return comitar_e_replicar(self.conn, lote, self.lider, descricao)
+
+    def desfazer(self):
+        self.conn.rollback()
+
+    def fechar(self):
+        self.cursor.close()
+        liberar_conexao(self.conn)
+
+
+class BackendPostgres:
+    """Os líderes PostgreSQL de SERVERS (app/config.py), com pools, circuit breaker e REPLICACAO_MODO."""
+
+    modos_sync = ('incremental', 'completo', 'merkle', 'streaming')
+
+    def __init__(self, lideres=None):
+        self.lideres = list(lideres or ALL_SERVERS)
+
+    def abrir_sessao(self, lider):
+        conn = connect_to_db(lider)
+        return SessaoPostgres(lider, conn) if conn else None
+
+    def ler_fila(self, lider, disciplina_id):
+        from app.matricular import _ler_fila_no_lider
+        with medir('ler_fila', lider):
+            return _ler_fila_no_lider(lider, disciplina_id)
+
+    def conectar(self, lider):
+        return connect_to_db(lider)
+
+    def liberar(self, conn):
+        liberar_conexao(conn)
+
+    def versoes(self, conn, tabela, desde=None, ids=None):
+        from app.sincronizacao import fetch_all_data_from_server, fetch_data_by_ids
+        if ids is not None:
+            return fetch_data_by_ids(conn, tabela, ids)
+        return fetch_all_data_from_server(conn, tabela, desde=desde)
+
+    def ids_deletados(self, conn, tabela_tombstone, ids=None):
+        from app.sincronizacao import fetch_deleted_ids
+        return fetch_deleted_ids(conn, tabela_tombstone, ids=ids)
+
+    def copiar_linhas(self, conn_destino, conn_origem, tabela, ids):
+        from app.sincronizacao import _copiar_linhas
+        return _copiar_linhas(conn_destino, conn_origem, tabela, ids)
+
+    def resumo_tabelas(self, conn):
+        from app.sincronizacao import resumo_tabelas
+        return resumo_tabelas(conn)
+
+    def preparar_sincronizacao(self, conn):
+        from app.sincronizacao import garantir_tabela_watermarks
+        garantir_tabela_watermarks(conn)
+
+    def carregar_watermarks(self, conn, peer_id, direcao):
+        from app.sincronizacao import carregar_watermarks
+        return carregar_watermarks(conn, peer_id, direcao)
+
+    def salvar_watermark(self, conn, peer_id, tabela, direcao, watermark):
+        from app.sincronizacao import salvar_watermark
+        salvar_watermark(conn, peer_id, tabela, direcao, watermark)
+
+    def idas_por_lider(self):
+        return idas_por_lider()
+
+    def estado_matriculas(self, lider, disciplinas_ids):
+        conn = connect_to_db(lider)
+        if not conn:
+            return None
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT id::text, status FROM matriculas WHERE disciplina_id = ANY(%s::uuid[])",
+                           (list(disciplinas_ids),))
+            return dict(cursor.fetchall())
+        finally:
+            conn.rollback()
+            cursor.close()
+            liberar_conexao(conn)
+
+
+# --- Backend em memória ---
+
+# Mesma ordem de colunas de TABELAS_SYNC (app/sincronizacao.py); a versão (LWW) é sempre a última coluna
+TABELAS_MEMORIA = ('disciplinas', 'matriculas', 'deleted_disciplinas', 'deleted_matriculas')
+VERSAO = -1
+STATUS, DISCIPLINA, ALUNO, TIMESTAMP = 4, 1, 2, 3
+
+
+class EstadoLider:
+    """As tabelas de um líder em memória ({id: linha}) e a aplicação de lotes com as regras LWW do SQL (montar_sql_lote)."""
+
+    def __init__(self):
+        self.tabelas = {tabela: {} for tabela in TABELAS_MEMORIA}
+        self.watermarks = {}
+        self.lock = threading.Lock()
+
+    def _upsert(self, tabela, linha):
+        linha = (str(linha[0]),) + tuple(linha[1:])
+        if tabela == 'matriculas':
+            linha = linha[:DISCIPLINA] + (str(linha[DISCIPLINA]),) + linha[DISCIPLINA + 1:]
+        atual = self.tabelas[tabela].get(linha[0])
+        if atual is None or atual[VERSAO] < linha[VERSAO]:
+            self.tabelas[tabela][linha[0]] = linha
+
+    def aplicar(self, lote, forcar_status=False):
+        """
+        forcar_status=True aplica 'status' sem comparar versões, como o UPDATE de reavaliar_posicao_sql.
+        Retorna os ids das mudanças de status sem a matrícula neste líder, como aplicar_lote.
+        """
+        for linha in lote.get('disciplinas', ()):
+            self._upsert('disciplinas', linha)
+        for linha in lote.get('matriculas', ()):
+            self._upsert('matriculas', linha)
+        for chave, tabela in (('tombstones_matriculas', 'deleted_matriculas'), ('tombstones_disciplinas', 'deleted_disciplinas')):
+            for tombstone in lote.get(chave, ()):
+                self._upsert(tabela, tombstone)
+        matriculas, faltando = self.tabelas['matriculas'], set()
+        for matricula_id, status, versao in lote.get('status', ()):
+            atual = matriculas.get(str(matricula_id))
+            if atual is None:
+                faltando.add(str(matricula_id))
+            elif forcar_status or atual[VERSAO] < versao:
+                matriculas[str(matricula_id)] = atual[:STATUS] + (status, versao)
+        return faltando
+
+    def fila(self, disciplina_id):
+        """Matrículas não removidas da disciplina, em ordem FCFS (timestamp, id)."""
+        disciplina_id = str(disciplina_id)
+        return sorted(
+            (m for m in self.tabelas['matriculas'].values() if m[DISCIPLINA] == disciplina_id and m[STATUS] != 'REMOVIDA'),
+            key=lambda m: (m[TIMESTAMP], m[0]),
+        )
+
+
+class SessaoMemoria:
+    """
+    Transação num líder em memória: os lotes ficam pendentes até o commit (ninguém os vê antes) e as
+    leituras da própria sessão (reavaliar_fila) enxergam o estado comitado + os pendentes.
+    Cada chamada custa uma ida ao líder (latência injetada).
+    """
+
+    def __init__(self, backend, lider):
+        self.backend = backend
+        self.lider = lider
+        self._lotes = []
+
+    def _estado(self):
+        self.backend._rede(self.lider)
+        return self.backend.estados[self.lider]
+
+    def disciplina_por_nome(self, nome):
+        estado = self._estado()
+        with estado.lock:
+            for linha in estado.tabelas['disciplinas'].values():
+                if linha[1] == nome and not linha[3]:
+                    return linha[0], linha[2]
+        return None, None
+
+    def matricula_ativa(self, aluno, disciplina_id):
+        estado = self._estado()
+        with estado.lock:
+            for m in estado.tabelas['matriculas'].values():
+                if m[ALUNO] == aluno and m[DISCIPLINA] == str(disciplina_id) and m[STATUS] != 'REMOVIDA':
+                    return m[0]
+        return None
+
+    def matriculas_ativas_para_remover(self, pares, alunos_todas):
+        estado = self._estado()
+        with estado.lock:
+            disciplinas = {d[0]: d for d in estado.tabelas['disciplinas'].values() if not d[3]}
+            alvos = []
+            for m in estado.tabelas['matriculas'].values():
+                disciplina = disciplinas.get(m[DISCIPLINA])
+                if disciplina is None or m[STATUS] == 'REMOVIDA':
+                    continue
+                if (m[ALUNO], disciplina[1]) in pares or m[ALUNO] in alunos_todas:
+                    alvos.append((m[0], m[ALUNO], disciplina[1], disciplina[0], disciplina[2]))
+            return alvos
+
+    @medir('travar')
+    def travar(self, disciplinas_ids):
+        # Só as listras do processo: não há banco para um advisory lock
+        return TravaDisciplinas(None, disciplinas_ids).adquirir()
+
+    def _visao(self, disciplina_id):
+        """As tabelas da disciplina no estado comitado + os lotes pendentes desta sessão."""
+        estado = self._estado()
+        visao = EstadoLider()
+        with estado.lock:
+            visao.tabelas['disciplinas'] = {d[0]: d for d in estado.tabelas['disciplinas'].values() if d[0] == str(disciplina_id)}
+            visao.tabelas['matriculas'] = {m[0]: m for m in estado.tabelas['matriculas'].values() if m[DISCIPLINA] == str(disciplina_id)}
+        for lote, forcar in self._lotes:
+            visao.aplicar(lote, forcar)
+        return visao
+
+    def vagas_disponiveis(self, disciplina_id):
+        # Sem contador em memória: conta a fila (a trava de listras já serializa as matrículas da disciplina)
+        visao = self._visao(disciplina_id)
+        disciplina = visao.tabelas['disciplinas'].get(str(disciplina_id))
+        if disciplina is None:
+            return None
+        fila = visao.fila(disciplina_id)
+        return disciplina[2] - sum(1 for m in fila if m[STATUS] == 'ACEITA'), len(fila)
+
+    @medir('reavaliar_fila')
+    def reavaliar_fila(self, disciplina_id, vagas_totais, versao):
+        """Equivalente ao UPDATE com ROW_NUMBER() de reavaliar_posicao_sql, sobre o estado desta sessão."""
+        visao = self._visao(disciplina_id)
+        mudancas, lote = [], novo_lote()
+        for posicao, m in enumerate(visao.fila(disciplina_id), start=1):
+            status_novo = 'ACEITA' if posicao <= vagas_totais else 'REJEITADA'
+            if m[STATUS] != status_novo:
+                mudancas.append((m[0], m[ALUNO], status_novo, m[TIMESTAMP], m[STATUS], posicao))
+                lote['status'].append((m[0], status_novo, versao))
+        self._lotes.append((lote, True))
+        return mudancas
+
+    def aplicar_lote(self, lote):
+        self.backend._rede(self.lider)
+        self._lotes.append((lote, False))
+
+    @medir('comitar_e_replicar')
+    def comitar_e_replicar(self, lote, descricao):
+        estado = self._estado()
+        with estado.lock:
+            for pendente, forcar in self._lotes:
+                estado.aplicar(pendente, forcar)
+        self._lotes = []
+        return self.backend.replicar(self.lider, lote, descricao)
+
+    def desfazer(self):
+        self._lotes = []
+
+    def fechar(self):
+        self._lotes = []
+
+
+class BackendMemoria:
+    """
+    Líderes simulados em memória, para testes e benchmarks sem PostgreSQL.
+    - latencia: segundos por ida a um líder (padrão para todos); definir_latencia(lider, s) ajusta um líder.
+    - particionar(*lideres): os líderes ficam inacessíveis (ConnectionError / sessão None, como um líder offline);
+      cortar(a, b): só a replicação e a sincronização entre os dois param. reconectar() desfaz ambos.
+    - A replicação é síncrona para os peers alcançáveis; para os demais o lote fica pendente (como na outbox)
+      até entregar_pendentes().
+    """
+
+    modos_sync = ('incremental', 'completo')
+
+    def __init__(self, lideres=None, latencia=0.0):
+        self.lideres = list(lideres or ALL_SERVERS)
+        self.estados = {lider: EstadoLider() for lider in self.lideres}
+        self.latencia = latencia
+        self.latencias = {}
+        self.particionados = set()
+        self.cortes = set()
+        self.pendentes = {}
+        self._lock = threading.Lock()
+        self.idas = {}
+
+    # --- Rede simulada ---
+
+    def definir_latencia(self, lider, segundos):
+        self.latencias[lider] = segundos
+
+    def particionar(self, *lideres):
+        self.particionados.update(lideres)
+
+    def cortar(self, lider_a, lider_b):
+        self.cortes.add(frozenset((lider_a, lider_b)))
+
+    def reconectar(self, *lideres):
+        """Sem argumentos desfaz todas as partições e cortes."""
+        if not lideres:
+            self.particionados.clear()
+            self.cortes.clear()
+            return
+        self.particionados.difference_update(lideres)
+        self.cortes = {corte for corte in self.cortes if not corte & set(lideres)}
+
+    def alcancavel(self, lider, origem=None):
+        if lider in self.particionados or origem in self.particionados:
+            return False
+        return origem is None or frozenset((lider, origem)) not in self.cortes
+
+    def _rede(self, lider, origem=None):
+        if not self.alcancavel(lider, origem):
+            raise ConnectionError(f"líder {lider} inacessível (partição no backend em memória)")
+        with self._lock:
+            self.idas[lider] = self.idas.get(lider, 0) + 1
+        espera = self.latencias.get(lider, self.latencia)
+        if espera > 0:
+            time.sleep(espera)
+
+    # --- Operações ---
+
+    def criar_disciplina(self, nome, vagas_totais):
+        """Atalho de teste: a disciplina em todos os líderes alcançáveis (o restante recebe no heal)."""
+        import uuid
+        from app.hlc import agora_hlc
+        lote = novo_lote()
+        disciplina_id = str(uuid.uuid4())
+        lote['disciplinas'].append((disciplina_id, nome, vagas_totais, False, agora_hlc()))
+        for lider in self.lideres:
+            if self.alcancavel(lider):
+                with self.estados[lider].lock:
+                    self.estados[lider].aplicar(lote)
+        return disciplina_id
+
+    def abrir_sessao(self, lider):
+        return SessaoMemoria(self, lider) if self.alcancavel(lider) else None
+
+    def ler_fila(self, lider, disciplina_id):
+        with medir('ler_fila', lider):
+            self._rede(lider)
+            estado = self.estados[lider]
+            with estado.lock:
+                fila = estado.fila(disciplina_id)
+        observar_hlc(max((m[VERSAO] for m in fila), default=None))
+        return [(m[0], m[ALUNO], m[TIMESTAMP], m[STATUS]) for m in fila]
+
+    def replicar(self, origem, lote, descricao="lote"):
+        resultados = {}
+        for destino in self.lideres:
+            if destino == origem:
+                continue
+            with self._lock:
+                self.pendentes.setdefault((origem, destino), []).append(lote)
+            resultados[destino] = self._entregar(origem, destino)
+        return resultados
+
+    def _entregar(self, origem, destino):
+        with medir('replicar', destino):
+            try:
+                self._rede(destino, origem)
+            except ConnectionError:
+                return False
+            with self._lock:
+                lotes = self.pendentes.pop((origem, destino), [])
+            with self.estados[destino].lock:
+                # Como na outbox: lote com status de uma matrícula que o destino não tem continua pendente
+                sem_base = [lote for lote in lotes if status_sem_base(lote, self.estados[destino].aplicar(lote))]
+            if sem_base:
+                with self._lock:
+                    self.pendentes.setdefault((origem, destino), [])[:0] = sem_base
+            return not sem_base
+
+    def entregar_pendentes(self):
+        """Tenta entregar os lotes pendentes (peers que voltaram). Retorna quantos pares origem->destino seguem pendentes."""
+        for origem, destino in list(self.pendentes):
+            self._entregar(origem, destino)
+        return len(self.pendentes)
+
+    # --- Sincronização (handles = id do líder) ---
+
+    def conectar(self, lider):
+        return lider if self.alcancavel(lider) else None
+
+    def liberar(self, lider):
+        pass
+
+    def versoes(self, lider, tabela, desde=None, ids=None):
+        self._rede(lider)
+        estado = self.estados[lider]
+        with estado.lock:
+            linhas = estado.tabelas[tabela]
+            if ids is not None:
+                return {i: (linhas[i][VERSAO],) for i in map(str, ids) if i in linhas}
+            return {i: (l[VERSAO],) for i, l in linhas.items() if desde is None or l[VERSAO] > desde}
+
+    def ids_deletados(self, lider, tabela_tombstone, ids=None):
+        self._rede(lider)
+        estado = self.estados[lider]
+        with estado.lock:
+            deletados = set(estado.tabelas[tabela_tombstone])
+        return deletados if ids is None else deletados & set(map(str, ids))
+
+    def copiar_linhas(self, destino, origem, tabela, ids):
+        try:
+            self._rede(origem, destino)
+            self._rede(destino)
+        except ConnectionError as e:
+            print(f"❌ ERRO durante o merge da tabela '{tabela}': {e}")
+            return False
+        with self.estados[origem].lock:
+            linhas = [self.estados[origem].tabelas[tabela][i] for i in map(str, ids) if i in self.estados[origem].tabelas[tabela]]
+        estado = self.estados[destino]
+        with estado.lock:
+            for linha in linhas:
+                estado._upsert(tabela, linha)
+        return True
+
+    def resumo_tabelas(self, lider):
+        self._rede(lider)
+        estado = self.estados[lider]
+        with estado.lock:
+            return {tabela: (len(linhas), max((linha[VERSAO] for linha in linhas.values()), default=None))
+                    for tabela, linhas in estado.tabelas.items()}
+
+    def preparar_sincronizacao(self, lider):
+        pass
+
+    def carregar_watermarks(self, lider, peer_id, direcao):
+        return {tabela: wm for (peer, tabela, d), wm in self.estados[lider].watermarks.items() if peer == peer_id and d == direcao}
+
+    def salvar_watermark(self, lider, peer_id, tabela, direcao, watermark):
+        chave = (peer_id, tabela, direcao)
+        atual = self.estados[lider].watermarks.get(chave)
+        self.estados[lider].watermarks[chave] = watermark if atual is None else max(atual, watermark)
+
+    def idas_por_lider(self):
+        with self._lock:
+            return dict(self.idas)
+
+    def estado_matriculas(self, lider, disciplinas_ids):
+        """Lido direto do estado (sem passar pela rede simulada): serve para observar a convergência mesmo em partição."""
+        disciplinas_ids = set(map(str, disciplinas_ids))
+        estado = self.estados[lider]
+        with estado.lock:
+            return {i: m[STATUS] for i, m in estado.tabelas['matriculas'].items() if m[DISCIPLINA] in disciplinas_ids}
+
+    def resumo(self):
+        """Contagens por líder, para conferir a convergência."""
+        resumo = {}
+        for lider, estado in self.estados.items():
+            with estado.lock:
+                matriculas = estado.tabelas['matriculas'].values()
+                resumo[lider] = {
+                    'disciplinas': len(estado.tabelas['disciplinas']),
+                    'matriculas': len(matriculas),
+                    'aceitas': sum(1 for m in matriculas if m[STATUS] == 'ACEITA'),
+                    'tombstones': len(estado.tabelas['deleted_matriculas']) + len(estado.tabelas['deleted_disciplinas']),
+                }
+        return resumo
+
+
+_backend_padrao = None
+
+
+def backend_padrao():
+    global _backend_padrao
+    if _backend_padrao is None:
+        _backend_padrao = BackendPostgres()
+    return _backend_padrao
@@ -0,0 +1,286 @@
+import io
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from app.config import (
+    LOCAL_SERVERS, REPLICACAO_MODO, BENCHMARK_CONVERGENCIA_PRAZO, BENCHMARK_CONVERGENCIA_INTERVALO
+)
+
+# Cargas de ponta a ponta sobre as operações reais (_processar_matricula, remover_aluno, sincronizar_ao_iniciar),
+# contra os líderes PostgreSQL ou o backend em memória (app/armazenamento.py). O resultado é um dicionário
+# estável (mesmas chaves, valores arredondados) para ser salvo em JSON e comparado entre versões.
+CARGAS = {
+    'estouro': "todos os clientes disputam as vagas de UMA disciplina",
+    'uniforme': "matrículas espalhadas de forma uniforme entre as disciplinas",
+    'rotatividade': "carga inicial e depois remoções intercaladas com novas matrículas (promoções da fila)",
+    'particao': "matrículas com o último líder particionado, depois reconexão e heal",
+}
+
+
+def _lideres_entrada(backend, entrada, excluir=()):
+    lideres = [l for l in backend.lideres if l not in excluir]
+    if entrada == 'todos':
+        return lideres
+    return [entrada or LOCAL_SERVERS[0]]
+
+
+def _planejar(carga, operacoes, nomes, lideres, semente):
+    """Lista de fases [(nome, [(operação, líder, aluno, disciplina)])]; alunos nunca se repetem na mesma disciplina."""
+    aleatorio = random.Random(semente)
+    lider = lambda i: lideres[i % len(lideres)]
+    if carga == 'estouro':
+        return [('estouro', [('matricular', lider(i), f"aluno_{i}", nomes[0]) for i in range(operacoes)])]
+    if carga == 'rotatividade':
+        iniciais = operacoes // 2
+        carga_inicial = [('matricular', lider(i), f"aluno_{i}", aleatorio.choice(nomes)) for i in range(iniciais)]
+        removidos = aleatorio.sample(carga_inicial, min(iniciais, (operacoes - iniciais) // 2))
+        # A remoção entra pelo mesmo líder da matrícula: não depende de a replicação já ter chegado aos outros
+        rotatividade = [('remover', origem, aluno, nome) for _, origem, aluno, nome in removidos]
+        rotatividade += [('matricular', lider(i), f"aluno_{i}", aleatorio.choice(nomes))
+                         for i in range(iniciais, operacoes - len(removidos))]
+        aleatorio.shuffle(rotatividade)
+        return [('carga_inicial', carga_inicial), ('rotatividade', rotatividade)]
+    tarefas = [('matricular', lider(i), f"aluno_{i}", aleatorio.choice(nomes)) for i in range(operacoes)]
+    return [('particionada' if carga == 'particao' else 'uniforme', tarefas)]
+
+
+def _executar_fase(backend, nome, tarefas, clientes):
+    from app.matricular import _processar_matricula
+    from app.remover import remover_aluno
+    from app.servidor_http import LatenciaEndpoints
+    from app.instrumentacao import zerar_metricas, metricas
+    latencias = LatenciaEndpoints(amostras=None)
+    erros, respostas = {}, {'aceita': 0, 'rejeitada': 0, 'removida': 0, 'promocoes': 0}
+
+    def executar(tarefa):
+        operacao, lider, aluno, disciplina = tarefa
+        inicio = time.monotonic()
+        if operacao == 'matricular':
+            resultado = _processar_matricula(lider, aluno, disciplina, backend=backend)
+        else:
+            resultado = remover_aluno(lider, aluno, disciplina, backend=backend)
+        latencias.registrar(operacao, time.monotonic() - inicio, erro=bool(resultado.get('erro')))
+        return resultado
+
+    # Os spans (app/instrumentacao.py) passam a contar só esta fase
+    zerar_metricas()
+    idas_antes = sum(backend.idas_por_lider().values())
+    inicio = time.monotonic()
+    with ThreadPoolExecutor(max_workers=clientes) as executor:
+        resultados = list(executor.map(executar, tarefas))
+    segundos = time.monotonic() - inicio
+    idas = sum(backend.idas_por_lider().values()) - idas_antes
+
+    for resultado in resultados:
+        if resultado.get('erro'):
+            erros[resultado['erro']] = erros.get(resultado['erro'], 0) + 1
+        elif 'removida' in resultado:
+            respostas['removida'] += 1
+            respostas['promocoes'] += resultado['promocoes']
+        else:
+            respostas['aceita' if resultado['status'] == 'ACEITA' else 'rejeitada'] += 1
+    return {
+        'fase': nome,
+        'operacoes': len(tarefas),
+        'segundos': round(segundos, 3),
+        'por_segundo': round(len(tarefas) / segundos, 1) if segundos else 0.0,
+        'latencia': latencias.resumo(),
+        # Comandos enviados aos líderes por operação, incluindo a replicação disparada por ela
+        'idas_por_operacao': round(idas / len(tarefas), 2) if tarefas else 0.0,
+        # Onde o tempo foi gasto: conexão, leitura global, reavaliação, commit/replicação...
+        'etapas': metricas()['spans'],
+        'respostas': respostas,
+        'erros': erros,
+    }
+
+
+def _divergentes(estados):
+    """Matrículas cujo status difere entre os líderes (ou que faltam em algum)."""
+    ids = set().union(*estados)
+    return sum(1 for i in ids if len({estado.get(i) for estado in estados}) > 1)
+
+
+def _replicacao_quieta(backend, memoria):
+    """True quando não há mais nada a entregar (None: não dá para saber, como na captura)."""
+    if memoria:
+        return not backend.pendentes
+    if REPLICACAO_MODO == 'outbox':
+        from app.outbox import pendencias_outbox
+        return not any(pendencias_outbox(lider) for lider in backend.lideres)
+    return None
+
+
+def _aguardar_convergencia(backend, disciplinas_ids, propagar=None, quieta=None, prazo=BENCHMARK_CONVERGENCIA_PRAZO):
+    """
+    Compara os líderes até todos terem as mesmas matrículas com os mesmos status.
+    Retorna (True, estado) ou (False, divergentes) quando a replicação já entregou tudo e ainda há
+    divergência (só o heal resolve) ou quando o prazo acaba.
+    """
+    inicio = time.monotonic()
+    while True:
+        if propagar:
+            propagar()
+        estados = [backend.estado_matriculas(lider, disciplinas_ids) for lider in backend.lideres]
+        divergentes = None if None in estados else _divergentes(estados)
+        if divergentes == 0:
+            return True, estados[0]
+        if time.monotonic() - inicio > prazo or (divergentes and quieta and quieta()):
+            return False, divergentes
+        time.sleep(BENCHMARK_CONVERGENCIA_INTERVALO)
+
+
+def _heal(backend, motivo, divergentes):
+    from app.sincronizacao import sincronizar_ao_iniciar
+    idas_antes = sum(backend.idas_por_lider().values())
+    inicio = time.monotonic()
+    if motivo == 'particao':
+        backend.reconectar()
+        backend.entregar_pendentes()
+    sincronizar_ao_iniciar(backend=backend)
+    return {'motivo': motivo, 'divergentes_antes': divergentes, 'segundos': round(time.monotonic() - inicio, 3),
+            'idas': sum(backend.idas_por_lider().values()) - idas_antes}
+
+
+def _criar_disciplinas(backend, nomes, vagas, memoria):
+    if memoria:
+        return [backend.criar_disciplina(nome, vagas) for nome in nomes]
+    from app.adicionar_disciplina import _adicionar_disciplina_core
+    ids = [_adicionar_disciplina_core(nome, vagas).get('disciplina_id') for nome in nomes]
+    if REPLICACAO_MODO == 'outbox':
+        # Os outros líderes de entrada precisam conhecer as disciplinas antes da carga
+        from app.outbox import drenar_outbox
+        drenar_outbox()
+    return ids
+
+
+def _iniciar_propagacao():
+    """Nos líderes PostgreSQL a convergência depende do expedidor da outbox ou da captura, como no menu."""
+    if REPLICACAO_MODO == 'outbox':
+        from app.outbox import iniciar_expedidor
+        iniciar_expedidor()
+    elif REPLICACAO_MODO == 'captura':
+        from app.captura_mudancas import iniciar_captura
+        iniciar_captura()
+
+
+def _drenar_entradas(lideres):
+    """O expedidor do processo só drena a outbox de LOCAL_SERVERS[0]; com entrada 'todos' as demais são drenadas aqui."""
+    from app.outbox import drenar_outbox
+    for lider in lideres:
+        drenar_outbox(lider)
+
+
+def _parar_propagacao():
+    if REPLICACAO_MODO == 'outbox':
+        from app.outbox import parar_expedidor
+        parar_expedidor()
+    elif REPLICACAO_MODO == 'captura':
+        from app.captura_mudancas import parar_captura
+        parar_captura()
+
+
+def executar_benchmark(carga, clientes=8, operacoes=200, disciplinas=4, vagas=10, memoria=False,
+                       latencia=0.0, entrada=None, semente=42):
+    """
+    Roda a carga 'carga' (ver CARGAS) com 'clientes' threads e 'operacoes' operações.
+    - memoria=True: BackendMemoria com 'latencia' segundos por ida a um líder; senão os líderes PostgreSQL
+      (as disciplinas criadas são removidas no fim).
+    - entrada: líder de entrada (padrão LOCAL_SERVERS[0]) ou 'todos' (clientes espalhados entre os líderes).
+    - semente: o mesmo valor gera a mesma sequência de operações, para comparar versões.
+    Por fase: vazão, p50/p95/p99 por operação, idas aos líderes por operação e erros. Depois da carga:
+    matrículas que a replicação sozinha deixou divergentes, os heals (o da carga 'particao' e, se sobrou
+    divergência, um heal de reparo), o tempo do fim da carga até os líderes ficarem iguais e ACEITA acima das vagas.
+    """
+    from app.armazenamento import BackendMemoria, backend_padrao
+    if carga not in CARGAS:
+        return {'erro': f"carga desconhecida '{carga}' (use {', '.join(CARGAS)})"}
+    backend = BackendMemoria(latencia=latencia) if memoria else backend_padrao()
+    if carga == 'particao' and (not memoria or len(backend.lideres) < 2):
+        return {'erro': "a carga 'particao' precisa do backend em memória (--memoria) e de pelo menos 2 líderes"}
+
+    particionado = backend.lideres[-1] if carga == 'particao' else None
+    lideres = _lideres_entrada(backend, entrada, excluir=(particionado,))
+    nomes = [f"bench_{uuid.uuid4().hex[:6]}_{i}" for i in range(1 if carga == 'estouro' else disciplinas)]
+    resultado = {
+        'carga': carga, 'backend': 'memoria' if memoria else 'postgres', 'replicacao': None if memoria else REPLICACAO_MODO,
+        'parametros': {'clientes': clientes, 'operacoes': operacoes, 'disciplinas': len(nomes), 'vagas': vagas,
+                       'latencia_s': latencia if memoria else None, 'lideres_entrada': lideres, 'semente': semente},
+        'fases': [], 'heals': [], 'divergentes_apos_replicacao': None, 'convergencia_s': None, 'aceitas_acima_das_vagas': None,
+    }
+    # As mensagens de cada operação são descartadas: centenas de threads imprimindo distorcem a medição
+    with redirect_stdout(io.StringIO()):
+        try:
+            if not memoria:
+                _iniciar_propagacao()
+            disciplinas_ids = _criar_disciplinas(backend, nomes, vagas, memoria)
+            if particionado:
+                backend.particionar(particionado)
+            for nome, tarefas in _planejar(carga, operacoes, nomes, lideres, semente):
+                resultado['fases'].append(_executar_fase(backend, nome, tarefas, clientes))
+
+            fim_carga = time.monotonic()
+            ids = [i for i in disciplinas_ids if i]
+            if particionado:
+                estados = [backend.estado_matriculas(lider, ids) for lider in backend.lideres]
+                resultado['heals'].append(_heal(backend, 'particao', _divergentes(estados)))
+
+            propagar = None
+            if not memoria and REPLICACAO_MODO == 'outbox':
+                propagar = lambda: _drenar_entradas([l for l in lideres if l != LOCAL_SERVERS[0]])
+            quieta = lambda: _replicacao_quieta(backend, memoria)
+            convergiu, estado = _aguardar_convergencia(backend, ids, propagar, quieta)
+            resultado['divergentes_apos_replicacao'] = 0 if convergiu else estado
+            if not convergiu:
+                # A replicação entregou tudo e os líderes seguem diferentes: mede quanto o heal leva para reparar
+                resultado['heals'].append(_heal(backend, 'divergencia', estado))
+                convergiu, estado = _aguardar_convergencia(backend, ids, propagar, quieta)
+            if convergiu:
+                resultado['convergencia_s'] = round(time.monotonic() - fim_carga, 3)
+                aceitas = sum(1 for status in estado.values() if status == 'ACEITA')
+                resultado['aceitas_acima_das_vagas'] = max(0, aceitas - vagas * len(nomes))
+        finally:
+            if not memoria:
+                from app.benchmark_contencao import _limpar
+                _limpar(nomes)
+                _parar_propagacao()
+    return resultado
+
+
+def exibir_benchmark(resultado):
+    from prettytable import PrettyTable
+    parametros = resultado['parametros']
+    print(f"\n--- Benchmark '{resultado['carga']}' ({resultado['backend']}, {parametros['clientes']} clientes, "
+          f"{parametros['operacoes']} operações, entrada: {', '.join(parametros['lideres_entrada'])}) ---")
+    table = PrettyTable()
+    table.field_names = ["Fase", "Operação", "Qtd", "Ops/s (fase)", "p50 (ms)", "p95 (ms)", "p99 (ms)", "Idas/op", "Erros"]
+    table.align = "l"
+    for fase in resultado['fases']:
+        for operacao, dados in fase['latencia'].items():
+            table.add_row([fase['fase'], operacao, dados['requisicoes'], fase['por_segundo'], dados['p50_ms'],
+                           dados['p95_ms'], dados['p99_ms'], fase['idas_por_operacao'], dados['erros']])
+    print(table)
+    table = PrettyTable()
+    table.field_names = ["Fase", "Etapa", "Líder", "N", "Média (ms)", "p95 (ms)"]
+    table.align = "l"
+    for fase in resultado['fases']:
+        for etapa, por_lider in fase['etapas'].items():
+            for lider, dados in por_lider.items():
+                table.add_row([fase['fase'], etapa, lider, dados['n'], dados['media_ms'], dados['p95_ms']])
+    print("Tempo por etapa (p95 pelo limite da faixa do histograma):")
+    print(table)
+    for fase in resultado['fases']:
+        if fase['erros']:
+            print(f"⚠️ Erros em '{fase['fase']}': " + ", ".join(f"{erro} ({n})" for erro, n in fase['erros'].items()))
+    if resultado['divergentes_apos_replicacao']:
+        print(f"⚠️ {resultado['divergentes_apos_replicacao']} matrícula(s) seguiam divergentes depois da replicação.")
+    for heal in resultado['heals']:
+        origem = "na partição" if heal['motivo'] == 'particao' else "após a replicação"
+        print(f"🔁 Heal: {heal['divergentes_antes']} matrícula(s) divergentes {origem}, "
+              f"{heal['segundos']}s e {heal['idas']} idas para reconciliar.")
+    if resultado['convergencia_s'] is None:
+        print("❌ Os líderes não convergiram (nem depois do heal).")
+    else:
+        print(f"✅ Líderes convergiram {resultado['convergencia_s']}s após a carga. "
+              f"ACEITA acima das vagas: {resultado['aceitas_acima_das_vagas']}.")
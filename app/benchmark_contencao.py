@@ -0,0 +1,137 @@
+import io
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from app import coordenacao
+from app.config import ALL_SERVERS, LOCAL_SERVERS, REPLICACAO_MODO
+from app.conexoes import connect_to_db, liberar_conexao
+from app.hlc import agora_hlc
+
+
+def _aceitas_no_lider(servidor_id, disciplinas_ids):
+    conn = connect_to_db(servidor_id)
+    if not conn:
+        return {}
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT disciplina_id, COUNT(*) FROM matriculas
+            WHERE disciplina_id = ANY(%s::uuid[]) AND status = 'ACEITA'
+            GROUP BY disciplina_id
+        """, (list(disciplinas_ids),))
+        return dict(cursor.fetchall())
+    finally:
+        conn.rollback()
+        cursor.close()
+        liberar_conexao(conn)
+
+
+def _limpar(nomes):
+    """Entrega o que ficou na outbox e remove (soft delete) as disciplinas do benchmark em todos os líderes."""
+    from app.remover_disciplina import remover_disciplina_no_servidor
+    if REPLICACAO_MODO == 'outbox':
+        from app.outbox import drenar_outbox
+        drenar_outbox()
+    timestamp_agora = agora_hlc()
+    for servidor_id in ALL_SERVERS:
+        for nome in nomes:
+            remover_disciplina_no_servidor(servidor_id, nome, timestamp_agora)
+
+
+def _rodada(ativa, disciplinas_quentes, vagas, matriculas_por_disciplina, clientes, lider_entrada):
+    from app.adicionar_disciplina import _adicionar_disciplina_core
+    from app.matricular import _processar_matricula
+    prefixo = f"bench_{uuid.uuid4().hex[:6]}"
+    nomes = [f"{prefixo}_{i}" for i in range(disciplinas_quentes)]
+    ids = {}
+    for nome in nomes:
+        ids[nome] = _adicionar_disciplina_core(nome, vagas).get('disciplina_id')
+
+    # Matrículas das disciplinas intercaladas: todos os clientes disputam todas as disciplinas ao mesmo tempo
+    tarefas = [(nome, f"aluno_{j}") for j in range(matriculas_por_disciplina) for nome in nomes]
+    por_disciplina = {nome: {'latencias': [], 'respostas_aceita': 0, 'erros': 0, 'fim': 0.0} for nome in nomes}
+
+    def matricular(tarefa):
+        nome, aluno = tarefa
+        inicio = time.monotonic()
+        resultado = _processar_matricula(lider_entrada, aluno, nome)
+        fim = time.monotonic()
+        dados = por_disciplina[nome]
+        dados['latencias'].append(fim - inicio)
+        dados['fim'] = max(dados['fim'], fim)
+        if resultado.get('erro'):
+            dados['erros'] += 1
+        elif resultado.get('status') == 'ACEITA':
+            dados['respostas_aceita'] += 1
+
+    coordenacao.COORDENACAO_ATIVA = ativa
+    inicio = time.monotonic()
+    with ThreadPoolExecutor(max_workers=clientes) as executor:
+        list(executor.map(matricular, tarefas))
+    duracao = time.monotonic() - inicio
+
+    aceitas = _aceitas_no_lider(lider_entrada, [i for i in ids.values() if i])
+    linhas = []
+    for nome in nomes:
+        dados = por_disciplina[nome]
+        latencias = sorted(dados['latencias'])
+        segundos = dados['fim'] - inicio
+        linhas.append({
+            'disciplina': nome,
+            'matriculas': len(latencias),
+            'por_segundo': round(len(latencias) / segundos, 1) if segundos else 0.0,
+            'p50_ms': round(latencias[len(latencias) // 2] * 1000, 1) if latencias else None,
+            'p95_ms': round(latencias[min(len(latencias) - 1, int(0.95 * len(latencias)))] * 1000, 1) if latencias else None,
+            # Respostas "ACEITA" além das vagas = alunos que ouviram sim e depois foram rebaixados
+            'aceitas_respondidas': dados['respostas_aceita'],
+            'aceitas_no_banco': aceitas.get(ids[nome], 0),
+            'vagas': vagas,
+            'erros': dados['erros'],
+        })
+    return {'coordenacao': ativa, 'segundos': round(duracao, 2),
+            'por_segundo': round(len(tarefas) / duracao, 1) if duracao else 0.0, 'disciplinas': linhas}, nomes
+
+
+def benchmark_contencao(disciplinas_quentes=2, vagas=5, matriculas_por_disciplina=40, clientes=4, lider_entrada=None):
+    """
+    Disputa por vagas: 'clientes' threads matriculam alunos em 'disciplinas_quentes' disciplinas ao mesmo
+    tempo, primeiro sem e depois com a coordenação por disciplina (app/coordenacao.py).
+    Por disciplina: vazão, latência, quantas respostas ACEITA os clientes receberam e quantas ACEITA
+    ficaram no banco, comparadas às vagas (acima delas = overbooking / rebaixamentos).
+    """
+    lider_entrada = lider_entrada or LOCAL_SERVERS[0]
+    original = coordenacao.COORDENACAO_ATIVA
+    rodadas, criadas = [], []
+    try:
+        # As mensagens de cada matrícula são descartadas: centenas de threads imprimindo distorcem a medição
+        with redirect_stdout(io.StringIO()):
+            for ativa in (False, True):
+                rodada, nomes = _rodada(ativa, disciplinas_quentes, vagas, matriculas_por_disciplina, clientes, lider_entrada)
+                rodadas.append(rodada)
+                criadas += nomes
+    finally:
+        coordenacao.COORDENACAO_ATIVA = original
+        with redirect_stdout(io.StringIO()):
+            _limpar(criadas)
+    return {'lider_entrada': lider_entrada, 'clientes': clientes, 'rodadas': rodadas,
+            'travas': coordenacao.estatisticas_coordenacao()}
+
+
+def exibir_benchmark_contencao(resultado):
+    from prettytable import PrettyTable
+    print(f"\n--- Benchmark de Contenção (Líder {resultado['lider_entrada']}, {resultado['clientes']} clientes) ---")
+    for rodada in resultado['rodadas']:
+        estado = "COM coordenação por disciplina" if rodada['coordenacao'] else "SEM coordenação"
+        print(f"\n{estado}: {rodada['por_segundo']} matrículas/s no total ({rodada['segundos']}s)")
+        table = PrettyTable()
+        table.field_names = ["Disciplina", "Matrículas", "Matr./s", "p50 (ms)", "p95 (ms)",
+                             "ACEITA respondidas", "ACEITA no banco", "Vagas", "Erros"]
+        table.align = "l"
+        for linha in rodada['disciplinas']:
+            table.add_row([linha['disciplina'], linha['matriculas'], linha['por_segundo'], linha['p50_ms'], linha['p95_ms'],
+                           linha['aceitas_respondidas'], linha['aceitas_no_banco'], linha['vagas'], linha['erros']])
+        print(table)
+    travas = resultado['travas']
+    print(f"Travas: {travas['aquisicoes']} aquisições, {travas['esperas']} com espera, "
+          f"{travas['segundos_espera']:.2f}s esperando no total.")
@@ -0,0 +1,399 @@
+import atexit
+import select
+import struct
+import threading
+import psycopg2
+from psycopg2.extras import LogicalReplicationConnection
+from app.config import (
+    SERVERS, ALL_SERVERS, LOCAL_SERVERS, CONNECT_TIMEOUT, CAPTURA_PUBLICACAO, CAPTURA_PREFIXO_SLOT,
+    CAPTURA_ESPERA, CAPTURA_LOTE_MAXIMO, CAPTURA_BACKOFF_INICIAL, CAPTURA_BACKOFF_MAXIMO,
+)
+from app.conexoes import connect_to_db, liberar_conexao
+from app.saude_lideres import circuito_aberto
+from app.replicacao import COLUNAS_MATRICULAS, COLUNAS_DISCIPLINAS, novo_lote, lote_vazio, aplicar_lote
+from app.instrumentacao import medir
+
+TABELAS_CAPTURADAS = ('disciplinas', 'matriculas', 'deleted_disciplinas', 'deleted_matriculas')
+
+
+def nome_slot(origem, destino):
+    return f"{CAPTURA_PREFIXO_SLOT}_{origem}_para_{destino}".lower()
+
+
+def nome_origem(origem):
+    """Origem de replicação com que o consumidor marca, no destino, o que aplicou vindo de 'origem'."""
+    return f"{CAPTURA_PREFIXO_SLOT}_{origem}".lower()
+
+
+def preparar_captura(servidor_local):
+    """
+    Garante no líder local a publicação das tabelas replicadas e um slot lógico (pgoutput) por peer.
+    O slot guarda o WAL a partir do último ponto confirmado, então um peer offline recebe tudo ao voltar.
+    """
+    conn = connect_to_db(servidor_local)
+    if not conn:
+        return False
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT 1 FROM pg_publication WHERE pubname = %s", (CAPTURA_PUBLICACAO,))
+        if not cursor.fetchone():
+            cursor.execute(f"CREATE PUBLICATION {CAPTURA_PUBLICACAO} FOR TABLE {', '.join(TABELAS_CAPTURADAS)}")
+            conn.commit()
+        for destino in ALL_SERVERS:
+            if destino == servidor_local:
+                continue
+            slot = nome_slot(servidor_local, destino)
+            cursor.execute("SELECT 1 FROM pg_replication_slots WHERE slot_name = %s", (slot,))
+            if not cursor.fetchone():
+                cursor.execute("SELECT pg_create_logical_replication_slot(%s, 'pgoutput')", (slot,))
+                print(f"🆕 Slot de captura '{slot}' criado no Líder {servidor_local}.")
+            conn.commit()
+        return True
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"❌ Erro ao preparar a captura de mudanças no Líder {servidor_local}: {e}")
+        return False
+    finally:
+        cursor.close()
+        liberar_conexao(conn)
+
+
+def remover_captura(servidor_local=None):
+    """Remove slots e publicação. Slots abandonados retêm WAL indefinidamente no líder."""
+    servidor_local = servidor_local or LOCAL_SERVERS[0]
+    parar_captura()
+    conn = connect_to_db(servidor_local)
+    if not conn:
+        return
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT pg_drop_replication_slot(slot_name) FROM pg_replication_slots WHERE slot_name LIKE %s AND NOT active",
+            (f"{CAPTURA_PREFIXO_SLOT}_{servidor_local.lower()}_para_%",),
+        )
+        cursor.execute(f"DROP PUBLICATION IF EXISTS {CAPTURA_PUBLICACAO}")
+        conn.commit()
+        print(f"🧹 Slots e publicação de captura removidos do Líder {servidor_local}.")
+    finally:
+        cursor.close()
+        liberar_conexao(conn)
+
+
+class DecodificadorPgoutput:
+    """
+    Decodifica as mensagens binárias do plugin pgoutput (protocolo v1) em eventos:
+    ('begin',), ('origem', nome), ('commit', lsn_final) e ('mudanca', tabela, operacao, {coluna: valor_texto}).
+    Mantém o cache de relações ('R') que o servidor envia antes da primeira mudança de cada tabela.
+    """
+
+    def __init__(self):
+        self.relacoes = {}
+
+    @staticmethod
+    def _string(dados, pos):
+        fim = dados.index(b'\x00', pos)
+        return dados[pos:fim].decode(), fim + 1
+
+    @staticmethod
+    def _tupla(dados, pos, colunas):
+        (quantidade,) = struct.unpack_from('!h', dados, pos)
+        pos += 2
+        valores = {}
+        for indice in range(quantidade):
+            tipo = dados[pos:pos + 1]
+            pos += 1
+            if tipo == b'n':
+                valores[colunas[indice]] = None
+            elif tipo == b't':
+                (tamanho,) = struct.unpack_from('!i', dados, pos)
+                pos += 4
+                valores[colunas[indice]] = dados[pos:pos + tamanho].decode()
+                pos += tamanho
+            # b'u' (TOAST inalterado) não ocorre nestas tabelas: colunas pequenas
+        return valores, pos
+
+    def decodificar(self, dados):
+        tipo = dados[:1]
+        if tipo == b'B':
+            return ('begin',)
+        if tipo == b'C':
+            _, _, lsn_final, _ = struct.unpack_from('!bqqq', dados, 1)
+            return ('commit', lsn_final)
+        if tipo == b'O':
+            # Enviada logo após o 'B' quando a transação foi gravada numa sessão com origem de replicação
+            nome, _ = self._string(dados, 9)
+            return ('origem', nome)
+        if tipo == b'R':
+            (relid,) = struct.unpack_from('!I', dados, 1)
+            pos = 5
+            _, pos = self._string(dados, pos)
+            tabela, pos = self._string(dados, pos)
+            pos += 1  # replica identity
+            (quantidade,) = struct.unpack_from('!h', dados, pos)
+            pos += 2
+            colunas = []
+            for _ in range(quantidade):
+                pos += 1  # flags
+                nome, pos = self._string(dados, pos)
+                colunas.append(nome)
+                pos += 8  # oid do tipo + typmod
+            self.relacoes[relid] = (tabela, colunas)
+            return None
+        if tipo in (b'I', b'U', b'D'):
+            (relid,) = struct.unpack_from('!I', dados, 1)
+            tabela, colunas = self.relacoes[relid]
+            pos = 5
+            marcador = dados[pos:pos + 1]
+            if tipo == b'U' and marcador in (b'K', b'O'):
+                _, pos = self._tupla(dados, pos + 1, colunas)
+                marcador = dados[pos:pos + 1]
+            valores, _ = self._tupla(dados, pos + 1, colunas)
+            operacao = {b'I': 'INSERT', b'U': 'UPDATE', b'D': 'DELETE'}[tipo]
+            return ('mudanca', tabela, operacao, valores)
+        # 'Y' (tipo), 'T' (truncate), 'M' (mensagem): irrelevantes aqui
+        return None
+
+
+def adicionar_ao_lote(lote, tabela, operacao, valores):
+    """
+    Converte uma mudança capturada em entrada do lote de replicação (upsert LWW no destino).
+    DELETEs físicos são ignorados: o sistema só faz soft delete + tombstone, que chegam como INSERT/UPDATE.
+    """
+    if operacao == 'DELETE':
+        return False
+    if tabela == 'matriculas':
+        lote['matriculas'].append(tuple(valores[c] for c in COLUNAS_MATRICULAS))
+    elif tabela == 'disciplinas':
+        linha = dict(valores)
+        linha['vagas_totais'] = int(linha['vagas_totais'])
+        linha['is_deleted'] = linha['is_deleted'] == 't' if linha['is_deleted'] is not None else None
+        lote['disciplinas'].append(tuple(linha[c] for c in COLUNAS_DISCIPLINAS))
+    elif tabela == 'deleted_matriculas':
+        lote['tombstones_matriculas'].append((valores['id'], valores['timestamp']))
+    elif tabela == 'deleted_disciplinas':
+        lote['tombstones_disciplinas'].append((valores['id'], valores['timestamp']))
+    else:
+        return False
+    return True
+
+
+def _juntar(destino, origem):
+    for chave, linhas in origem.items():
+        destino[chave].extend(linhas)
+
+
+class MontadorLote:
+    """
+    Agrupa os eventos decodificados por transação e junta as confirmadas num lote para o peer.
+    Transações com origem de captura (aplicadas neste líder por um consumidor vindo de outro peer) são
+    descartadas: quem as gerou já as envia a cada peer pelo próprio slot, e reenviá-las faria a mudança
+    ir e voltar entre os líderes.
+    """
+
+    def __init__(self):
+        self.confirmado, self.transacao = novo_lote(), novo_lote()
+        self.lsn_confirmado = 0
+        self.mudancas = 0
+        self.descartar = False
+        self.descartadas = 0
+
+    def processar(self, evento):
+        if not evento:
+            return
+        if evento[0] == 'begin':
+            self.transacao, self.descartar = novo_lote(), False
+        elif evento[0] == 'origem':
+            self.descartar = evento[1].startswith(CAPTURA_PREFIXO_SLOT.lower())
+        elif evento[0] == 'mudanca':
+            if self.descartar:
+                self.descartadas += 1
+            elif adicionar_ao_lote(self.transacao, *evento[1:]):
+                self.mudancas += 1
+        elif evento[0] == 'commit':
+            _juntar(self.confirmado, self.transacao)
+            self.transacao, self.descartar = novo_lote(), False
+            # Avança mesmo se a transação foi descartada, para o slot liberar o WAL dela
+            self.lsn_confirmado = evento[1]
+
+    def retirar(self):
+        """Retorna (lote, lsn, mudancas) das transações confirmadas e recomeça o acúmulo."""
+        retirado = (self.confirmado, self.lsn_confirmado, self.mudancas)
+        self.confirmado, self.lsn_confirmado, self.mudancas = novo_lote(), 0, 0
+        return retirado
+
+
+def _conectar_replicacao(servidor_id):
+    config = SERVERS.get(servidor_id)
+    connect_args = {k: v for k, v in config.items() if k != 'tipo'}
+    connect_args['connect_timeout'] = CONNECT_TIMEOUT
+    return psycopg2.connect(connection_factory=LogicalReplicationConnection, **connect_args)
+
+
+class ConsumidorCaptura(threading.Thread):
+    """
+    Lê o slot origem->destino e aplica as transações confirmadas no destino com LWW, numa sessão marcada
+    com a origem de replicação nome_origem(origem): o consumidor do destino reconhece essas transações no
+    WAL e não as devolve (MontadorLote). Transações que chegam juntas são agrupadas num único lote
+    (um round trip). A posição do slot só
+    avança (send_feedback) depois que o destino aceitou o lote; em falha a conexão é refeita com
+    backoff exponencial e o slot reenvia tudo a partir do último ponto confirmado (reaplicar é inofensivo).
+    """
+
+    def __init__(self, origem, destino):
+        super().__init__(name=f"captura-{origem}-{destino}", daemon=True)
+        self.origem = origem
+        self.destino = destino
+        self.slot = nome_slot(origem, destino)
+        self._parar = threading.Event()
+        self.aplicadas = 0
+        self.ultimo_lsn = 0
+        self.ultimo_erro = None
+        self.ecos_descartados = 0
+
+    def parar(self, timeout=5):
+        self._parar.set()
+        self.join(timeout)
+
+    def run(self):
+        backoff = CAPTURA_BACKOFF_INICIAL
+        while not self._parar.is_set():
+            try:
+                self._consumir()
+                backoff = CAPTURA_BACKOFF_INICIAL
+            except (psycopg2.Error, ConnectionError) as e:
+                self.ultimo_erro = str(e).strip().splitlines()[0] if str(e).strip() else type(e).__name__
+                print(f"❌ Captura {self.origem}->{self.destino}: {self.ultimo_erro}. Nova tentativa em {backoff}s.")
+                self._parar.wait(backoff)
+                backoff = min(backoff * 2, CAPTURA_BACKOFF_MAXIMO)
+
+    def _consumir(self):
+        conn = _conectar_replicacao(self.origem)
+        try:
+            cursor = conn.cursor()
+            cursor.start_replication(
+                slot_name=self.slot, decode=False,
+                options={'proto_version': '1', 'publication_names': CAPTURA_PUBLICACAO},
+            )
+            decodificador = DecodificadorPgoutput()
+            montador = MontadorLote()
+            while not self._parar.is_set():
+                mensagem = cursor.read_message()
+                if mensagem is not None:
+                    montador.processar(decodificador.decodificar(mensagem.payload))
+                    if montador.mudancas < CAPTURA_LOTE_MAXIMO:
+                        continue
+                # Sem mensagens pendentes (ou lote cheio): entrega o que já foi confirmado na origem
+                if montador.lsn_confirmado:
+                    lote, lsn_confirmado, mudancas = montador.retirar()
+                    self._entregar(lote, mudancas)
+                    cursor.send_feedback(flush_lsn=lsn_confirmado)
+                    self.ultimo_lsn = lsn_confirmado
+                self.ecos_descartados = montador.descartadas
+                if mensagem is None:
+                    select.select([cursor], [], [], CAPTURA_ESPERA)
+        finally:
+            conn.close()
+
+    def _entregar(self, lote, mudancas):
+        if lote_vazio(lote):
+            return
+        if circuito_aberto(self.destino):
+            raise ConnectionError(f"Líder {self.destino} indisponível (circuito aberto)")
+        conn_destino = connect_to_db(self.destino)
+        if not conn_destino:
+            raise ConnectionError(f"Líder {self.destino} offline")
+        descartar = False
+        cursor = conn_destino.cursor()
+        try:
+            with medir('captura_entregar', self.destino):
+                _marcar_origem(conn_destino, cursor, nome_origem(self.origem))
+                aplicar_lote(conn_destino, lote)
+        finally:
+            try:
+                cursor.execute("SELECT pg_replication_origin_session_reset()")
+            except psycopg2.Error:
+                # A sessão não pode voltar ao pool ainda marcada com a origem
+                descartar = True
+            cursor.close()
+            liberar_conexao(conn_destino, descartar=descartar)
+        self.aplicadas += mudancas
+        self.ultimo_erro = None
+
+
+def _marcar_origem(conn, cursor, origem):
+    """Cria (se preciso) a origem de replicação e marca a sessão com ela; o que a sessão gravar sai no WAL com essa origem."""
+    autocommit_anterior = conn.autocommit
+    conn.autocommit = True
+    try:
+        cursor.execute(
+            "SELECT pg_replication_origin_create(%s) WHERE pg_replication_origin_oid(%s) IS NULL", (origem, origem)
+        )
+        cursor.execute("SELECT pg_replication_origin_session_setup(%s)", (origem,))
+    finally:
+        conn.autocommit = autocommit_anterior
+
+
+_consumidores = {}
+_consumidores_lock = threading.Lock()
+
+
+def iniciar_captura(servidor_local=None):
+    """Prepara publicação/slots e inicia um consumidor por peer. Retorna os consumidores ativos."""
+    servidor_local = servidor_local or LOCAL_SERVERS[0]
+    if not preparar_captura(servidor_local):
+        return []
+    with _consumidores_lock:
+        for destino in ALL_SERVERS:
+            if destino == servidor_local:
+                continue
+            consumidor = _consumidores.get(destino)
+            if consumidor is None or not consumidor.is_alive():
+                consumidor = ConsumidorCaptura(servidor_local, destino)
+                consumidor.start()
+                _consumidores[destino] = consumidor
+        print(f"🔁 Captura de mudanças (WAL) ativa: Líder {servidor_local} -> {', '.join(_consumidores)}.")
+        return list(_consumidores.values())
+
+
+def parar_captura():
+    with _consumidores_lock:
+        for consumidor in _consumidores.values():
+            consumidor.parar()
+        _consumidores.clear()
+
+
+def estado_captura(servidor_local=None):
+    """Retorna {slot: (ativo, atraso_bytes)} dos slots de captura do líder local."""
+    servidor_local = servidor_local or LOCAL_SERVERS[0]
+    conn = connect_to_db(servidor_local)
+    if not conn:
+        return {}
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT slot_name, active, pg_wal_lsn_diff(pg_current_wal_lsn(), confirmed_flush_lsn)
+            FROM pg_replication_slots WHERE slot_name LIKE %s ORDER BY slot_name
+        """, (f"{CAPTURA_PREFIXO_SLOT}_%",))
+        return {slot: (ativo, int(atraso or 0)) for slot, ativo, atraso in cursor.fetchall()}
+    finally:
+        cursor.close()
+        liberar_conexao(conn)
+
+
+def exibir_captura():
+    print("\n--- Captura de Mudanças (Replicação Lógica) ---")
+    slots = estado_captura()
+    if not slots:
+        print("Nenhum slot de captura configurado.")
+        return
+    for slot, (ativo, atraso) in slots.items():
+        print(f"Slot {slot}: {'ativo' if ativo else 'inativo'} | WAL pendente: {atraso} bytes")
+    for destino, consumidor in _consumidores.items():
+        linha = (f"Consumidor -> Líder {destino}: {consumidor.aplicadas} mudanças aplicadas, "
+                 f"{consumidor.ecos_descartados} vindas de outro peer descartadas")
+        if consumidor.ultimo_erro:
+            linha += f" | último erro: {consumidor.ultimo_erro}"
+        print(linha)
+
+
+atexit.register(parar_captura)
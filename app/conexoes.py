@@ -0,0 +1,331 @@
+import atexit
+import threading
+import time
+import psycopg2
+from psycopg2 import extensions
+from app.config import (
+    SERVERS, CONNECT_TIMEOUT, POOL_TAMANHOS, POOL_MIN_PADRAO, POOL_MAX_PADRAO,
+    POOL_TIMEOUT_CHECKOUT, POOL_INTERVALO_HEALTHCHECK
+)
+from app import saude_lideres
+from app.instrumentacao import registrar_comando, comandos_por_lider, medir
+
+
+def idas_por_lider():
+    """{servidor_id: comandos enviados} desde o início do processo (execute, commit e rollback de transação aberta)."""
+    return comandos_por_lider()
+
+
+class CursorContado(extensions.cursor):
+    """
+    Cursor padrão das conexões do pool: registra cada comando enviado ao líder, com as linhas devolvidas ou
+    afetadas e a duração (app/instrumentacao.py). As leituras seguintes de um cursor nomeado não entram.
+    """
+
+    def execute(self, query, vars=None):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            registrar_comando(self.connection.servidor_id, time.perf_counter() - inicio, self.rowcount, query)
+
+    def executemany(self, query, vars_list):
+        # O psycopg2 envia um comando por item
+        vars_list = list(vars_list)
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            registrar_comando(self.connection.servidor_id, time.perf_counter() - inicio, self.rowcount, query,
+                              quantidade=len(vars_list))
+
+
+class ConexaoPool(extensions.connection):
+    """Conexão psycopg2 que sabe a qual líder (pool) pertence."""
+    servidor_id = None
+    devolvida_em = 0.0
+
+    def _finalizar(self, comando, finalizar):
+        # Sem transação aberta o psycopg2 não vai ao servidor
+        if self.status == extensions.STATUS_READY:
+            return finalizar()
+        inicio = time.perf_counter()
+        try:
+            return finalizar()
+        finally:
+            registrar_comando(self.servidor_id, time.perf_counter() - inicio, sql=comando)
+
+    def commit(self):
+        self._finalizar("COMMIT", super().commit)
+
+    def rollback(self):
+        self._finalizar("ROLLBACK", super().rollback)
+
+
+class PoolLider:
+    """
+    Pool de conexões de UM líder.
+    Mantém conexões ociosas para reaproveitamento, limita o total aberto em 'maximo'
+    e testa conexões paradas há muito tempo antes de entregá-las (health check).
+    """
+
+    def __init__(self, servidor_id, minimo, maximo):
+        self.servidor_id = servidor_id
+        self.minimo = minimo
+        self.maximo = maximo
+        self._livres = []
+        self._abertas = 0
+        self._cond = threading.Condition()
+        self.ultimo_erro = None
+        self.estatisticas = {
+            'criadas': 0,
+            'reutilizadas': 0,
+            'descartadas': 0,
+            'health_checks': 0,
+            'health_checks_falhos': 0,
+            'falhas_conexao': 0,
+            'esperas': 0,
+            'timeouts_checkout': 0,
+        }
+
+    def _abrir_conexao(self):
+        config = SERVERS.get(self.servidor_id)
+        connect_args = {k: v for k, v in config.items() if k != 'tipo'}
+        connect_args['connect_timeout'] = CONNECT_TIMEOUT
+        conn = psycopg2.connect(connection_factory=ConexaoPool, **connect_args)
+        conn.servidor_id = self.servidor_id
+        conn.cursor_factory = CursorContado
+        return conn
+
+    def _conexao_saudavel(self, conn, forcar=False):
+        if conn.closed:
+            return False
+        # Só paga o round trip do teste se a conexão ficou parada tempo demais
+        # (ou se o circuit breaker está sondando o líder)
+        if not forcar and time.monotonic() - conn.devolvida_em < POOL_INTERVALO_HEALTHCHECK:
+            return True
+        self.estatisticas['health_checks'] += 1
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            self.estatisticas['health_checks_falhos'] += 1
+            return False
+
+    def _descartar(self, conn):
+        self.estatisticas['descartadas'] += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def obter(self, timeout=POOL_TIMEOUT_CHECKOUT):
+        """Entrega uma conexão (ociosa ou nova). Retorna None se o líder estiver inacessível."""
+        limite = time.monotonic() + timeout
+        sondando = not saude_lideres.circuito_fechado(self.servidor_id)
+        while True:
+            conn = None
+            with self._cond:
+                if self._livres:
+                    conn = self._livres.pop()
+                elif self._abertas < self.maximo:
+                    # Reserva a vaga e abre a conexão fora do lock (handshake é lento)
+                    self._abertas += 1
+                else:
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        if sondando:
+                            saude_lideres.cancelar_sondagem(self.servidor_id)
+                        self.estatisticas['timeouts_checkout'] += 1
+                        print(f"⚠️ Pool do Líder {self.servidor_id} esgotado ({self.maximo} conexões em uso).")
+                        return None
+                    self.estatisticas['esperas'] += 1
+                    self._cond.wait(restante)
+                    continue
+
+            if conn is None:
+                return self._nova_conexao()
+            if self._conexao_saudavel(conn, forcar=sondando):
+                with self._cond:
+                    self.estatisticas['reutilizadas'] += 1
+                if sondando:
+                    saude_lideres.registrar_sucesso(self.servidor_id)
+                return conn
+            with self._cond:
+                self._abertas -= 1
+                self._descartar(conn)
+
+    def _nova_conexao(self):
+        try:
+            conn = self._abrir_conexao()
+        except psycopg2.OperationalError as e:
+            with self._cond:
+                self._abertas -= 1
+                self.estatisticas['falhas_conexao'] += 1
+                self.ultimo_erro = str(e).strip()
+                self._cond.notify()
+            saude_lideres.registrar_falha(self.servidor_id, self.ultimo_erro)
+            return None
+        with self._cond:
+            self.estatisticas['criadas'] += 1
+            self.ultimo_erro = None
+        saude_lideres.registrar_sucesso(self.servidor_id)
+        return conn
+
+    def devolver(self, conn, descartar=False):
+        """Devolve a conexão ao pool, desfazendo qualquer transação que tenha ficado aberta."""
+        if not descartar and not conn.closed:
+            try:
+                status = conn.get_transaction_status()
+                if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                    descartar = True
+                elif status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                descartar = True
+        if conn.closed:
+            # A conexão caiu durante o uso: conta como falha do líder
+            saude_lideres.registrar_falha(self.servidor_id, "conexão perdida durante o uso")
+        with self._cond:
+            if descartar or conn.closed:
+                self._abertas -= 1
+                self._descartar(conn)
+            else:
+                conn.devolvida_em = time.monotonic()
+                self._livres.append(conn)
+            self._cond.notify()
+
+    def aquecer(self):
+        """Abre conexões até atingir o tamanho mínimo configurado."""
+        novas = []
+        while len(self._livres) + len(novas) < self.minimo:
+            conn = self.obter(timeout=0)
+            if conn is None:
+                break
+            novas.append(conn)
+        for conn in novas:
+            self.devolver(conn)
+        return len(novas)
+
+    def fechar(self):
+        with self._cond:
+            while self._livres:
+                self._abertas -= 1
+                self._descartar(self._livres.pop())
+
+    def resumo(self):
+        with self._cond:
+            dados = dict(self.estatisticas)
+            dados.update({
+                'abertas': self._abertas,
+                'livres': len(self._livres),
+                'em_uso': self._abertas - len(self._livres),
+                'min': self.minimo,
+                'max': self.maximo,
+            })
+            return dados
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def obter_pool(servidor_id):
+    """Retorna (criando sob demanda) o pool do líder. Retorna None para ids desconhecidos."""
+    pool = _pools.get(servidor_id)
+    if pool:
+        return pool
+    if servidor_id not in SERVERS:
+        return None
+    with _pools_lock:
+        if servidor_id not in _pools:
+            tamanhos = POOL_TAMANHOS.get(servidor_id, {})
+            _pools[servidor_id] = PoolLider(
+                servidor_id,
+                tamanhos.get('min', POOL_MIN_PADRAO),
+                tamanhos.get('max', POOL_MAX_PADRAO),
+            )
+        return _pools[servidor_id]
+
+
+def connect_to_db(servidor_id, ignorar_circuito=False):
+    """
+    Obtém uma conexão do pool do líder. Retorna None em caso de falha.
+    Líderes com o circuit breaker aberto (app/saude_lideres.py) são recusados imediatamente,
+    sem handshake; use ignorar_circuito=True apenas em diagnósticos.
+    A conexão DEVE ser devolvida com liberar_conexao() (e não com conn.close()).
+    """
+    pool = obter_pool(servidor_id)
+    if not pool:
+        print(f"❌ Configuração do servidor {servidor_id} não encontrada.")
+        return None
+    if not ignorar_circuito and not saude_lideres.permitir_conexao(servidor_id):
+        return None
+    with medir('connect_to_db', servidor_id):
+        return pool.obter()
+
+
+def connect_to_any_db(servidores_ids):
+    """Retorna (conn, servidor_id) do primeiro líder que responder, ou (None, None)."""
+    for servidor_id in servidores_ids:
+        conn = connect_to_db(servidor_id)
+        if conn:
+            return conn, servidor_id
+    return None, None
+
+
+def liberar_conexao(conn, descartar=False):
+    """Devolve a conexão ao pool de origem. Use descartar=True se ela ficou em estado duvidoso."""
+    if conn is None:
+        return
+    pool = _pools.get(getattr(conn, 'servidor_id', None))
+    if pool is None:
+        conn.close()
+        return
+    pool.devolver(conn, descartar=descartar)
+
+
+def ultimo_erro_conexao(servidor_id):
+    if saude_lideres.circuito_aberto(servidor_id):
+        return f"líder ignorado ({saude_lideres.descricao_circuito(servidor_id)})"
+    pool = _pools.get(servidor_id)
+    return pool.ultimo_erro if pool else "Configuração não encontrada."
+
+
+def aquecer_pools(servidores_ids=None):
+    """Abre as conexões mínimas de cada líder (útil para processos de longa duração)."""
+    for servidor_id in (servidores_ids or list(SERVERS)):
+        pool = obter_pool(servidor_id)
+        if pool:
+            pool.aquecer()
+
+
+def estatisticas_pool():
+    """Retorna um dicionário {servidor_id: estatísticas} de todos os pools já criados."""
+    return {servidor_id: pool.resumo() for servidor_id, pool in _pools.items()}
+
+
+def exibir_estatisticas_pool():
+    stats = estatisticas_pool()
+    if not stats:
+        print("Nenhum pool de conexões foi criado ainda.")
+        return
+    print("\n--- Estatísticas do Pool de Conexões ---")
+    for servidor_id, dados in stats.items():
+        print(
+            f"Líder {servidor_id}: abertas={dados['abertas']} (livres={dados['livres']}, em uso={dados['em_uso']}, "
+            f"min={dados['min']}, max={dados['max']}) | criadas={dados['criadas']} reutilizadas={dados['reutilizadas']} "
+            f"descartadas={dados['descartadas']} falhas={dados['falhas_conexao']} esperas={dados['esperas']} "
+            f"health_checks={dados['health_checks']}"
+        )
+
+
+def fechar_pools():
+    for pool in list(_pools.values()):
+        pool.fechar()
+
+
+atexit.register(fechar_pools)
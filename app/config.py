@@ -21,4 +21,107 @@ SERVERS = {
 ALL_SERVERS = ['A', 'B']
 LEADER_SERVERS = ['A', 'B'] 
 
-LOCAL_SERVERS = ['A']
\ No newline at end of file
+LOCAL_SERVERS = ['A']
+
+# --- Pool de conexões (app/conexoes.py) ---
+CONNECT_TIMEOUT = 5             # segundos para o handshake TCP+auth
+POOL_MIN_PADRAO = 1
+POOL_MAX_PADRAO = 10
+POOL_TAMANHOS = {               # tamanhos específicos por líder (sobrescrevem o padrão)
+    'A': {'min': 2, 'max': 20},
+    'B': {'min': 1, 'max': 10},
+}
+POOL_TIMEOUT_CHECKOUT = 10      # segundos esperando uma conexão livre quando o pool está cheio
+POOL_INTERVALO_HEALTHCHECK = 30 # conexões ociosas há mais tempo que isso são testadas (SELECT 1) antes do uso
+
+# --- Circuit breaker / saúde dos líderes (app/saude_lideres.py) ---
+CIRCUITO_FALHAS_PARA_ABRIR = 2  # falhas de conexão seguidas até o líder ser ignorado
+CIRCUITO_BACKOFF_INICIAL = 5    # segundos até a primeira sondagem (semi-aberto)
+CIRCUITO_BACKOFF_MAXIMO = 120   # o backoff dobra a cada sondagem falha até este limite
+
+# --- Fan-out de leituras entre líderes (app/fanout.py) ---
+FANOUT_PARALELO = True          # False volta à consulta sequencial, líder por líder
+FANOUT_PRAZO_PADRAO = 4.0       # segundos; líderes que não responderem a tempo ficam fora (resultado parcial)
+FANOUT_MAX_WORKERS = 16
+
+# --- Sincronização / healing (app/sincronizacao.py) ---
+SYNC_MODO_PADRAO = 'incremental'    # 'completo' compara todas as linhas (fallback)
+SYNC_MARGEM_WATERMARK_SEGUNDOS = 300 # sobreposição relida a cada rodada (transações longas / relógios adiantados).
+                                    # Limite: a watermark é a maior versão (LWW) vista na origem, não a ordem de
+                                    # chegada. Com 3+ líderes, uma linha que chega à origem repassada por um terceiro
+                                    # com versão mais velha que watermark - margem não é vista no modo incremental;
+                                    # fica para os modos 'completo'/'merkle' (a anti-entropia roda 'merkle' a cada
+                                    # ANTI_ENTROPIA_RODADAS_MERKLE rodadas)
+SYNC_AO_INICIAR = False             # menu interativo: heal bloqueante ao abrir (--heal / --sem-heal); os subcomandos só
+                                    # com --heal; 'se_divergente' só se o monitor de divergência recomendar. Com
+                                    # ANTI_ENTROPIA_ATIVA a primeira rodada em segundo plano já faz esse papel
+MERKLE_LIMITE_FOLHA = 256           # modo 'merkle': buckets divergentes com até N linhas são comparados linha a linha
+MERKLE_PROFUNDIDADE_MAXIMA = 6      # modo 'merkle': tamanho máximo do prefixo de UUID usado como bucket
+SYNC_STREAMING_ITERSIZE = 2000      # modo 'streaming': linhas (id, versão) trazidas por ida ao servidor, por lado
+SYNC_STREAMING_LOTE = 500           # modo 'streaming': ids divergentes acumulados antes de copiar e comitar um lote
+
+# --- Reavaliação da fila ---
+REAVALIACAO_NO_SERVIDOR = True  # usa o UPDATE com ROW_NUMBER() quando o líder de entrada tem a fila global completa
+
+# --- Replicação (app/replicacao.py, app/outbox.py) ---
+REPLICACAO_MODO = 'outbox'      # 'outbox': grava na replication_outbox e um expedidor em segundo plano entrega;
+                                # 'sincrona': envia a cada peer antes de responder (comportamento antigo);
+                                # 'captura': só o commit local, a propagação vem do WAL (app/captura_mudancas.py)
+OUTBOX_INTERVALO = 2.0          # segundos entre rodadas do expedidor (ele também é acordado após cada commit)
+OUTBOX_LOTE_MAXIMO = 500        # entradas da outbox enviadas por round trip
+OUTBOX_BACKOFF_INICIAL = 2      # segundos; dobra a cada tentativa falha da mesma entrada
+OUTBOX_BACKOFF_MAXIMO = 60
+
+# --- Captura de mudanças via replicação lógica (app/captura_mudancas.py, REPLICACAO_MODO = 'captura') ---
+CAPTURA_PUBLICACAO = 'lab_captura'   # publicação (pgoutput) com disciplinas, matriculas e tombstones
+CAPTURA_PREFIXO_SLOT = 'lab_captura' # um slot lógico por peer: <prefixo>_<origem>_para_<destino>
+CAPTURA_ESPERA = 0.2                 # segundos de espera por novas mensagens antes de reverificar
+CAPTURA_LOTE_MAXIMO = 1000           # mudanças acumuladas antes de forçar uma entrega ao peer
+CAPTURA_BACKOFF_INICIAL = 1          # segundos; dobra a cada reconexão falha
+CAPTURA_BACKOFF_MAXIMO = 30
+
+# --- Consulta de estado detalhado (app/consultar_estado.py) ---
+CONSULTA_ESTADO_ITERSIZE = 2000  # linhas trazidas por ida ao servidor (cursor nomeado)
+CONSULTA_ESTADO_BUFFER = 256     # disciplinas já lidas e ainda não exibidas, por líder
+
+# --- Importação de matrículas em lote (app/importar_matriculas.py) ---
+IMPORTACAO_LOTE_MAXIMO = 5000  # matrículas/mudanças de status por commit + replicação
+
+# --- Serviço HTTP/JSON (app/servidor_http.py, `python main.py servir`) ---
+HTTP_HOST = '127.0.0.1'
+HTTP_PORTA = 8080
+HTTP_WORKERS = 5              # requisições simultâneas; cada matrícula usa até 2 conexões do líder local (acompanhe POOL_MAX_PADRAO)
+HTTP_FILA_MAXIMA = 64         # conexões aguardando worker; além disso o serviço responde 503
+HTTP_AMOSTRAS_LATENCIA = 2048 # últimas latências guardadas por endpoint para os percentis de GET /metricas
+
+# --- Coordenação por disciplina (app/coordenacao.py) ---
+COORDENACAO_ATIVA = True       # serializa reavaliar-e-gravar por disciplina no líder de entrada
+COORDENACAO_ADVISORY = True    # além das listras do processo, pg_advisory_xact_lock (vale entre processos)
+COORDENACAO_LISTRAS = 64       # locks do processo; disciplinas na mesma listra se serializam entre si
+COORDENACAO_NAMESPACE = 7301   # 1ª chave do advisory lock, para não colidir com outros usos de advisory locks
+
+# --- Relógio lógico híbrido (app/hlc.py) ---
+HLC_MAX_NOS = 10               # nós distintos no desempate do µs (índice em ALL_SERVERS); lógico vai de 0 a 1000/N - 1
+HLC_DESVIO_MAXIMO_MS = 60000   # versões remotas mais adiantadas que isso em relação ao relógio local são ignoradas
+
+# --- Benchmark de carga (app/benchmark.py, `python main.py benchmark`) ---
+BENCHMARK_CONVERGENCIA_PRAZO = 30.0      # segundos esperando os líderes ficarem iguais depois da carga
+BENCHMARK_CONVERGENCIA_INTERVALO = 0.05  # segundos entre duas comparações dos líderes
+
+# --- Instrumentação (app/instrumentacao.py) ---
+INSTRUMENTACAO_ATIVA = True    # spans (tempo por etapa) nos caminhos quentes; os comandos ao banco são contados sempre
+INSTRUMENTACAO_LIMITES_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)  # faixas dos histogramas
+CONSULTA_LENTA_MS = None       # comandos mais lentos que isso vão para CONSULTA_LENTA_ARQUIVO (None desliga)
+CONSULTA_LENTA_ARQUIVO = 'consultas_lentas.log'
+
+# --- Monitor de divergência e atraso entre líderes (app/monitor_divergencia.py, `python main.py monitor`) ---
+MONITOR_INTERVALO = 30              # segundos entre as rodadas de `monitor --continuo`
+MONITOR_OUTBOX_IDADE_MAXIMA = 60    # entradas da outbox pendentes há mais que isso = replicação travada (recomenda heal)
+
+# --- Anti-entropia em segundo plano (app/anti_entropia.py, `python main.py anti-entropia`) ---
+ANTI_ENTROPIA_ATIVA = True          # menu e `servir`: rodadas incrementais numa thread; nenhuma operação espera por elas
+ANTI_ENTROPIA_INTERVALO = 30        # segundos entre rodadas (a primeira começa logo ao iniciar)
+ANTI_ENTROPIA_JITTER = 0.2          # ± fração do intervalo sorteada a cada rodada, para processos não sincronizarem juntos
+ANTI_ENTROPIA_RODADAS_MERKLE = 10   # a cada N rodadas, compara todas as tabelas por digests (o que contagens e versões não mostram)
+ANTI_ENTROPIA_BACKOFF_INICIAL = 30  # segundos sem tentar um peer depois de uma falha; dobra a cada falha seguida
+ANTI_ENTROPIA_BACKOFF_MAXIMO = 600
@@ -1,80 +1,170 @@
-import psycopg2
-from prettytable import PrettyTable
-from app.config import SERVERS, ALL_SERVERS 
+import queue
+import threading
+from app.config import SERVERS, ALL_SERVERS, CONSULTA_ESTADO_ITERSIZE, CONSULTA_ESTADO_BUFFER
+from app.conexoes import connect_to_db, liberar_conexao, ultimo_erro_conexao
+from app.saude_lideres import filtrar_lideres_disponiveis
 from datetime import timezone
 
-def connect_to_db(servidor_id):
-    config = SERVERS.get(servidor_id)
-    if not config: return None, "Configuração não encontrada."
-    connect_args = {k: v for k, v in config.items() if k != 'tipo'}
-    connect_args['connect_timeout'] = 5
+# Uma única consulta por líder: todas as filas, já com a posição e a validade de cada matrícula.
+# Disciplinas sem matrículas aparecem uma vez com nome_aluno NULL (LEFT JOIN).
+SQL_ESTADO_DETALHADO = """
+    WITH ativas AS (
+        SELECT id, nome, vagas_totais, COUNT(*) OVER () AS total_disciplinas
+        FROM disciplinas
+        WHERE (is_deleted IS NULL OR is_deleted = false)
+    ), fila AS (
+        SELECT d.id, d.nome, d.vagas_totais, d.total_disciplinas, m.nome_aluno, m.timestamp_matricula,
+               ROW_NUMBER() OVER (PARTITION BY d.id ORDER BY m.timestamp_matricula, m.id) AS posicao
+        FROM ativas d
+        LEFT JOIN matriculas m ON m.disciplina_id = d.id AND m.status != 'REMOVIDA'
+    )
+    SELECT id, nome, vagas_totais, total_disciplinas, nome_aluno, timestamp_matricula,
+           posicao, posicao <= vagas_totais AS valida
+    FROM fila
+    ORDER BY nome, id, posicao;
+"""
+
+_FIM = object()
+
+
+def _ler_estado_no_lider(servidor, saida):
+    """
+    Produtor: executa a consulta num cursor nomeado (as linhas chegam do servidor em blocos de
+    CONSULTA_ESTADO_ITERSIZE) e entrega uma disciplina completa por vez em 'saida'.
+    A fila é limitada, então um líder que responde antes de ser exibido não acumula tudo em memória.
+    """
+    conn = connect_to_db(servidor)
+    if not conn:
+        saida.put(('erro', f"❌ Erro de conexão com o servidor {servidor}: {ultimo_erro_conexao(servidor)}"))
+        saida.put(_FIM)
+        return
     try:
-        conn = psycopg2.connect(**connect_args)
-        return conn, None
-    except psycopg2.OperationalError as e:
-        return None, str(e)
+        cursor = conn.cursor(name=f"estado_detalhado_{servidor}")
+        cursor.itersize = CONSULTA_ESTADO_ITERSIZE
+        cursor.execute(SQL_ESTADO_DETALHADO)
+        atual, linhas = None, []
+        for disciplina_id, nome, vagas, total, aluno, ts_db, posicao, valida in cursor:
+            if atual is None:
+                saida.put(('total', total))
+            if atual is None or atual[0] != disciplina_id:
+                if atual is not None:
+                    saida.put(('disciplina', atual[1], atual[2], linhas))
+                atual, linhas = (disciplina_id, nome, vagas), []
+            if aluno is not None:
+                linhas.append((posicao, aluno, ts_db, valida))
+        if atual is None:
+            saida.put(('total', 0))
+        else:
+            saida.put(('disciplina', atual[1], atual[2], linhas))
+        # O cursor nomeado precisa ser fechado antes do fim da transação que o contém
+        cursor.close()
+        cursor = None
+        conn.commit()
+    except Exception as e:
+        saida.put(('erro', f"❌ Erro ao consultar o servidor {servidor}: {e}"))
+        cursor = None
+        conn.rollback()
+    finally:
+        saida.put(_FIM)
+        liberar_conexao(conn)
+
+
+def _exibir_disciplina(nome_disciplina, vagas_totais, linhas):
+    from prettytable import PrettyTable
+    matricula_table = PrettyTable()
+    matricula_table.field_names = ["#", "Nome do Aluno", "Timestamp (H:M:S.ms)", "Status da Vaga"]
+    matricula_table.align = "l"
+    alunos_aceites = []
+
+    for posicao, nome, ts_db, valida in linhas:
+        ts_utc = ts_db.replace(tzinfo=timezone.utc)
+        ts_local = ts_utc.astimezone(None)
+        ts_formatado = ts_local.strftime('%H:%M:%S.%f')[:-3]
+        if valida:
+            alunos_aceites.append(nome)
+            status = "✅ Válida"
+        else:
+            status = "❌ Conflito/Rejeitada"
+        matricula_table.add_row([posicao, nome, ts_formatado, status])
+
+    print(f"\n[DISCIPLINA: {nome_disciplina}] | Vagas: {len(alunos_aceites)}/{vagas_totais} ocupadas")
+    print(matricula_table)
+    resumo_alunos = ', '.join(alunos_aceites) if alunos_aceites else 'Nenhum'
+    print(f"Alunos Matriculados (Válidos): {resumo_alunos}")
+    print("-" * 70)
+
+
+def _iniciar_leitores(servidores):
+    """Dispara um produtor por líder; todos começam a responder ao mesmo tempo."""
+    filas = {}
+    for servidor in servidores:
+        filas[servidor] = queue.Queue(maxsize=CONSULTA_ESTADO_BUFFER)
+        threading.Thread(
+            target=_ler_estado_no_lider, args=(servidor, filas[servidor]),
+            name=f"estado-{servidor}", daemon=True,
+        ).start()
+    return filas
+
+
+def estado_detalhado():
+    """
+    Mesmo conteúdo de consultar_estado, como dados: {líder: {'disciplinas': [{'nome', 'vagas_totais',
+    'matriculas': [{'posicao', 'aluno', 'timestamp', 'valida'}]}], 'erro'}}.
+    """
+    disponiveis, ignorados = filtrar_lideres_disponiveis(ALL_SERVERS, "consulta de estado")
+    filas = _iniciar_leitores(disponiveis)
+    estado = {}
+    for servidor in ALL_SERVERS:
+        resultado = estado[servidor] = {'disciplinas': [], 'erro': None}
+        if servidor in ignorados:
+            resultado['erro'] = ultimo_erro_conexao(servidor) or "circuito aberto"
+            continue
+        while True:
+            item = filas[servidor].get()
+            if item is _FIM:
+                break
+            if item[0] == 'erro':
+                resultado['erro'] = item[1]
+            elif item[0] == 'disciplina':
+                _, nome, vagas, linhas = item
+                resultado['disciplinas'].append({
+                    'nome': nome, 'vagas_totais': vagas,
+                    'matriculas': [
+                        {'posicao': posicao, 'aluno': aluno, 'timestamp': ts_db.replace(tzinfo=timezone.utc).isoformat(), 'valida': valida}
+                        for posicao, aluno, ts_db, valida in linhas
+                    ],
+                })
+    return estado
+
 
 def consultar_estado():
     print("\n" + "="*70)
     print("INICIANDO CONSULTA DE ESTADO DETALHADO DOS SERVIDORES")
     print("="*70)
+
+    # Todos os líderes começam a responder ao mesmo tempo; a exibição segue a ordem de ALL_SERVERS
+    # e vai imprimindo cada disciplina assim que ela chega.
+    disponiveis, ignorados = filtrar_lideres_disponiveis(ALL_SERVERS, "consulta de estado")
+    filas = _iniciar_leitores(disponiveis)
+
     for servidor in ALL_SERVERS:
         tipo = SERVERS[servidor]['tipo'].upper()
         print("\n" + "="*20 + f" ESTADO DO {tipo} {servidor} " + "="*20)
-        conn, erro_conexao = connect_to_db(servidor)
-        if not conn:
-            print(f"❌ Erro de conexão com o servidor {servidor}: {erro_conexao}")
+        if servidor in ignorados:
+            print(f"❌ Erro de conexão com o servidor {servidor}: {ultimo_erro_conexao(servidor)}")
             continue
-        cursor = conn.cursor()
-        try:
-           
-            cursor.execute("""
-                SELECT id, nome, vagas_totais FROM disciplinas 
-                WHERE (is_deleted IS NULL OR is_deleted = false) ORDER BY nome;
-            """)
-            disciplinas = cursor.fetchall()
-            if not disciplinas:
-                print("⚠️ Nenhuma disciplina encontrada. Verifique se o banco foi inicializado.")
-                continue
-
-            print(f"Disciplinas encontradas no {servidor}: {len(disciplinas)}")
-            print("-" * 70)
-            for disciplina_id, nome_disciplina, vagas_totais in disciplinas:
-                
-                
-                cursor.execute("""
-                    SELECT nome_aluno, timestamp_matricula FROM matriculas
-                    WHERE disciplina_id = %s AND status != 'REMOVIDA'
-                    ORDER BY timestamp_matricula;
-                """, (disciplina_id,))
-                matriculas = cursor.fetchall()
-                
-                matricula_table = PrettyTable()
-                matricula_table.field_names = ["#", "Nome do Aluno", "Timestamp (H:M:S.ms)", "Status da Vaga"]
-                matricula_table.align = "l"
-                vagas_ocupadas = 0
-                alunos_aceites = []
-                
-                for i, (nome, ts_db) in enumerate(matriculas):
-                    posicao = i + 1
-                    ts_utc = ts_db.replace(tzinfo=timezone.utc)
-                    ts_local = ts_utc.astimezone(None)
-                    ts_formatado = ts_local.strftime('%H:%M:%S.%f')[:-3] 
-                    if i < vagas_totais:
-                        vagas_ocupadas += 1
-                        alunos_aceites.append(nome)
-                        status = "✅ Válida"
-                    else:
-                        status = "❌ Conflito/Rejeitada"
-                    matricula_table.add_row([posicao, nome, ts_formatado, status])
-
-                print(f"\n[DISCIPLINA: {nome_disciplina}] | Vagas: {vagas_ocupadas}/{vagas_totais} ocupadas")
-                print(matricula_table)
-                resumo_alunos = ', '.join(alunos_aceites) if alunos_aceites else 'Nenhum'
-                print(f"Alunos Matriculados (Válidos): {resumo_alunos}")
+        saida = filas[servidor]
+        while True:
+            item = saida.get()
+            if item is _FIM:
+                break
+            if item[0] == 'erro':
+                print(item[1])
+            elif item[0] == 'total':
+                if not item[1]:
+                    print("⚠️ Nenhuma disciplina encontrada. Verifique se o banco foi inicializado.")
+                    continue
+                print(f"Disciplinas encontradas no {servidor}: {item[1]}")
                 print("-" * 70)
-        except Exception as e:
-            print(f"❌ Erro ao consultar o servidor {servidor}: {e}")
-        finally:
-            if cursor: cursor.close()
-            if conn: conn.close()
\ No newline at end of file
+            else:
+                _exibir_disciplina(*item[1:])
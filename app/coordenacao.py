@@ -0,0 +1,79 @@
+import threading
+import time
+import zlib
+from app.config import COORDENACAO_ATIVA, COORDENACAO_ADVISORY, COORDENACAO_LISTRAS, COORDENACAO_NAMESPACE
+
+# Tabela fixa de locks ("listras"): cada disciplina cai sempre na mesma listra, então duas operações na
+# mesma disciplina se serializam e disciplinas em listras diferentes seguem em paralelo. O crc32 (e não
+# hash()) mantém o mapeamento estável entre execuções.
+_listras = [threading.Lock() for _ in range(COORDENACAO_LISTRAS)]
+_estatisticas_lock = threading.Lock()
+_estatisticas = {'aquisicoes': 0, 'esperas': 0, 'segundos_espera': 0.0}
+
+
+def _listra(disciplina_id):
+    return zlib.crc32(str(disciplina_id).encode()) % COORDENACAO_LISTRAS
+
+
+class TravaDisciplinas:
+    """
+    Seção crítica de reavaliar-e-gravar de uma ou mais disciplinas, no líder de entrada:
+    - no processo: as listras das disciplinas (evita ocupar conexões do pool esperando no banco);
+    - no banco: pg_advisory_xact_lock(COORDENACAO_NAMESPACE, hashtext(disciplina_id)) na transação de 'conn',
+      que serializa também outros processos (CLI, serviço HTTP) que entram pelo mesmo líder e é liberado
+      sozinho no commit/rollback.
+    Várias disciplinas são sempre travadas em ordem (listras por índice, advisory por id), sem deadlock.
+    Use como context manager, ou adquirir()/liberar() quando o corpo já tem seu próprio try/finally.
+    A trava não coordena líderes de entrada diferentes: entre eles a reavaliação e o heal continuam valendo.
+    """
+
+    def __init__(self, conn, disciplinas_ids):
+        self.conn = conn
+        self.disciplinas_ids = sorted({str(d) for d in disciplinas_ids})
+        self._listras = sorted({_listra(d) for d in self.disciplinas_ids})
+        self._travadas = []
+
+    def adquirir(self):
+        if not COORDENACAO_ATIVA:
+            return self
+        inicio = time.monotonic()
+        esperou = False
+        for indice in self._listras:
+            trava = _listras[indice]
+            if not trava.acquire(blocking=False):
+                esperou = True
+                trava.acquire()
+            self._travadas.append(trava)
+        if COORDENACAO_ADVISORY and self.conn is not None and self.disciplinas_ids:
+            cursor = self.conn.cursor()
+            try:
+                for disciplina_id in self.disciplinas_ids:
+                    cursor.execute("SELECT pg_advisory_xact_lock(%s, hashtext(%s))", (COORDENACAO_NAMESPACE, disciplina_id))
+            except Exception:
+                self.liberar()
+                raise
+            finally:
+                cursor.close()
+        espera = time.monotonic() - inicio
+        with _estatisticas_lock:
+            _estatisticas['aquisicoes'] += 1
+            _estatisticas['esperas'] += int(esperou)
+            _estatisticas['segundos_espera'] += espera
+        return self
+
+    def liberar(self):
+        """Solta as listras. O advisory lock vai junto com a transação (commit/rollback de quem chamou)."""
+        while self._travadas:
+            self._travadas.pop().release()
+
+    def __enter__(self):
+        return self.adquirir()
+
+    def __exit__(self, *exc):
+        self.liberar()
+        return False
+
+
+def estatisticas_coordenacao():
+    with _estatisticas_lock:
+        return dict(_estatisticas)
@@ -0,0 +1,87 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from app.config import FANOUT_PARALELO, FANOUT_PRAZO_PADRAO, FANOUT_MAX_WORKERS
+from app.saude_lideres import filtrar_lideres_disponiveis
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _obter_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=FANOUT_MAX_WORKERS, thread_name_prefix="fanout")
+    return _executor
+
+
+def executar_em_lideres(servidores_ids, funcao, prazo=None, contexto="", ao_chegar=None, paralelo=None):
+    """
+    Executa funcao(servidor_id) em cada líder e consolida as respostas.
+
+    - paralelo=True (padrão: FANOUT_PARALELO) dispara todos os líderes ao mesmo tempo, então a latência
+      é a do líder mais lento e não a soma de todos; paralelo=False mantém a execução sequencial.
+    - prazo (segundos) limita a espera total; líderes que não responderam a tempo entram em 'expirados'
+      e o resultado é parcial.
+    - ao_chegar(servidor_id, resultado) é chamado à medida que cada líder responde (merge incremental).
+    - Líderes com o circuit breaker aberto nem são consultados (entram em 'ignorados').
+
+    Retorna um dicionário com 'resultados' {servidor_id: retorno}, 'respondidos', 'falharam' {servidor_id: erro},
+    'expirados', 'ignorados' e 'parcial' (True se algum líder não contribuiu).
+    """
+    if prazo is None:
+        prazo = FANOUT_PRAZO_PADRAO
+    if paralelo is None:
+        paralelo = FANOUT_PARALELO
+
+    disponiveis, ignorados = filtrar_lideres_disponiveis(servidores_ids, contexto)
+    resultado = {
+        'resultados': {},
+        'respondidos': [],
+        'falharam': {},
+        'expirados': [],
+        'ignorados': ignorados,
+        'parcial': False,
+    }
+
+    def _registrar(servidor_id, retorno=None, erro=None):
+        if erro is not None:
+            resultado['falharam'][servidor_id] = erro
+            return
+        resultado['resultados'][servidor_id] = retorno
+        resultado['respondidos'].append(servidor_id)
+        if ao_chegar:
+            ao_chegar(servidor_id, retorno)
+
+    limite = time.monotonic() + prazo
+    if not paralelo or len(disponiveis) <= 1:
+        for servidor_id in disponiveis:
+            if time.monotonic() >= limite:
+                resultado['expirados'].append(servidor_id)
+                continue
+            try:
+                _registrar(servidor_id, funcao(servidor_id))
+            except Exception as e:
+                _registrar(servidor_id, erro=e)
+    else:
+        executor = _obter_executor()
+        futuros = {executor.submit(funcao, servidor_id): servidor_id for servidor_id in disponiveis}
+        pendentes = set(futuros)
+        while pendentes:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            prontos, pendentes = wait(pendentes, timeout=restante, return_when=FIRST_COMPLETED)
+            for futuro in prontos:
+                servidor_id = futuros[futuro]
+                try:
+                    _registrar(servidor_id, futuro.result())
+                except Exception as e:
+                    _registrar(servidor_id, erro=e)
+        # Os que estouraram o prazo continuam rodando em segundo plano e liberam as próprias conexões
+        resultado['expirados'] = [futuros[f] for f in pendentes]
+
+    resultado['parcial'] = bool(resultado['falharam'] or resultado['expirados'] or resultado['ignorados'])
+    return resultado
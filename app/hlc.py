@@ -0,0 +1,110 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from app.config import ALL_SERVERS, LOCAL_SERVERS, HLC_MAX_NOS, HLC_DESVIO_MAXIMO_MS
+
+# Relógio lógico híbrido (HLC): (físico em ms, contador lógico, nó). O trio é gravado nas próprias colunas
+# TIMESTAMPTZ (timestamp_matricula, data_ultima_modificacao), que têm resolução de 1µs:
+#     instante = físico (ms) + (lógico * HLC_MAX_NOS + nó) µs
+# Assim a ordem do timestamp é a ordem (físico, lógico, nó), e todo o SQL existente (LWW com '<',
+# ORDER BY timestamp_matricula, id) continua valendo sem mudança de esquema.
+EPOCA = datetime(1970, 1, 1)
+LOGICO_MAXIMO = 1000 // HLC_MAX_NOS - 1
+
+
+def codificar(fisico, logico, no):
+    """(ms desde a época, contador lógico, índice do nó) -> datetime UTC sem fuso, como as demais versões do app."""
+    return EPOCA + timedelta(milliseconds=fisico, microseconds=logico * HLC_MAX_NOS + no)
+
+
+def decodificar(instante):
+    """datetime (com ou sem fuso, sem fuso = UTC) -> (físico, lógico, nó)."""
+    if instante.tzinfo is not None:
+        instante = instante.astimezone(timezone.utc).replace(tzinfo=None)
+    delta = instante - EPOCA
+    micros = (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+    fisico, resto = divmod(micros, 1000)
+    logico, no = divmod(resto, HLC_MAX_NOS)
+    return fisico, logico, no
+
+
+class RelogioHibrido:
+    """
+    HLC de um nó. agora() marca um evento local (matrícula, remoção, reavaliação) e observar() incorpora
+    uma versão lida de outro líder, para que o próximo agora() seja maior que ela mesmo que o relógio
+    desta máquina esteja atrasado. Nenhuma das duas vai ao banco.
+    Versões remotas mais de HLC_DESVIO_MAXIMO_MS à frente do relógio físico são ignoradas (com aviso):
+    um peer com o relógio muito adiantado não arrasta o HLC de todos junto.
+    """
+
+    def __init__(self, servidor_id, relogio_fisico=time.time):
+        self.no = ALL_SERVERS.index(servidor_id)
+        if self.no >= HLC_MAX_NOS:
+            raise ValueError(f"HLC_MAX_NOS={HLC_MAX_NOS} não comporta o nó {servidor_id} (índice {self.no}).")
+        self._relogio_fisico = relogio_fisico
+        self._lock = threading.Lock()
+        self._fisico = 0
+        self._logico = 0
+
+    def _ms(self):
+        return int(self._relogio_fisico() * 1000)
+
+    def _guardar(self, fisico, logico):
+        # O contador lógico não cabe no µs além de LOGICO_MAXIMO: o HLC adianta 1ms (continua monotônico)
+        if logico > LOGICO_MAXIMO:
+            fisico, logico = fisico + 1, 0
+        self._fisico, self._logico = fisico, logico
+
+    def agora(self):
+        fisico_atual = self._ms()
+        with self._lock:
+            if fisico_atual > self._fisico:
+                self._guardar(fisico_atual, 0)
+            else:
+                self._guardar(self._fisico, self._logico + 1)
+            return codificar(self._fisico, self._logico, self.no)
+
+    def observar(self, instante):
+        if instante is None:
+            return
+        fisico_remoto, logico_remoto, _ = decodificar(instante)
+        fisico_atual = self._ms()
+        if fisico_remoto - fisico_atual > HLC_DESVIO_MAXIMO_MS:
+            print(f"⚠️ HLC: versão remota {instante} está {(fisico_remoto - fisico_atual) / 1000:.1f}s à frente "
+                  f"do relógio local; ignorada (HLC_DESVIO_MAXIMO_MS={HLC_DESVIO_MAXIMO_MS}).")
+            return
+        with self._lock:
+            fisico = max(self._fisico, fisico_remoto, fisico_atual)
+            if fisico == self._fisico and fisico == fisico_remoto:
+                logico = max(self._logico, logico_remoto) + 1
+            elif fisico == self._fisico:
+                logico = self._logico + 1
+            elif fisico == fisico_remoto:
+                logico = logico_remoto + 1
+            else:
+                logico = 0
+            self._guardar(fisico, logico)
+
+
+_relogio = None
+_relogio_lock = threading.Lock()
+
+
+def relogio():
+    """O HLC do processo, no nó LOCAL_SERVERS[0] (o líder de entrada)."""
+    global _relogio
+    with _relogio_lock:
+        if _relogio is None:
+            _relogio = RelogioHibrido(LOCAL_SERVERS[0])
+        return _relogio
+
+
+def agora_hlc():
+    return relogio().agora()
+
+
+def observar_hlc(*instantes):
+    """Incorpora a maior das versões lidas (None é ignorado)."""
+    validos = [i for i in instantes if i is not None]
+    if validos:
+        relogio().observar(max(validos, key=decodificar))
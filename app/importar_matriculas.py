@@ -0,0 +1,237 @@
+import csv
+import json
+import os
+import time
+import uuid
+import psycopg2
+from app.config import LOCAL_SERVERS, IMPORTACAO_LOTE_MAXIMO
+from app.conexoes import connect_to_db, liberar_conexao
+from app.matricular import consultar_estado_global_detalhado, atribuir_vagas, STATUS_ACEITA
+from app.replicacao import novo_lote, aplicar_lote, lote_vazio
+from app.outbox import comitar_e_replicar
+from app.coordenacao import TravaDisciplinas
+from app.hlc import agora_hlc
+
+# Nomes de coluna aceitos no arquivo (CSV com cabeçalho ou um objeto JSON por linha)
+CAMPOS_ALUNO = ('aluno', 'nome_aluno')
+CAMPOS_DISCIPLINA = ('disciplina', 'disciplina_nome')
+
+
+def _campo(registro, nomes):
+    for nome in nomes:
+        valor = registro.get(nome)
+        if valor is not None and str(valor).strip():
+            return str(valor).strip()
+    return None
+
+
+def ler_registros(caminho):
+    """
+    Lê o arquivo linha a linha e devolve (aluno, disciplina) na ordem do arquivo, que é a ordem FCFS
+    da importação. Linhas sem aluno ou disciplina (ou JSON inválido) saem como (None, None).
+    """
+    with open(caminho, newline='', encoding='utf-8') as arquivo:
+        if caminho.lower().endswith(('.jsonl', '.ndjson')):
+            for linha in arquivo:
+                if not linha.strip():
+                    continue
+                try:
+                    registro = json.loads(linha)
+                except ValueError:
+                    yield None, None
+                    continue
+                if not isinstance(registro, dict):
+                    yield None, None
+                    continue
+                yield _campo(registro, CAMPOS_ALUNO), _campo(registro, CAMPOS_DISCIPLINA)
+        else:
+            for registro in csv.DictReader(arquivo):
+                yield _campo(registro, CAMPOS_ALUNO), _campo(registro, CAMPOS_DISCIPLINA)
+
+
+def _agrupar_por_disciplina(caminho, resumo):
+    """{disciplina_nome: [alunos na ordem do arquivo]}; só os nomes ficam em memória, não as linhas do arquivo."""
+    grupos = {}
+    for aluno, disciplina in ler_registros(caminho):
+        resumo['linhas'] += 1
+        if not aluno or not disciplina:
+            resumo['invalidas'] += 1
+            continue
+        grupos.setdefault(disciplina, []).append(aluno)
+    return grupos
+
+
+def _disciplinas_por_nome(conn, nomes):
+    """Resolve todas as disciplinas do arquivo numa única consulta: {nome: (id, vagas_totais)}."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT nome, id, vagas_totais FROM disciplinas
+            WHERE nome = ANY(%s) AND (is_deleted IS NULL OR is_deleted = false)
+        """, (list(nomes),))
+        return {nome: (disciplina_id, vagas) for nome, disciplina_id, vagas in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+
+def _desfazer(conn):
+    """Rollback do lote em andamento; False se a conexão já não responde (ela não volta ao pool)."""
+    try:
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _comitar_lote(conn, lote, lider_entrada, descricao):
+    if lote_vazio(lote):
+        return
+    aplicar_lote(conn, lote, commit=False)
+    comitar_e_replicar(conn, lote, lider_entrada, descricao)
+
+
+def _blocos(grupos, disciplinas):
+    """
+    Divide as linhas das disciplinas conhecidas em blocos de até IMPORTACAO_LOTE_MAXIMO matrículas (um commit
+    por bloco): [(disciplina_nome, alunos)]. Uma disciplina maior que o bloco é repartida em pedaços
+    consecutivos, na ordem do arquivo; cada pedaço relê a fila global, que já inclui os pedaços gravados.
+    """
+    bloco, linhas = [], 0
+    for disciplina_nome, alunos in grupos.items():
+        if disciplina_nome not in disciplinas:
+            continue
+        inicio = 0
+        while inicio < len(alunos):
+            pedaco = alunos[inicio:inicio + IMPORTACAO_LOTE_MAXIMO - linhas]
+            bloco.append((disciplina_nome, pedaco))
+            linhas += len(pedaco)
+            inicio += len(pedaco)
+            if linhas >= IMPORTACAO_LOTE_MAXIMO:
+                yield bloco
+                bloco, linhas = [], 0
+    if bloco:
+        yield bloco
+
+
+def _planejar_disciplina(lote, disciplina_nome, alunos, disciplina_id, vagas_totais, contagens):
+    """
+    Lê a fila global da disciplina uma vez e acrescenta ao lote as novas matrículas e as mudanças de status.
+    'contagens' é o contador do bloco, somado ao resumo só depois do commit.
+    """
+    registros_atuais, fanout = consultar_estado_global_detalhado(disciplina_id)
+    if fanout['parcial']:
+        print(f"⚠️ Fila global de '{disciplina_nome}' lida sem todos os líderes; o heal corrige as posições depois.")
+    ja_matriculados = {nome for _, nome, _, _ in registros_atuais}
+
+    versao = agora_hlc()
+    novas = []
+    for aluno in alunos:
+        if aluno in ja_matriculados:
+            contagens['duplicadas'] += 1
+            continue
+        ja_matriculados.add(aluno)
+        novas.append((str(uuid.uuid4()), aluno, agora_hlc(), 'PENDENTE'))
+
+    status_novas, mudancas = atribuir_vagas(registros_atuais, novas, vagas_totais)
+    for matricula_id, aluno, ts, _ in novas:
+        status = status_novas[matricula_id]
+        lote['matriculas'].append((matricula_id, disciplina_id, aluno, ts, status, ts))
+        contagens['aceitas' if status == STATUS_ACEITA else 'rejeitadas'] += 1
+    for matricula_id, novo_status in mudancas:
+        lote['status'].append((matricula_id, novo_status, versao))
+    contagens['status_alterados'] += len(mudancas)
+    print(f"📥 {disciplina_nome}: {len(novas)} nova(s) matrícula(s), {len(alunos) - len(novas)} duplicada(s), "
+          f"{len(mudancas)} status reavaliado(s).")
+    return len(novas) + len(mudancas)
+
+
+def importar_matriculas(caminho, lider_entrada=None):
+    """
+    Importação em lote de matrículas (dia de inscrições): agrupa as linhas por disciplina, faz UMA leitura
+    global da fila de cada disciplina, atribui as vagas de todo o grupo em memória e grava/replica em lotes
+    de até ~IMPORTACAO_LOTE_MAXIMO matrículas (um commit e uma replicação por lote, não por aluno). As
+    disciplinas de um lote ficam travadas até o commit, como numa matrícula individual.
+    Os timestamps (HLC) das novas matrículas seguem a ordem do arquivo.
+    Retorna o resumo com as contagens e a vazão; aceitas/rejeitadas/duplicadas/status_alterados só contam os
+    lotes gravados, e 'erro' vem preenchido se o líder estava offline ou um lote foi descartado.
+    """
+    lider_entrada = lider_entrada or LOCAL_SERVERS[0]
+    inicio = time.monotonic()
+    resumo = {'linhas': 0, 'invalidas': 0, 'aceitas': 0, 'rejeitadas': 0, 'duplicadas': 0,
+              'sem_disciplina': 0, 'status_alterados': 0, 'lotes': 0, 'segundos': 0.0, 'por_segundo': 0.0, 'erro': None}
+    try:
+        grupos = _agrupar_por_disciplina(caminho, resumo)
+    except (OSError, ValueError, csv.Error) as e:
+        # UnicodeDecodeError é um ValueError; nada foi gravado ainda
+        print(f"❌ Importação falhou ao ler {caminho}: {e}")
+        resumo['erro'] = f"arquivo ilegível: {e}"
+        return resumo
+
+    conn = connect_to_db(lider_entrada)
+    if not conn:
+        print(f"❌ Importação falhou: Líder {lider_entrada} está offline.")
+        resumo['erro'] = f"líder {lider_entrada} offline"
+        return resumo
+    trava, descartar = None, False
+    try:
+        disciplinas = _disciplinas_por_nome(conn, grupos)
+        conn.commit()
+        for disciplina_nome, alunos in grupos.items():
+            if disciplina_nome not in disciplinas:
+                print(f"❌ Disciplina '{disciplina_nome}' não encontrada ou foi removida ({len(alunos)} linhas ignoradas).")
+                resumo['sem_disciplina'] += len(alunos)
+
+        for bloco in _blocos(grupos, disciplinas):
+            # As disciplinas do bloco ficam travadas (app/coordenacao.py) da leitura global até o commit do lote
+            trava = TravaDisciplinas(conn, list(dict.fromkeys(disciplinas[nome][0] for nome, _ in bloco))).adquirir()
+            lote, no_lote = novo_lote(), 0
+            contagens = dict.fromkeys(('aceitas', 'rejeitadas', 'duplicadas', 'status_alterados'), 0)
+            for disciplina_nome, alunos in bloco:
+                no_lote += _planejar_disciplina(lote, disciplina_nome, alunos, *disciplinas[disciplina_nome], contagens)
+            if lote_vazio(lote):
+                conn.rollback()
+            else:
+                _comitar_lote(conn, lote, lider_entrada, f"Importação em lote ({no_lote} mudanças)")
+                resumo['lotes'] += 1
+            for chave, valor in contagens.items():
+                resumo[chave] += valor
+            trava.liberar()
+    except psycopg2.Error as e:
+        descartar = not _desfazer(conn)
+        print(f"❌ Erro PostgreSQL durante a importação (lote em andamento descartado): {e}")
+        resumo['erro'] = str(e)
+    except Exception as e:
+        # Pool/circuito (ConnectionError) ou leitura global: os lotes já gravados seguem no resumo
+        descartar = not _desfazer(conn)
+        print(f"❌ Erro inesperado durante a importação (lote em andamento descartado): {e}")
+        resumo['erro'] = str(e)
+    finally:
+        if trava: trava.liberar()
+        liberar_conexao(conn, descartar=descartar)
+
+    resumo['segundos'] = time.monotonic() - inicio
+    resumo['por_segundo'] = resumo['linhas'] / resumo['segundos'] if resumo['segundos'] else 0.0
+    return resumo
+
+
+def exibir_resumo_importacao(resumo):
+    print("\n--- Resumo da Importação ---")
+    print(f"Linhas lidas: {resumo['linhas']} (inválidas: {resumo['invalidas']})")
+    print(f"✅ Aceitas: {resumo['aceitas']} | ❌ Rejeitadas (lista de espera): {resumo['rejeitadas']}")
+    print(f"⚠️ Duplicadas: {resumo['duplicadas']} | Disciplina inexistente: {resumo['sem_disciplina']}")
+    print(f"🔁 Status reavaliados na fila existente: {resumo['status_alterados']} | Lotes gravados: {resumo['lotes']}")
+    print(f"⏱️ {resumo['segundos']:.2f}s ({resumo['por_segundo']:.0f} linhas/s)")
+    if resumo['erro']:
+        print(f"❌ Importação incompleta: {resumo['erro']} (só os lotes gravados entram nas contagens acima).")
+
+
+def importar_matriculas_menu():
+    caminho = input("Caminho do arquivo (.csv com colunas aluno,disciplina ou .jsonl): ").strip()
+    if not caminho or not os.path.isfile(caminho):
+        print("❌ Operação cancelada. Arquivo não encontrado.")
+        return
+    if not LOCAL_SERVERS:
+        print("❌ ERRO DE CONFIGURAÇÃO: LOCAL_SERVERS não está definido no config.py.")
+        return
+    print(f"\n⏳ Importando matrículas de {caminho} via Líder {LOCAL_SERVERS[0]}...")
+    exibir_resumo_importacao(importar_matriculas(caminho))
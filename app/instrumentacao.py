@@ -0,0 +1,242 @@
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from app.config import INSTRUMENTACAO_ATIVA, INSTRUMENTACAO_LIMITES_MS, CONSULTA_LENTA_MS, CONSULTA_LENTA_ARQUIVO
+
+# Métricas do processo, sem dependências externas:
+# - spans: medir('nome', lider) em volta de uma etapa (conexão, leitura global, reavaliação, replicação, merge)
+#   alimenta um histograma de latência por (etapa, líder);
+# - comandos: o cursor do pool (app/conexoes.py) registra cada comando enviado a um líder, com as linhas
+#   devolvidas/afetadas e a duração; acima de CONSULTA_LENTA_MS o comando vai para o log de consultas lentas.
+# - valores: medidas pontuais (gauges) publicadas por outros módulos, como o atraso entre líderes do monitor
+#   de divergência (app/monitor_divergencia.py).
+# metricas() devolve tudo em JSON e metricas_prometheus() no formato texto do Prometheus.
+_lock = threading.Lock()
+_spans = {}
+_lideres = {}
+_valores = {}
+_lentas = {'limite_ms': CONSULTA_LENTA_MS, 'arquivo': CONSULTA_LENTA_ARQUIVO, 'registradas': 0}
+
+
+class Histograma:
+    """
+    Contagens por faixa (INSTRUMENTACAO_LIMITES_MS, em ms) + soma, total, mínimo e máximo. Percentis interpolados
+    dentro da faixa, entre os valores observados que ela pode conter.
+    """
+
+    def __init__(self, limites=INSTRUMENTACAO_LIMITES_MS):
+        self.limites = limites
+        self.contagens = [0] * (len(limites) + 1)
+        self.total = 0
+        self.soma_ms = 0.0
+        self.minimo_ms = None
+        self.maximo_ms = 0.0
+
+    def registrar(self, ms):
+        self.contagens[bisect.bisect_left(self.limites, ms)] += 1
+        self.total += 1
+        self.soma_ms += ms
+        self.minimo_ms = ms if self.minimo_ms is None else min(self.minimo_ms, ms)
+        self.maximo_ms = max(self.maximo_ms, ms)
+
+    def percentil(self, p):
+        alvo, acumulado = p * self.total, 0
+        for indice, contagem in enumerate(self.contagens):
+            if contagem and acumulado + contagem >= alvo:
+                # Interpolação linear na faixa, cujos extremos são apertados pelo mínimo e pelo máximo observados:
+                # com todas as amostras abaixo de 1 ms, p50/p95/p99 ficam entre elas em vez de iguais ao teto
+                inferior = max(self.limites[indice - 1] if indice else 0.0, self.minimo_ms)
+                superior = min(self.limites[indice] if indice < len(self.limites) else self.maximo_ms, self.maximo_ms)
+                fracao = (alvo - acumulado) / contagem
+                return round(inferior + (superior - inferior) * fracao, 2)
+            acumulado += contagem
+        return None
+
+    def resumo(self):
+        return {
+            'n': self.total,
+            'media_ms': round(self.soma_ms / self.total, 2) if self.total else None,
+            'p50_ms': self.percentil(0.50),
+            'p95_ms': self.percentil(0.95),
+            'p99_ms': self.percentil(0.99),
+            'max_ms': round(self.maximo_ms, 2),
+        }
+
+
+def registrar_span(nome, lider, segundos):
+    with _lock:
+        histograma = _spans.get((nome, lider))
+        if histograma is None:
+            histograma = _spans[(nome, lider)] = Histograma()
+        histograma.registrar(segundos * 1000)
+
+
+@contextmanager
+def medir(nome, lider=None):
+    """Span: mede o bloco (ou a função, usado como decorador) no histograma de (nome, lider), com ou sem exceção."""
+    if not INSTRUMENTACAO_ATIVA:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        registrar_span(nome, lider, time.perf_counter() - inicio)
+
+
+def _dados_lider(lider):
+    dados = _lideres.get(lider)
+    if dados is None:
+        dados = _lideres[lider] = {'comandos': 0, 'linhas': 0, 'latencia': Histograma()}
+    return dados
+
+
+def registrar_comando(lider, segundos, linhas=0, sql=None, quantidade=1):
+    ms = segundos * 1000
+    with _lock:
+        dados = _dados_lider(lider)
+        dados['comandos'] += quantidade
+        dados['linhas'] += max(linhas, 0)
+        dados['latencia'].registrar(ms)
+        limite = _lentas['limite_ms']
+        lenta = limite is not None and ms >= limite
+        if lenta:
+            _lentas['registradas'] += 1
+    if lenta:
+        _registrar_lenta(lider, ms, linhas, sql)
+
+
+def _registrar_lenta(lider, ms, linhas, sql):
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', errors='replace')
+    texto = " ".join(str(sql or '').split())
+    if len(texto) > 500:
+        texto = texto[:500] + "..."
+    linha = f"{datetime.now().isoformat(timespec='milliseconds')} lider={lider} {ms:.1f}ms linhas={linhas} {texto}\n"
+    with _lock:
+        with open(_lentas['arquivo'], 'a', encoding='utf-8') as arquivo:
+            arquivo.write(linha)
+
+
+def registrar_valor(nome, valor, **rotulos):
+    """Gauge: guarda o último valor de 'nome' para a combinação de rótulos (None remove a série)."""
+    chave = tuple(sorted(rotulos.items()))
+    with _lock:
+        if valor is None:
+            _valores.get(nome, {}).pop(chave, None)
+        else:
+            _valores.setdefault(nome, {})[chave] = valor
+
+
+def configurar_consultas_lentas(limite_ms, arquivo=None):
+    """Liga (limite em ms) ou desliga (None) o log de consultas lentas em tempo de execução."""
+    with _lock:
+        _lentas['limite_ms'] = limite_ms
+        if arquivo:
+            _lentas['arquivo'] = arquivo
+
+
+def comandos_por_lider():
+    with _lock:
+        return {lider: dados['comandos'] for lider, dados in _lideres.items()}
+
+
+def zerar_metricas():
+    with _lock:
+        _spans.clear()
+        _lideres.clear()
+        _valores.clear()
+        _lentas['registradas'] = 0
+
+
+def metricas():
+    """
+    {'spans': {etapa: {lider: resumo}}, 'lideres': {lider: comandos, linhas, latência},
+     'valores': {nome: [{rótulos..., 'valor'}]}, 'consultas_lentas': {...}}.
+    """
+    with _lock:
+        spans = {}
+        for (nome, lider), histograma in sorted(_spans.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+            spans.setdefault(nome, {})[lider or 'todos'] = histograma.resumo()
+        lideres = {lider: {'comandos': dados['comandos'], 'linhas': dados['linhas'], 'latencia': dados['latencia'].resumo()}
+                   for lider, dados in sorted(_lideres.items(), key=lambda item: str(item[0]))}
+        valores = {nome: [dict(chave, valor=valor) for chave, valor in sorted(series.items())]
+                   for nome, series in sorted(_valores.items())}
+        return {'spans': spans, 'lideres': lideres, 'valores': valores, 'consultas_lentas': dict(_lentas)}
+
+
+def _rotulos(**rotulos):
+    pares = [f'{chave}="{valor}"' for chave, valor in rotulos.items() if valor is not None]
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def _histograma_prometheus(linhas, metrica, histograma, **rotulos):
+    acumulado = 0
+    for limite, contagem in zip(histograma.limites, histograma.contagens):
+        acumulado += contagem
+        linhas.append(f"{metrica}_bucket{_rotulos(**rotulos, le=limite / 1000)} {acumulado}")
+    linhas.append(f"{metrica}_bucket{_rotulos(**rotulos, le='+Inf')} {histograma.total}")
+    linhas.append(f"{metrica}_sum{_rotulos(**rotulos)} {histograma.soma_ms / 1000:.6f}")
+    linhas.append(f"{metrica}_count{_rotulos(**rotulos)} {histograma.total}")
+
+
+def metricas_prometheus():
+    """As mesmas métricas no formato texto de exposição do Prometheus (segundos, como é a convenção)."""
+    with _lock:
+        linhas = ["# HELP lab_span_segundos Duração das etapas instrumentadas.", "# TYPE lab_span_segundos histogram"]
+        for (nome, lider), histograma in sorted(_spans.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+            _histograma_prometheus(linhas, 'lab_span_segundos', histograma, etapa=nome, lider=lider)
+        linhas += ["# HELP lab_comando_segundos Duração dos comandos enviados a cada líder.",
+                   "# TYPE lab_comando_segundos histogram"]
+        for lider, dados in sorted(_lideres.items(), key=lambda item: str(item[0])):
+            _histograma_prometheus(linhas, 'lab_comando_segundos', dados['latencia'], lider=lider)
+        linhas += ["# HELP lab_comandos_total Comandos enviados a cada líder.", "# TYPE lab_comandos_total counter"]
+        linhas += [f"lab_comandos_total{_rotulos(lider=lider)} {dados['comandos']}" for lider, dados in _lideres.items()]
+        linhas += ["# HELP lab_linhas_total Linhas devolvidas ou afetadas pelos comandos.", "# TYPE lab_linhas_total counter"]
+        linhas += [f"lab_linhas_total{_rotulos(lider=lider)} {dados['linhas']}" for lider, dados in _lideres.items()]
+        linhas += ["# HELP lab_consultas_lentas_total Comandos acima de CONSULTA_LENTA_MS.",
+                   "# TYPE lab_consultas_lentas_total counter", f"lab_consultas_lentas_total {_lentas['registradas']}"]
+        for nome, series in sorted(_valores.items()):
+            linhas.append(f"# TYPE {nome} gauge")
+            linhas += [f"{nome}{_rotulos(**dict(chave))} {valor}" for chave, valor in sorted(series.items())]
+    return "\n".join(linhas) + "\n"
+
+
+def exportar_metricas(caminho):
+    """Grava as métricas em 'caminho': formato Prometheus para .prom/.txt, JSON nos demais."""
+    if caminho.lower().endswith(('.prom', '.txt')):
+        conteudo = metricas_prometheus()
+    else:
+        conteudo = json.dumps(metricas(), default=str, ensure_ascii=False, indent=2)
+    with open(caminho, 'w', encoding='utf-8') as arquivo:
+        arquivo.write(conteudo)
+
+
+def exibir_metricas():
+    from prettytable import PrettyTable
+    dados = metricas()
+    print("\n--- Tempo por etapa (spans) ---")
+    table = PrettyTable()
+    table.field_names = ["Etapa", "Líder", "N", "Média (ms)", "p50 (ms)", "p95 (ms)", "p99 (ms)", "Máx (ms)"]
+    table.align = "l"
+    for nome, por_lider in dados['spans'].items():
+        for lider, resumo in por_lider.items():
+            table.add_row([nome, lider, resumo['n'], resumo['media_ms'], resumo['p50_ms'], resumo['p95_ms'],
+                           resumo['p99_ms'], resumo['max_ms']])
+    print(table)
+    print("\n--- Comandos por líder ---")
+    table = PrettyTable()
+    table.field_names = ["Líder", "Comandos", "Linhas", "p50 (ms)", "p95 (ms)", "Máx (ms)"]
+    table.align = "l"
+    for lider, resumo in dados['lideres'].items():
+        latencia = resumo['latencia']
+        table.add_row([lider, resumo['comandos'], resumo['linhas'], latencia['p50_ms'], latencia['p95_ms'], latencia['max_ms']])
+    print(table)
+    lentas = dados['consultas_lentas']
+    if lentas['limite_ms'] is None:
+        print("Log de consultas lentas desligado (CONSULTA_LENTA_MS = None).")
+    else:
+        print(f"🐢 {lentas['registradas']} comando(s) acima de {lentas['limite_ms']}ms registrados em {lentas['arquivo']}.")
@@ -1,24 +1,16 @@
 import psycopg2
-import time
-from app.config import SERVERS, ALL_SERVERS, LOCAL_SERVERS 
-from psycopg2.extras import execute_values 
+import uuid
+from app.config import LOCAL_SERVERS, REAVALIACAO_NO_SERVIDOR
+from app.conexoes import connect_to_db, liberar_conexao, ultimo_erro_conexao
+from app.fanout import executar_em_lideres
+from app.replicacao import novo_lote
+from app.hlc import agora_hlc, observar_hlc
+from app.armazenamento import backend_padrao
+from app.instrumentacao import medir
 
 STATUS_ACEITA = 'ACEITA'
 STATUS_REJEITADA = 'REJEITADA'
 
-def connect_to_db(servidor_id):
-    config = SERVERS.get(servidor_id)
-    if not config:
-        raise ValueError(f"Configuração do servidor {servidor_id} não encontrada.")
-    connect_args = {k: v for k, v in config.items() if k != 'tipo'}
-    connect_args['connect_timeout'] = 5
-    try:
-        conn = psycopg2.connect(**connect_args)
-        return conn
-    except psycopg2.OperationalError as e:
-        print(f"❌ Falha de conexão com {servidor_id}: {e}")
-        return None
-
 def obter_disciplina_id_e_vagas(conn, disciplina_nome):
     cursor = conn.cursor()
     try:
@@ -33,48 +25,139 @@ def obter_disciplina_id_e_vagas(conn, disciplina_nome):
     finally:
         cursor.close()
 
-def consultar_estado_global(disciplina_id):
-    """Consulta o estado global, ignorando matrículas removidas."""
-    todos_registros = []
-    for servidor_id in ALL_SERVERS:
-        conn = connect_to_db(servidor_id)
-        if conn:
-            cursor = conn.cursor()
-            try:
-                cursor.execute("""
-                    SELECT id, nome_aluno, timestamp_matricula, status
-                    FROM matriculas
-                    WHERE disciplina_id = %s AND status != 'REMOVIDA'
-                    ORDER BY timestamp_matricula;
-                """, (disciplina_id,))
-                
-                registros = cursor.fetchall()
-                registros_corrigidos = []
-                for matricula_id, nome, timestamp_db, status in registros:
-                    if timestamp_db and timestamp_db.tzinfo is not None:
-                        timestamp_naive = timestamp_db.replace(tzinfo=None)
-                    else:
-                        timestamp_naive = timestamp_db
-                    registros_corrigidos.append((matricula_id, nome, timestamp_naive, status))
-                todos_registros.extend(registros_corrigidos)
-            except Exception as e:
-                print(f"❌ Erro ao consultar servidor {servidor_id} para estado global: {e}")
-            finally:
-                if cursor: cursor.close()
-                if conn: conn.close()
-    
-    registros_unicos = set(todos_registros) 
+def _ler_fila_no_lider(servidor_id, disciplina_id):
+    """
+    Lê a fila (sem as matrículas removidas) da disciplina em UM líder.
+    As versões lidas alimentam o HLC (app/hlc.py): o próximo timestamp gerado aqui é maior que todas elas.
+    """
+    conn = connect_to_db(servidor_id)
+    if not conn:
+        raise ConnectionError(ultimo_erro_conexao(servidor_id))
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT id, nome_aluno, timestamp_matricula, status, data_ultima_modificacao
+            FROM matriculas
+            WHERE disciplina_id = %s AND status != 'REMOVIDA'
+            ORDER BY timestamp_matricula;
+        """, (disciplina_id,))
+
+        registros_corrigidos = []
+        maior_versao = None
+        for matricula_id, nome, timestamp_db, status, versao in cursor.fetchall():
+            if versao is not None and (maior_versao is None or versao > maior_versao):
+                maior_versao = versao
+            if timestamp_db and timestamp_db.tzinfo is not None:
+                timestamp_naive = timestamp_db.replace(tzinfo=None)
+            else:
+                timestamp_naive = timestamp_db
+            registros_corrigidos.append((matricula_id, nome, timestamp_naive, status))
+        observar_hlc(maior_versao)
+        return registros_corrigidos
+    finally:
+        cursor.close()
+        liberar_conexao(conn)
+
+@medir('consultar_estado_global')
+def consultar_estado_global_detalhado(disciplina_id, prazo=None, backend=None):
+    """
+    Consulta a fila da disciplina em todos os líderes ao mesmo tempo (app/fanout.py),
+    juntando os registros à medida que cada líder responde.
+    Retorna (registros, fanout): 'fanout' informa quais líderes responderam ('respondidos')
+    e quais ficaram de fora ('falharam', 'expirados', 'ignorados'), ou seja, se o resultado é parcial.
+    """
+    backend = backend or backend_padrao()
+    registros_unicos = set()
+    fanout = executar_em_lideres(
+        backend.lideres,
+        lambda servidor_id: backend.ler_fila(servidor_id, disciplina_id),
+        prazo=prazo,
+        contexto="leitura global",
+        ao_chegar=lambda servidor_id, registros: registros_unicos.update(registros),
+    )
+    for servidor_id, erro in fanout['falharam'].items():
+        if isinstance(erro, ConnectionError):
+            print(f"❌ Falha de conexão com {servidor_id}: {erro}")
+        else:
+            print(f"❌ Erro ao consultar servidor {servidor_id} para estado global: {erro}")
+    for servidor_id in fanout['expirados']:
+        print(f"⌛ Líder {servidor_id} não respondeu dentro do prazo da leitura global. (Resultado parcial)")
+
     registros_finais = list(registros_unicos)
-    registros_finais.sort(key=lambda x: x[2]) 
-    return registros_finais
+    registros_finais.sort(key=chave_fila)
+    return registros_finais, fanout
+
+def consultar_estado_global(disciplina_id, backend=None):
+    """Consulta o estado global, ignorando matrículas removidas."""
+    registros, _ = consultar_estado_global_detalhado(disciplina_id, backend=backend)
+    return registros
+
+def chave_fila(registro):
+    """Ordem FCFS: timestamp da matrícula, com o id como desempate (mesma ordem do ROW_NUMBER no SQL)."""
+    return (registro[2], str(registro[0]))
+
+def fila_local_completa(lider_id, registros_globais, fanout):
+    """
+    True se o líder respondeu à leitura global e já possui TODAS as matrículas da fila global,
+    ou seja, se a reavaliação pode ser feita só com os dados dele (reavaliar_posicao_sql).
+    """
+    if lider_id not in fanout['respondidos']:
+        return False
+    ids_locais = {registro[0] for registro in fanout['resultados'][lider_id]}
+    return all(registro[0] in ids_locais for registro in registros_globais)
+
+def fila_assentada(registros_globais, vagas_totais, ocupacao):
+    """
+    True se o contador do líder (vagas_disponiveis) confere com a fila global lida — mesmo tamanho e
+    mesmas ACEITAS — e a fila já está em ordem: as primeiras min(vagas, n) ACEITAS e o resto em espera.
+    Nesse caso a nova matrícula, com HLC maior que todos os timestamps lidos, entra no fim da fila e o
+    contador decide o status sem reavaliar ninguém.
+    """
+    if ocupacao is None:
+        return False
+    vagas_livres, na_fila = ocupacao
+    aceitas = min(vagas_totais, len(registros_globais))
+    return (na_fila == len(registros_globais) and vagas_totais - vagas_livres == aceitas
+            and [r[3] for r in registros_globais] == [STATUS_ACEITA] * aceitas + [STATUS_REJEITADA] * (len(registros_globais) - aceitas))
 
-def reavaliar_posicao(lider_destino, disciplina_id, vagas_totais, nova_tentativa=None, id_a_ignorar=None):
+def reavaliar_posicao_sql(cursor, disciplina_id, vagas_totais, timestamp_modificacao):
+    """
+    Reavaliação da fila feita no próprio servidor, em UM comando:
+    calcula as posições com ROW_NUMBER() e aplica todas as transições ACEITA/REJEITADA
+    num único UPDATE, que devolve apenas as linhas que mudaram.
+    Só é correta quando o líder já possui a fila global completa (ver fila_local_completa).
+    Retorna [(id, nome, status_novo, timestamp_matricula, status_antigo, posicao)].
+    A transação fica aberta: quem chama faz o commit.
+    """
+    cursor.execute("""
+        WITH fila AS (
+            SELECT id, status AS status_antigo,
+                   ROW_NUMBER() OVER (PARTITION BY disciplina_id ORDER BY timestamp_matricula, id) AS posicao
+            FROM matriculas
+            WHERE disciplina_id = %(disciplina_id)s AND status != 'REMOVIDA'
+        ), alvo AS (
+            SELECT id, status_antigo, posicao,
+                   CASE WHEN posicao <= %(vagas)s THEN 'ACEITA' ELSE 'REJEITADA' END AS status_novo
+            FROM fila
+        )
+        UPDATE matriculas m
+        SET status = alvo.status_novo, data_ultima_modificacao = %(ts)s
+        FROM alvo
+        WHERE m.id = alvo.id AND m.status IS DISTINCT FROM alvo.status_novo
+        RETURNING m.id, m.nome_aluno, m.status, m.timestamp_matricula, alvo.status_antigo, alvo.posicao;
+    """, {'disciplina_id': disciplina_id, 'vagas': vagas_totais, 'ts': timestamp_modificacao})
+    return cursor.fetchall()
+
+@medir('reavaliar_posicao')
+def reavaliar_posicao(lider_destino, disciplina_id, vagas_totais, nova_tentativa=None, id_a_ignorar=None, registros_atuais=None, backend=None):
     """
     Reavalia o status de todos os alunos na fila.
     'lider_destino' é usado apenas para a lógica de consulta (embora aqui não seja usado).
+    'registros_atuais' evita uma nova leitura global quando quem chama acabou de fazê-la.
     """
     
-    registros_atuais = consultar_estado_global(disciplina_id)
+    if registros_atuais is None:
+        registros_atuais = consultar_estado_global(disciplina_id, backend=backend)
     updates_a_replicar = []
     
     if id_a_ignorar:
@@ -84,7 +167,7 @@ def reavaliar_posicao(lider_destino, disciplina_id, vagas_totais, nova_tentativa
 
     if nova_tentativa:
         registros_limpos.append(nova_tentativa)
-        registros_limpos.sort(key=lambda x: x[2])
+        registros_limpos.sort(key=chave_fila)
         
     posicao_na_fila = 0
     status_final = None
@@ -106,6 +189,32 @@ def reavaliar_posicao(lider_destino, disciplina_id, vagas_totais, nova_tentativa
     
     return status_final, posicao_na_fila, updates_a_replicar
 
+def atribuir_vagas(registros_atuais, novas, vagas_totais):
+    """
+    Mesma regra FCFS de reavaliar_posicao, para um grupo de matrículas de uma vez (importação e remoção
+    em lote): junta a fila global com as novas tentativas, ordena e recalcula todas as posições numa
+    única passada.
+    Retorna ({id_nova: status}, [(id, novo_status)] das matrículas existentes que mudaram).
+    """
+    ids_novas = {registro[0] for registro in novas}
+    fila = sorted(list(registros_atuais) + list(novas), key=chave_fila)
+    status_novas, mudancas = {}, []
+    for posicao, (matricula_id, _, _, status_antigo) in enumerate(fila, start=1):
+        status_calculado = STATUS_ACEITA if posicao <= vagas_totais else STATUS_REJEITADA
+        if matricula_id in ids_novas:
+            status_novas[matricula_id] = status_calculado
+        elif status_calculado != status_antigo:
+            mudancas.append((matricula_id, status_calculado))
+    return status_novas, mudancas
+
+def _lote_matricula(matricula_id, disciplina_id, aluno_nome, timestamp_utc, status_final, updates_a_replicar):
+    """Lote de replicação de uma matrícula: a nova linha + as mudanças de status da fila (versão = timestamp_utc)."""
+    lote = novo_lote()
+    lote['matriculas'].append((matricula_id, disciplina_id, aluno_nome, timestamp_utc, status_final, timestamp_utc))
+    for old_id, nome, novo_status, ts in updates_a_replicar:
+        lote['status'].append((old_id, novo_status, timestamp_utc))
+    return lote
+
 def matricular_aluno_menu():
     aluno_nome = input("Nome do Aluno: ").strip()
     disciplina_nome = input("Nome da Disciplina: ").strip()
@@ -119,79 +228,87 @@ def matricular_aluno_menu():
     print(f"\n⏳ Tentando matricular {aluno_nome} (Disciplina: {disciplina_nome}) via Líder {lider_entrada}...")
     _processar_matricula(lider_entrada, aluno_nome, disciplina_nome)
 
-def _processar_matricula(lider_entrada, aluno_nome, disciplina_nome):
+@medir('matricula')
+def _processar_matricula(lider_entrada, aluno_nome, disciplina_nome, backend=None):
     """
     Processa a matrícula.
     'lider_entrada' é o ID do servidor local que está recebendo a requisição.
+    'backend' (app/armazenamento.py) padrão: os líderes PostgreSQL.
+    Retorna {'aluno', 'disciplina', 'lider', 'status', 'posicao', 'matricula_id', 'erro'}
+    ('status' None e 'erro' preenchido quando a matrícula não foi gravada).
     """
-    
-    conn = connect_to_db(lider_entrada)
-    if not conn:
+    backend = backend or backend_padrao()
+    resultado = {'aluno': aluno_nome, 'disciplina': disciplina_nome, 'lider': lider_entrada,
+                 'status': None, 'posicao': None, 'matricula_id': None, 'erro': None}
+    sessao = backend.abrir_sessao(lider_entrada)
+    if not sessao:
         print(f"❌ Matrícula falhou: Líder {lider_entrada} está offline.")
-        return
-    cursor = conn.cursor()
+        resultado['erro'] = f"líder {lider_entrada} offline"
+        return resultado
+    trava = None
     try:
-        disciplina_id, vagas_totais = obter_disciplina_id_e_vagas(conn, disciplina_nome)
+        disciplina_id, vagas_totais = sessao.disciplina_por_nome(disciplina_nome)
         if not disciplina_id:
             print(f"❌ Matrícula falhou: Disciplina '{disciplina_nome}' não encontrada ou foi removida.")
-            return
+            resultado['erro'] = "disciplina não encontrada"
+            return resultado
+
+        # Seção crítica da disciplina: leitura global, reavaliação e gravação até o commit
+        trava = sessao.travar([disciplina_id])
 
-        registros_atuais = consultar_estado_global(disciplina_id)
+        registros_atuais, fanout = consultar_estado_global_detalhado(disciplina_id, backend=backend)
         alunos_existentes = {nome for id, nome, ts, status in registros_atuais}
         if aluno_nome in alunos_existentes:
             print(f"❌ REJEITADA! Aluno {aluno_nome} já possui um registro de matrícula (ACEITA ou REJEITADA) na {disciplina_nome}.")
-            return
+            resultado['erro'] = "matrícula duplicada"
+            return resultado
 
-        cursor.execute("SELECT gen_random_uuid(), (NOW() AT TIME ZONE 'UTC')")
-        matricula_id, timestamp_utc = cursor.fetchone()
-        timestamp_naive = timestamp_utc.replace(tzinfo=None)
-        nova_tentativa = (matricula_id, aluno_nome, timestamp_naive, 'PENDENTE')
+        # HLC gerado dentro da seção crítica e depois da leitura global: a ordem da fila é a ordem de entrada
+        # na seção crítica e a versão supera todas as lidas, mesmo com o relógio desta máquina atrasado
+        matricula_id = str(uuid.uuid4())
+        timestamp_utc = agora_hlc()
+        nova_tentativa = (matricula_id, aluno_nome, timestamp_utc, 'PENDENTE')
+
+        fila_completa = REAVALIACAO_NO_SERVIDOR and fila_local_completa(lider_entrada, registros_atuais, fanout)
+        ocupacao = sessao.vagas_disponiveis(disciplina_id) if fila_completa else None
+        if fila_assentada(registros_atuais, vagas_totais, ocupacao):
+            # Caso comum: o contador da disciplina decide ACEITA/fila em O(1) e nenhuma outra matrícula muda
+            vagas_livres, na_fila = ocupacao
+            status_final = STATUS_ACEITA if vagas_livres > 0 else STATUS_REJEITADA
+            posicao_na_fila, updates_a_replicar = na_fila + 1, []
+            print(f"Aluno {aluno_nome} (Novo) -> Status Final: {status_final} (Posição: {posicao_na_fila}/{vagas_totais})")
+            lote = _lote_matricula(matricula_id, disciplina_id, aluno_nome, timestamp_utc, status_final, updates_a_replicar)
+            sessao.aplicar_lote(lote)
+        elif fila_completa:
+            # O líder de entrada já tem a fila global inteira: insere como PENDENTE e deixa o
+            # servidor reposicionar todos com um único UPDATE (sem segunda leitura global).
+            lote_pendente = novo_lote()
+            lote_pendente['matriculas'].append(
+                (matricula_id, disciplina_id, aluno_nome, timestamp_utc, 'PENDENTE', timestamp_utc)
+            )
+            sessao.aplicar_lote(lote_pendente)
+            status_final, posicao_na_fila, updates_a_replicar = None, 0, []
+            for old_id, nome, novo_status, ts, status_antigo, posicao in sessao.reavaliar_fila(
+                disciplina_id, vagas_totais, timestamp_utc
+            ):
+                if old_id == matricula_id:
+                    status_final, posicao_na_fila = novo_status, posicao
+                    print(f"Aluno {nome} (Novo) -> Status Final: {status_final} (Posição: {posicao}/{vagas_totais})")
+                else:
+                    updates_a_replicar.append((old_id, nome, novo_status, ts))
+                    print(f"Status Atualizado: {nome} mudou de {status_antigo} para {novo_status}")
+            lote = _lote_matricula(matricula_id, disciplina_id, aluno_nome, timestamp_utc, status_final, updates_a_replicar)
+        else:
+            status_final, posicao_na_fila, updates_a_replicar = reavaliar_posicao(
+                lider_entrada, disciplina_id, vagas_totais, nova_tentativa, id_a_ignorar=None,
+                registros_atuais=registros_atuais, backend=backend
+            )
+            lote = _lote_matricula(matricula_id, disciplina_id, aluno_nome, timestamp_utc, status_final, updates_a_replicar)
+            sessao.aplicar_lote(lote)
 
-        status_final, posicao_na_fila, updates_a_replicar = reavaliar_posicao(
-            lider_entrada, disciplina_id, vagas_totais, nova_tentativa, id_a_ignorar=None
-        )
-       
-        
-        matr_a_inserir = (
-            matricula_id, disciplina_id, aluno_nome, 
-            timestamp_utc, status_final, timestamp_utc 
-        )
-        
-        insert_query = """
-            INSERT INTO matriculas (id, disciplina_id, nome_aluno, timestamp_matricula, status, data_ultima_modificacao)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            ON CONFLICT (id) DO NOTHING
-        """
-        update_query = "UPDATE matriculas SET status = %s, data_ultima_modificacao = (NOW() AT TIME ZONE 'UTC') WHERE id = %s"
-        
-        cursor.execute(insert_query, matr_a_inserir)
-        for old_id, nome, novo_status, ts in updates_a_replicar:
-            cursor.execute(update_query, (novo_status, old_id))
-        conn.commit()
-        
         print("\n--- Replicação de Matrícula ---")
-        replicacoes_pendentes = [(insert_query, matr_a_inserir)]
-        for old_id, nome, novo_status, ts in updates_a_replicar:
-            replicacoes_pendentes.append((update_query, (novo_status, old_id)))
-
-        for servidor_id in ALL_SERVERS:
-            if servidor_id == lider_entrada: continue
-            replica_conn = connect_to_db(servidor_id)
-            if replica_conn:
-                replica_cursor = replica_conn.cursor()
-                try:
-                    for query, data in replicacoes_pendentes:
-                        replica_cursor.execute(query, data)
-                    replica_conn.commit()
-                    print(f"➡ Replicação SUCESSO (Nova matrícula + {len(updates_a_replicar)} updates) para o Líder {servidor_id}.")
-                except Exception as e:
-                    print(f"❌ Erro ao replicar para {servidor_id}: {e}")
-                    replica_conn.rollback()
-                finally:
-                    if replica_cursor: replica_cursor.close()
-                    if replica_conn: replica_conn.close()
-            else:
-                print(f"❌ Falha de Conexão: Líder {servidor_id} offline. (Replicação pendente)")
+        sessao.comitar_e_replicar(lote, f"Nova matrícula + {len(updates_a_replicar)} updates")
+        resultado.update(status=status_final, posicao=posicao_na_fila, matricula_id=matricula_id)
 
         print(f"\nResultado da Matrícula (Líder {lider_entrada}):")
         if status_final == STATUS_ACEITA:
@@ -199,10 +316,14 @@ def _processar_matricula(lider_entrada, aluno_nome, disciplina_nome):
         else:
             print(f"❌ REJEITADA! Aluno {aluno_nome} rejeitado. (Posição: {posicao_na_fila}/{vagas_totais})")
     except psycopg2.Error as e:
-        conn.rollback()
+        sessao.desfazer()
         print(f"❌ Erro PostgreSQL durante a matrícula: {e}")
+        resultado['erro'] = str(e)
     except Exception as e:
+        sessao.desfazer()
         print(f"❌ Erro inesperado: {e}")
+        resultado['erro'] = str(e)
     finally:
-        if cursor: cursor.close()
-        if conn: conn.close()
\ No newline at end of file
+        sessao.fechar()
+        if trava: trava.liberar()
+    return resultado
\ No newline at end of file
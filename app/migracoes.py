@@ -0,0 +1,193 @@
+import json
+import psycopg2
+from app.config import ALL_SERVERS
+from app.conexoes import connect_to_db, liberar_conexao
+from app.saude_lideres import filtrar_lideres_disponiveis
+from app.ocupacao import SQL_OCUPACAO, SQL_CONTAGEM_REAL
+
+SQL_TABELA_MIGRACOES = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        versao INT PRIMARY KEY,
+        nome VARCHAR(100) NOT NULL,
+        aplicada_em TIMESTAMPTZ DEFAULT (NOW() AT TIME ZONE 'UTC')
+    )
+"""
+
+# (versao, nome, verificacao prévia ou None, SQL). Os mesmos índices estão no init.sql para bancos novos.
+# A verificação, se houver, roda antes da migração; se retornar linhas, a migração é interrompida com elas no erro.
+MIGRACOES = [
+    (1, "indice_fila_por_disciplina", None, """
+        CREATE INDEX IF NOT EXISTS idx_matriculas_fila
+            ON matriculas (disciplina_id, timestamp_matricula, id) WHERE status != 'REMOVIDA'
+    """),
+    (2, "indices_versao_para_sync", None, """
+        CREATE INDEX IF NOT EXISTS idx_matriculas_versao ON matriculas (data_ultima_modificacao, id);
+        CREATE INDEX IF NOT EXISTS idx_disciplinas_versao ON disciplinas (data_ultima_modificacao, id)
+    """),
+    (3, "indice_disciplina_por_nome", None, """
+        CREATE INDEX IF NOT EXISTS idx_disciplinas_nome ON disciplinas (nome)
+    """),
+    # Sem UNIQUE: o mesmo aluno pode se matricular na mesma disciplina em dois líderes (partição, corrida entre
+    # a leitura global e a gravação) e as duas linhas, de ids diferentes, precisam replicar — os upserts da
+    # replicação e do heal só resolvem conflito por id. A duplicata é tratada pela aplicação (verificação global).
+    (4, "indice_matricula_ativa_por_aluno", None, """
+        CREATE INDEX IF NOT EXISTS idx_matriculas_aluno_ativo
+            ON matriculas (disciplina_id, nome_aluno) WHERE status != 'REMOVIDA'
+    """),
+    # Tabela, função e triggers criados na mesma transação da carga inicial, com as escritas bloqueadas
+    (5, "contadores_ocupacao_por_disciplina", None, "LOCK TABLE matriculas IN SHARE MODE;" + SQL_OCUPACAO + f"""
+        DELETE FROM disciplina_ocupacao;
+        INSERT INTO disciplina_ocupacao (disciplina_id, aceitas, em_espera, pendentes, removidas)
+        SELECT c.* FROM ({SQL_CONTAGEM_REAL}) c JOIN disciplinas d ON d.id = c.disciplina_id
+    """),
+    # Bancos que aplicaram a versão 4 antiga (índice único) ficam com o índice comum da versão atual
+    (6, "matricula_ativa_sem_unicidade", None, """
+        DROP INDEX IF EXISTS uq_matriculas_aluno_ativo;
+        CREATE INDEX IF NOT EXISTS idx_matriculas_aluno_ativo
+            ON matriculas (disciplina_id, nome_aluno) WHERE status != 'REMOVIDA'
+    """),
+]
+
+# Formatos das consultas quentes e os índices aceitáveis para cada uma.
+# Os parâmetros são fictícios: o plano não depende do valor, só do formato.
+PLANOS_ESPERADOS = [
+    # Ambos são parciais em status != 'REMOVIDA' e começam por disciplina_id; com poucas linhas o
+    # planejador pode preferir o do aluno + sort, com filas longas o idx_matriculas_fila evita o sort
+    ("fila da disciplina (reavaliação / leitura global)", ("idx_matriculas_fila", "idx_matriculas_aluno_ativo"), """
+        SELECT id, nome_aluno, timestamp_matricula, status FROM matriculas
+        WHERE disciplina_id = %s AND status != 'REMOVIDA' ORDER BY timestamp_matricula
+    """, ('00000000-0000-0000-0000-000000000000',)),
+    ("matrícula ativa do aluno (remoção)", ("idx_matriculas_aluno_ativo",), """
+        SELECT id FROM matriculas WHERE nome_aluno = %s AND disciplina_id = %s AND status != 'REMOVIDA'
+    """, ('aluno', '00000000-0000-0000-0000-000000000000')),
+    ("disciplina por nome", ("idx_disciplinas_nome",), """
+        SELECT id, vagas_totais FROM disciplinas WHERE nome = %s AND (is_deleted IS NULL OR is_deleted = false)
+    """, ('disciplina',)),
+    ("sync incremental de matrículas", ("idx_matriculas_versao",), """
+        SELECT id, data_ultima_modificacao FROM matriculas WHERE data_ultima_modificacao > %s
+    """, ('2000-01-01',)),
+    ("sync incremental de disciplinas", ("idx_disciplinas_versao",), """
+        SELECT id, data_ultima_modificacao FROM disciplinas WHERE data_ultima_modificacao > %s
+    """, ('2000-01-01',)),
+]
+
+
+def garantir_tabela_migracoes(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(SQL_TABELA_MIGRACOES)
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def versoes_aplicadas(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT versao FROM schema_migrations")
+        return {versao for (versao,) in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+
+def aplicar_migracoes_no_servidor(servidor_id):
+    """
+    Aplica, em ordem e cada uma na sua transação, as migrações que ainda não constam em schema_migrations.
+    Para na primeira que falhar (as seguintes podem depender dela). Retorna a lista de versões aplicadas agora.
+    """
+    conn = connect_to_db(servidor_id)
+    if not conn:
+        print(f"❌ Migrações: Líder {servidor_id} inacessível.")
+        return []
+    aplicadas = []
+    cursor = conn.cursor()
+    try:
+        garantir_tabela_migracoes(conn)
+        ja_aplicadas = versoes_aplicadas(conn)
+        for versao, nome, verificacao, sql in MIGRACOES:
+            if versao in ja_aplicadas:
+                continue
+            if verificacao:
+                cursor.execute(verificacao)
+                conflitos = cursor.fetchall()
+                if conflitos:
+                    conn.rollback()
+                    print(f"❌ Migração {versao} ({nome}) não aplicada no Líder {servidor_id}: dados conflitantes {conflitos}.")
+                    print("   (Resolva os registros acima, p.ex. removendo as matrículas duplicadas, e rode de novo.)")
+                    break
+            try:
+                cursor.execute(sql)
+                cursor.execute("INSERT INTO schema_migrations (versao, nome) VALUES (%s, %s)", (versao, nome))
+                conn.commit()
+                aplicadas.append(versao)
+                print(f"✅ Migração {versao} ({nome}) aplicada no Líder {servidor_id}.")
+            except psycopg2.Error as e:
+                conn.rollback()
+                print(f"❌ Migração {versao} ({nome}) falhou no Líder {servidor_id}: {e}")
+                break
+    finally:
+        cursor.close()
+        liberar_conexao(conn)
+    return aplicadas
+
+
+def aplicar_migracoes(servidores_ids=None):
+    """Aplica as migrações pendentes em cada líder disponível. Retorna {servidor_id: [versões aplicadas]}."""
+    disponiveis, _ = filtrar_lideres_disponiveis(servidores_ids or ALL_SERVERS, "migrações")
+    return {servidor_id: aplicar_migracoes_no_servidor(servidor_id) for servidor_id in disponiveis}
+
+
+def _percorrer_plano(no, indices, seq_scans):
+    if 'Index Name' in no:
+        indices.add(no['Index Name'])
+    if no.get('Node Type') == 'Seq Scan':
+        seq_scans.add(no.get('Relation Name'))
+    for filho in no.get('Plans', []):
+        _percorrer_plano(filho, indices, seq_scans)
+
+
+def verificar_planos(servidor_id):
+    """
+    Regressão de planos: roda EXPLAIN de cada consulta quente com enable_seqscan=off e confere se o
+    plano usa um dos índices esperados, sem nenhum Seq Scan. Em tabelas pequenas o planejador prefere
+    seq scan de qualquer forma; desligá-lo mostra se o índice é UTILIZÁVEL pelo formato da consulta
+    (predicado parcial, ordem das colunas), que é o que quebra quando alguém muda a consulta ou o índice.
+    Retorna [(descricao, indices_esperados, ok, indices_usados)].
+    """
+    conn = connect_to_db(servidor_id)
+    if not conn:
+        return []
+    resultados = []
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SET LOCAL enable_seqscan = off")
+        for descricao, indices, sql, params in PLANOS_ESPERADOS:
+            cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+            plano = cursor.fetchone()[0]
+            if isinstance(plano, str):
+                plano = json.loads(plano)
+            usados, seq_scans = set(), set()
+            _percorrer_plano(plano[0]['Plan'], usados, seq_scans)
+            ok = bool(usados & set(indices)) and not seq_scans
+            resultados.append((descricao, indices, ok, sorted(usados) + [f"seq scan em {t}" for t in sorted(seq_scans)]))
+    finally:
+        conn.rollback()
+        cursor.close()
+        liberar_conexao(conn)
+    return resultados
+
+
+def verificar_planos_menu():
+    aplicar_migracoes()
+    disponiveis, _ = filtrar_lideres_disponiveis(ALL_SERVERS, "verificação de planos")
+    for servidor_id in disponiveis:
+        print(f"\n--- Planos das consultas quentes no Líder {servidor_id} ---")
+        resultados = verificar_planos(servidor_id)
+        if not resultados:
+            print(f"❌ Líder {servidor_id} inacessível.")
+            continue
+        for descricao, indices, ok, usados in resultados:
+            if ok:
+                print(f"✅ {descricao}: usa {', '.join(usados)}")
+            else:
+                print(f"❌ {descricao}: esperado {' ou '.join(indices)}, plano usa {usados or 'nenhum índice'}")
@@ -0,0 +1,243 @@
+import time
+from datetime import datetime, timezone
+from app.config import ALL_SERVERS, LOCAL_SERVERS, REPLICACAO_MODO, MONITOR_INTERVALO, MONITOR_OUTBOX_IDADE_MAXIMA
+from app.conexoes import connect_to_db, liberar_conexao, ultimo_erro_conexao
+from app.fanout import executar_em_lideres
+from app.instrumentacao import medir, registrar_valor
+from app.sincronizacao import ORDEM_SYNC, resumo_tabelas
+
+# Foto de cada líder, calculada no servidor (poucas linhas trafegam): contagem e maior versão de cada tabela
+# sincronizada, um digest por disciplina e as pendências da outbox por destino. O digest cobre o que o heal
+# converge: a linha da disciplina e, se ela não foi removida, a fila (id, status, versão) sem as matrículas
+# com tombstone. A diferença entre as maiores versões (HLC, app/hlc.py) é o atraso de um líder em relação ao outro.
+SQL_DIGESTS_DISCIPLINAS = """
+    SELECT d.id::text, d.nome,
+           md5(concat_ws('|', d.nome, d.vagas_totais, COALESCE(d.is_deleted, false),
+                         (EXTRACT(EPOCH FROM d.data_ultima_modificacao) * 1000000)::bigint, f.digest))
+    FROM disciplinas d
+    LEFT JOIN (
+        SELECT m.disciplina_id,
+               md5(string_agg(
+                   m.id::text || ':' || m.status || ':'
+                   || (EXTRACT(EPOCH FROM m.data_ultima_modificacao) * 1000000)::bigint::text,
+                   ',' ORDER BY m.id
+               )) AS digest
+        FROM matriculas m
+        WHERE NOT EXISTS (SELECT 1 FROM deleted_matriculas t WHERE t.id = m.id)
+        GROUP BY m.disciplina_id
+    ) f ON f.disciplina_id = d.id AND NOT COALESCE(d.is_deleted, false)
+"""
+
+SQL_OUTBOX = """
+    SELECT destino, COUNT(*), EXTRACT(EPOCH FROM (NOW() AT TIME ZONE 'UTC') - MIN(criado_em)), MAX(tentativas)
+    FROM replication_outbox
+    GROUP BY destino
+"""
+
+SITUACAO_EM_DIA = 'em_dia'
+SITUACAO_REPLICANDO = 'replicando'
+SITUACAO_HEAL = 'heal'
+SITUACAO_OFFLINE = 'offline'
+
+
+def _foto_lider(servidor_id):
+    conn = connect_to_db(servidor_id)
+    if not conn:
+        raise ConnectionError(ultimo_erro_conexao(servidor_id))
+    cursor = conn.cursor()
+    try:
+        tabelas = resumo_tabelas(conn)
+        cursor.execute(SQL_DIGESTS_DISCIPLINAS)
+        disciplinas = {disciplina_id: (nome, digest) for disciplina_id, nome, digest in cursor.fetchall()}
+        outbox = {}
+        # O monitor só lê: não cria a outbox em líderes que ainda não a têm
+        cursor.execute("SELECT to_regclass('replication_outbox') IS NOT NULL")
+        if cursor.fetchone()[0]:
+            cursor.execute(SQL_OUTBOX)
+            outbox = {destino: {'pendentes': pendentes, 'idade_s': round(float(idade or 0), 1), 'tentativas_max': tentativas}
+                      for destino, pendentes, idade, tentativas in cursor.fetchall()}
+    finally:
+        conn.rollback()
+        cursor.close()
+        liberar_conexao(conn)
+    captura = {}
+    if REPLICACAO_MODO == 'captura':
+        from app.captura_mudancas import estado_captura
+        captura = estado_captura(servidor_id)
+    return {'tabelas': tabelas, 'disciplinas': disciplinas, 'outbox': outbox, 'captura': captura}
+
+
+def _comparar(lider_local, peer, foto_local, foto_peer):
+    """Divergência do peer em relação ao líder local. atraso_s > 0: o peer está atrás; < 0: o local está atrás."""
+    tabelas = {}
+    for tabela in ORDEM_SYNC:
+        linhas_local, versao_local = foto_local['tabelas'][tabela]
+        linhas_peer, versao_peer = foto_peer['tabelas'][tabela]
+        atraso = None
+        if versao_local is not None and versao_peer is not None:
+            atraso = round((versao_local - versao_peer).total_seconds(), 3)
+        tabelas[tabela] = {'linhas_local': linhas_local, 'linhas_peer': linhas_peer, 'atraso_s': atraso}
+
+    local, remoto = foto_local['disciplinas'], foto_peer['disciplinas']
+    divergentes = sorted((local.get(d) or remoto.get(d))[0] for d in set(local) | set(remoto) if local.get(d) != remoto.get(d))
+
+    em_transito = [o for o in (foto_local['outbox'].get(peer), foto_peer['outbox'].get(lider_local)) if o]
+    slots = []
+    if REPLICACAO_MODO == 'captura':
+        from app.captura_mudancas import nome_slot
+        slots = [slot for slot in (foto_local['captura'].get(nome_slot(lider_local, peer)),
+                                   foto_peer['captura'].get(nome_slot(peer, lider_local)))
+                 if slot and slot[0] and slot[1]]
+    # Linhas e versões das tabelas de dados entram na foto só como indicador: matrículas de disciplinas removidas
+    # ou com tombstone podem sobrar num líder sem mudar o que os alunos veem. Tombstones faltando, não.
+    iguais = not divergentes and all(
+        tabelas[tabela]['linhas_local'] == tabelas[tabela]['linhas_peer'] for tabela in ('deleted_disciplinas', 'deleted_matriculas')
+    )
+    if iguais:
+        situacao = SITUACAO_EM_DIA
+    elif (em_transito and max(o['idade_s'] for o in em_transito) <= MONITOR_OUTBOX_IDADE_MAXIMA) or slots:
+        # A diferença pode ser só o que ainda está a caminho; o heal só se a replicação não resolver
+        situacao = SITUACAO_REPLICANDO
+    else:
+        situacao = SITUACAO_HEAL
+    return {
+        'situacao': situacao,
+        'disciplinas_divergentes': divergentes,
+        'tabelas': tabelas,
+        'outbox_para_peer': foto_local['outbox'].get(peer),
+        'outbox_do_peer': foto_peer['outbox'].get(lider_local),
+    }
+
+
+def _publicar(resultado):
+    """Atualiza os gauges de app/instrumentacao.py (GET /metricas, --metricas)."""
+    for peer, dados in resultado['peers'].items():
+        registrar_valor('lab_heal_recomendado', int(dados['situacao'] == SITUACAO_HEAL), peer=peer)
+        registrar_valor('lab_peer_online', int(dados['situacao'] != SITUACAO_OFFLINE), peer=peer)
+        if dados['situacao'] == SITUACAO_OFFLINE:
+            continue
+        registrar_valor('lab_disciplinas_divergentes', len(dados['disciplinas_divergentes']), peer=peer)
+        for tabela, t in dados['tabelas'].items():
+            registrar_valor('lab_atraso_versao_segundos', t['atraso_s'], peer=peer, tabela=tabela)
+            registrar_valor('lab_diferenca_linhas', t['linhas_local'] - t['linhas_peer'], peer=peer, tabela=tabela)
+    for origem, destinos in resultado['outbox'].items():
+        for destino in ALL_SERVERS:
+            pendencia = destinos.get(destino) or {'pendentes': 0, 'idade_s': 0.0}
+            if destino != origem:
+                registrar_valor('lab_outbox_pendentes', pendencia['pendentes'], origem=origem, destino=destino)
+                registrar_valor('lab_outbox_idade_segundos', pendencia['idade_s'], origem=origem, destino=destino)
+
+
+def medir_divergencia(lider_local=None):
+    """
+    Mede, sem copiar nada, o quanto cada peer difere do líder local: linhas e atraso de versão por tabela,
+    disciplinas cujas filas diferem (digest) e a outbox entre os dois. Situação de cada peer:
+    'em_dia', 'replicando' (diferença explicada por entregas pendentes há menos de MONITOR_OUTBOX_IDADE_MAXIMA),
+    'heal' (divergência que a replicação não vai resolver sozinha) ou 'offline'.
+    Retorna {'lider_local', 'medido_em', 'peers': {peer: ...}, 'outbox': {líder: {destino: ...}},
+    'heal_recomendado', 'erro'}.
+    """
+    lider_local = lider_local or LOCAL_SERVERS[0]
+    with medir('monitor_divergencia'):
+        fanout = executar_em_lideres(ALL_SERVERS, _foto_lider, contexto="monitor de divergência")
+    fotos = fanout['resultados']
+    resultado = {'lider_local': lider_local, 'medido_em': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                 'peers': {}, 'outbox': {lider: foto['outbox'] for lider, foto in fotos.items()},
+                 'heal_recomendado': False, 'erro': None}
+    if lider_local not in fotos:
+        resultado['erro'] = f"líder local {lider_local} não respondeu"
+        return resultado
+    for peer in ALL_SERVERS:
+        if peer == lider_local:
+            continue
+        if peer in fotos:
+            resultado['peers'][peer] = _comparar(lider_local, peer, fotos[lider_local], fotos[peer])
+        else:
+            resultado['peers'][peer] = {'situacao': SITUACAO_OFFLINE}
+    resultado['heal_recomendado'] = any(p['situacao'] == SITUACAO_HEAL for p in resultado['peers'].values())
+    _publicar(resultado)
+    return resultado
+
+
+def precisa_heal():
+    """Para o início do menu (SYNC_AO_INICIAR = 'se_divergente'): True se algum peer alcançável precisa de heal."""
+    resultado = medir_divergencia()
+    for peer, dados in resultado['peers'].items():
+        if dados['situacao'] != SITUACAO_EM_DIA:
+            print(f"🔎 Líder {peer}: {dados['situacao']}.")
+    return resultado['heal_recomendado']
+
+
+def _linha_peer(peer, dados):
+    situacao = dados['situacao']
+    if situacao == SITUACAO_OFFLINE:
+        return f"⚫ Líder {peer}: offline."
+    atrasos = [t['atraso_s'] for t in dados['tabelas'].values() if t['atraso_s']]
+    atraso = max(atrasos, key=abs) if atrasos else 0
+    outbox = [o for o in (dados['outbox_para_peer'], dados['outbox_do_peer']) if o]
+    detalhe = (f"{len(dados['disciplinas_divergentes'])} disciplina(s) divergentes, atraso de versão {atraso}s, "
+               f"outbox {sum(o['pendentes'] for o in outbox)} pendente(s)")
+    if situacao == SITUACAO_EM_DIA:
+        return f"🟢 Líder {peer}: em dia."
+    if situacao == SITUACAO_REPLICANDO:
+        return f"🟡 Líder {peer}: replicando ({detalhe})."
+    return f"🔴 Líder {peer}: heal recomendado ({detalhe})."
+
+
+def exibir_divergencia(resultado):
+    from prettytable import PrettyTable
+    print(f"\n--- Divergência em relação ao Líder {resultado['lider_local']} ({resultado['medido_em']}) ---")
+    if resultado['erro']:
+        print(f"❌ {resultado['erro']}")
+        return
+    for peer, dados in resultado['peers'].items():
+        print(_linha_peer(peer, dados))
+        if dados['situacao'] == SITUACAO_OFFLINE:
+            continue
+        table = PrettyTable()
+        table.field_names = ["Tabela", f"Linhas ({resultado['lider_local']})", f"Linhas ({peer})", "Atraso de versão (s)"]
+        table.align = "l"
+        for tabela, t in dados['tabelas'].items():
+            table.add_row([tabela, t['linhas_local'], t['linhas_peer'], t['atraso_s']])
+        print(table)
+        if dados['disciplinas_divergentes']:
+            mostradas = dados['disciplinas_divergentes'][:10]
+            resto = len(dados['disciplinas_divergentes']) - len(mostradas)
+            print("Filas divergentes: " + ", ".join(mostradas) + (f" (+{resto})" if resto > 0 else ""))
+    for origem, destinos in resultado['outbox'].items():
+        for destino, pendencia in destinos.items():
+            print(f"📤 Outbox {origem} -> {destino}: {pendencia['pendentes']} pendente(s), a mais antiga há "
+                  f"{pendencia['idade_s']}s ({pendencia['tentativas_max']} tentativa(s)).")
+    if resultado['heal_recomendado']:
+        print("👉 Heal recomendado (opção 10 do menu ou `python main.py heal`).")
+
+
+def monitorar(intervalo=MONITOR_INTERVALO, rodadas=None, arquivo_metricas=None, lider_local=None):
+    """
+    Modo contínuo: uma medição a cada 'intervalo' segundos (até 'rodadas', ou Ctrl+C), uma linha por peer.
+    Com 'arquivo_metricas' as métricas (app/instrumentacao.py) são regravadas a cada rodada, para um
+    coletor externo (p.ex. o textfile collector do node_exporter). Retorna a última medição.
+    """
+    from app.instrumentacao import exportar_metricas
+    resultado, rodada = None, 0
+    try:
+        while rodadas is None or rodada < rodadas:
+            if rodada:
+                time.sleep(intervalo)
+            rodada += 1
+            resultado = medir_divergencia(lider_local)
+            if resultado['erro']:
+                print(f"❌ {resultado['medido_em']}: {resultado['erro']}")
+            else:
+                print(f"🔎 {resultado['medido_em']}: " + " | ".join(
+                    _linha_peer(peer, dados) for peer, dados in resultado['peers'].items()
+                ))
+            if arquivo_metricas:
+                exportar_metricas(arquivo_metricas)
+    except KeyboardInterrupt:
+        print("\nMonitor encerrado.")
+    return resultado
+
+
+def monitor_divergencia_menu():
+    exibir_divergencia(medir_divergencia())
@@ -0,0 +1,174 @@
+import psycopg2
+from app.config import ALL_SERVERS
+from app.conexoes import connect_to_db, liberar_conexao
+from app.saude_lideres import filtrar_lideres_disponiveis
+
+# Contadores por disciplina mantidos por triggers de COMANDO (transition tables): um INSERT/UPDATE em
+# lote (replicação, sync, captura) gera um único upsert agregado por disciplina, e todo caminho que
+# escreve em 'matriculas' mantém os contadores sem precisar lembrar deles.
+SQL_OCUPACAO = """
+    CREATE TABLE IF NOT EXISTS disciplina_ocupacao (
+        disciplina_id UUID PRIMARY KEY REFERENCES disciplinas(id) ON DELETE CASCADE,
+        aceitas INT NOT NULL DEFAULT 0,
+        em_espera INT NOT NULL DEFAULT 0,
+        pendentes INT NOT NULL DEFAULT 0,
+        removidas INT NOT NULL DEFAULT 0
+    );
+
+    CREATE OR REPLACE FUNCTION atualizar_disciplina_ocupacao() RETURNS trigger AS $$
+    DECLARE
+        delta TEXT;
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            delta := 'SELECT disciplina_id, status, COUNT(*) AS n FROM novas GROUP BY 1, 2';
+        ELSIF TG_OP = 'UPDATE' THEN
+            delta := 'SELECT disciplina_id, status, COUNT(*) AS n FROM novas GROUP BY 1, 2
+                      UNION ALL
+                      SELECT disciplina_id, status, -COUNT(*) FROM antigas GROUP BY 1, 2';
+        ELSE
+            delta := 'SELECT disciplina_id, status, -COUNT(*) AS n FROM antigas GROUP BY 1, 2';
+        END IF;
+
+        -- Ordenado por disciplina para que transações concorrentes travem os contadores na mesma ordem
+        EXECUTE format($sql$
+            INSERT INTO disciplina_ocupacao AS o (disciplina_id, aceitas, em_espera, pendentes, removidas)
+            SELECT disciplina_id,
+                   COALESCE(SUM(n) FILTER (WHERE status = 'ACEITA'), 0),
+                   COALESCE(SUM(n) FILTER (WHERE status = 'REJEITADA'), 0),
+                   COALESCE(SUM(n) FILTER (WHERE status = 'PENDENTE'), 0),
+                   COALESCE(SUM(n) FILTER (WHERE status = 'REMOVIDA'), 0)
+            FROM (%s) delta
+            WHERE disciplina_id IS NOT NULL
+            GROUP BY disciplina_id
+            HAVING bool_or(n <> 0)
+            ORDER BY disciplina_id
+            ON CONFLICT (disciplina_id) DO UPDATE SET
+                aceitas = o.aceitas + EXCLUDED.aceitas,
+                em_espera = o.em_espera + EXCLUDED.em_espera,
+                pendentes = o.pendentes + EXCLUDED.pendentes,
+                removidas = o.removidas + EXCLUDED.removidas
+        $sql$, delta);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_ocupacao_insert ON matriculas;
+    DROP TRIGGER IF EXISTS trg_ocupacao_update ON matriculas;
+    DROP TRIGGER IF EXISTS trg_ocupacao_delete ON matriculas;
+    CREATE TRIGGER trg_ocupacao_insert AFTER INSERT ON matriculas
+        REFERENCING NEW TABLE AS novas FOR EACH STATEMENT EXECUTE FUNCTION atualizar_disciplina_ocupacao();
+    CREATE TRIGGER trg_ocupacao_update AFTER UPDATE ON matriculas
+        REFERENCING OLD TABLE AS antigas NEW TABLE AS novas FOR EACH STATEMENT EXECUTE FUNCTION atualizar_disciplina_ocupacao();
+    CREATE TRIGGER trg_ocupacao_delete AFTER DELETE ON matriculas
+        REFERENCING OLD TABLE AS antigas FOR EACH STATEMENT EXECUTE FUNCTION atualizar_disciplina_ocupacao();
+"""
+
+# Contagem "do zero", usada para reconstruir e para conferir os contadores
+SQL_CONTAGEM_REAL = """
+    SELECT disciplina_id,
+           COUNT(*) FILTER (WHERE status = 'ACEITA') AS aceitas,
+           COUNT(*) FILTER (WHERE status = 'REJEITADA') AS em_espera,
+           COUNT(*) FILTER (WHERE status = 'PENDENTE') AS pendentes,
+           COUNT(*) FILTER (WHERE status = 'REMOVIDA') AS removidas
+    FROM matriculas
+    WHERE disciplina_id IS NOT NULL
+    GROUP BY disciplina_id
+"""
+
+
+def vagas_disponiveis(conn, disciplina_id, travar=False):
+    """
+    Vagas totais menos as ACEITAS e o tamanho da fila (aceitas, em espera e pendentes), lidos do contador:
+    uma linha por PK, sem varrer matrículas. Retorna (vagas_livres, na_fila) ou None se a disciplina não existe.
+    travar=True trava a linha do contador até o fim da transação: os triggers de quem escreve nessa
+    disciplina esperam, então o valor lido continua valendo até o commit.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT d.vagas_totais - COALESCE(o.aceitas, 0), COALESCE(o.aceitas + o.em_espera + o.pendentes, 0)
+            FROM disciplinas d
+            LEFT JOIN LATERAL (
+                SELECT aceitas, em_espera, pendentes FROM disciplina_ocupacao
+                WHERE disciplina_id = d.id {'FOR UPDATE' if travar else ''}
+            ) o ON true
+            WHERE d.id = %s
+        """, (disciplina_id,))
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+
+
+def reconstruir_ocupacao(servidor_id):
+    """
+    Recalcula todos os contadores a partir de 'matriculas'. O LOCK em modo SHARE bloqueia escritas durante
+    a reconstrução (leituras continuam), então nenhuma mudança fica de fora nem é contada duas vezes.
+    """
+    conn = connect_to_db(servidor_id)
+    if not conn:
+        print(f"❌ Líder {servidor_id} inacessível para reconstruir a ocupação.")
+        return False
+    cursor = conn.cursor()
+    try:
+        cursor.execute("LOCK TABLE matriculas IN SHARE MODE")
+        cursor.execute("DELETE FROM disciplina_ocupacao")
+        cursor.execute(f"""
+            INSERT INTO disciplina_ocupacao (disciplina_id, aceitas, em_espera, pendentes, removidas)
+            SELECT c.* FROM ({SQL_CONTAGEM_REAL}) c JOIN disciplinas d ON d.id = c.disciplina_id
+        """)
+        conn.commit()
+        print(f"✅ Ocupação reconstruída no Líder {servidor_id} ({cursor.rowcount} disciplinas com matrículas).")
+        return True
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"❌ Erro ao reconstruir a ocupação no Líder {servidor_id}: {e}")
+        return False
+    finally:
+        cursor.close()
+        liberar_conexao(conn)
+
+
+def verificar_ocupacao(servidor_id):
+    """
+    Compara os contadores com a contagem real. Retorna [(disciplina_id, contador, real)] das divergentes
+    (tuplas aceitas/em_espera/pendentes/removidas), ou None se o líder estiver inacessível.
+    """
+    conn = connect_to_db(servidor_id)
+    if not conn:
+        return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            WITH real AS ({SQL_CONTAGEM_REAL}), comparacao AS (
+                SELECT COALESCE(o.disciplina_id, r.disciplina_id) AS disciplina_id,
+                       ARRAY[COALESCE(o.aceitas, 0), COALESCE(o.em_espera, 0),
+                             COALESCE(o.pendentes, 0), COALESCE(o.removidas, 0)] AS contador,
+                       ARRAY[COALESCE(r.aceitas, 0), COALESCE(r.em_espera, 0),
+                             COALESCE(r.pendentes, 0), COALESCE(r.removidas, 0)]::int[] AS real
+                FROM disciplina_ocupacao o
+                FULL JOIN real r ON r.disciplina_id = o.disciplina_id
+            )
+            SELECT disciplina_id, contador, real FROM comparacao WHERE contador <> real
+        """)
+        return [(disciplina_id, tuple(contador), tuple(real)) for disciplina_id, contador, real in cursor.fetchall()]
+    finally:
+        conn.rollback()
+        cursor.close()
+        liberar_conexao(conn)
+
+
+def verificar_ocupacao_menu():
+    disponiveis, _ = filtrar_lideres_disponiveis(ALL_SERVERS, "verificação da ocupação")
+    for servidor_id in disponiveis:
+        print(f"\n--- Contadores de ocupação no Líder {servidor_id} ---")
+        divergentes = verificar_ocupacao(servidor_id)
+        if divergentes is None:
+            print(f"❌ Líder {servidor_id} inacessível.")
+            continue
+        if not divergentes:
+            print("✅ Contadores conferem com as matrículas.")
+            continue
+        for disciplina_id, contador, real in divergentes[:10]:
+            print(f"❌ Disciplina {disciplina_id}: contador (aceitas, espera, pendentes, removidas)={contador} real={real}")
+        print(f"⚠️ {len(divergentes)} disciplina(s) divergente(s). Reconstruindo...")
+        reconstruir_ocupacao(servidor_id)
@@ -0,0 +1,346 @@
+import atexit
+import json
+import threading
+import psycopg2
+from psycopg2.extras import Json
+from app.config import (
+    ALL_SERVERS, LOCAL_SERVERS, REPLICACAO_MODO, OUTBOX_INTERVALO, OUTBOX_LOTE_MAXIMO,
+    OUTBOX_BACKOFF_INICIAL, OUTBOX_BACKOFF_MAXIMO,
+)
+from app.conexoes import connect_to_db, liberar_conexao
+from app.saude_lideres import circuito_aberto
+from app.replicacao import novo_lote, aplicar_lote, replicar_lote, status_sem_base
+from app.instrumentacao import medir
+
+SQL_TABELA_OUTBOX = """
+    CREATE TABLE IF NOT EXISTS replication_outbox (
+        id BIGSERIAL PRIMARY KEY,
+        destino VARCHAR(20) NOT NULL,
+        descricao TEXT,
+        lote JSONB NOT NULL,
+        criado_em TIMESTAMPTZ DEFAULT (NOW() AT TIME ZONE 'UTC'),
+        tentativas INT NOT NULL DEFAULT 0,
+        proxima_tentativa TIMESTAMPTZ NOT NULL DEFAULT (NOW() AT TIME ZONE 'UTC'),
+        ultimo_erro TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_replication_outbox_destino ON replication_outbox (destino, id)
+"""
+
+_tabelas_garantidas = set()
+_tabelas_lock = threading.Lock()
+
+
+def garantir_tabela_outbox(servidor_id):
+    """
+    Cria a outbox em bancos inicializados antes dela existir no init.sql (uma vez por líder e processo).
+    Usa uma conexão própria para não comitar a transação de quem está enfileirando.
+    """
+    with _tabelas_lock:
+        if servidor_id in _tabelas_garantidas:
+            return
+        conn = connect_to_db(servidor_id)
+        if not conn:
+            return
+        cursor = conn.cursor()
+        try:
+            cursor.execute(SQL_TABELA_OUTBOX)
+            conn.commit()
+            _tabelas_garantidas.add(servidor_id)
+        finally:
+            cursor.close()
+            liberar_conexao(conn)
+
+
+def _serializar(lote):
+    # UUIDs e datetimes viram texto; montar_sql_lote faz o cast (::uuid, ::timestamptz) na aplicação
+    return json.loads(json.dumps(lote, default=str))
+
+
+def enfileirar_lote(conn, lote, lider_origem, descricao="lote", destinos=None):
+    """
+    Grava o lote na outbox do líder de origem, uma linha por peer (padrão: todos os outros líderes),
+    DENTRO da transação de quem chama: o commit local e a intenção de replicar são atômicos.
+    Retorna a lista de destinos.
+    """
+    if destinos is None:
+        destinos = [s for s in ALL_SERVERS if s != lider_origem]
+    if not destinos:
+        return []
+    garantir_tabela_outbox(lider_origem)
+    cursor = conn.cursor()
+    try:
+        dados = Json(_serializar(lote))
+        for destino in destinos:
+            cursor.execute(
+                "INSERT INTO replication_outbox (destino, descricao, lote) VALUES (%s, %s, %s)",
+                (destino, descricao, dados),
+            )
+    finally:
+        cursor.close()
+    return destinos
+
+
+def comitar_e_replicar(conn, lote, lider_origem, descricao="lote"):
+    """
+    Faz o commit local e dispara a replicação do lote segundo REPLICACAO_MODO:
+    - 'outbox': o lote entra na outbox na MESMA transação e o expedidor entrega em segundo plano
+      (a resposta ao cliente não espera pelos peers e nada se perde se um deles estiver offline);
+    - 'sincrona': commit e envio imediato a cada peer (replicar_lote);
+    - 'captura': só o commit; os consumidores de replicação lógica propagam a mudança.
+    """
+    if REPLICACAO_MODO == 'captura':
+        # O WAL do commit local é lido pelos consumidores de captura e aplicado nos peers
+        conn.commit()
+        print(f"🔁 Replicação ({descricao}) será propagada pela captura de mudanças (WAL).")
+        return {}
+    if REPLICACAO_MODO != 'outbox':
+        conn.commit()
+        return replicar_lote(lote, lider_origem, descricao)
+    destinos = enfileirar_lote(conn, lote, lider_origem, descricao)
+    conn.commit()
+    notificar_expedidor()
+    if destinos:
+        print(f"📤 Replicação ({descricao}) enfileirada na outbox para: {', '.join(destinos)}.")
+    return {destino: None for destino in destinos}
+
+
+def enfileirar_pendentes(lider_origem, lote, destinos, descricao="lote"):
+    """
+    Para operações que já escrevem em todos os líderes diretamente (disciplinas): guarda na outbox do
+    líder de origem só os destinos que falharam, para o expedidor entregar quando voltarem.
+    """
+    if not destinos:
+        return []
+    conn = connect_to_db(lider_origem)
+    if not conn:
+        return []
+    try:
+        enfileirar_lote(conn, lote, lider_origem, descricao, destinos)
+        conn.commit()
+        notificar_expedidor()
+        print(f"📤 Replicação ({descricao}) enfileirada na outbox para: {', '.join(destinos)}.")
+        return destinos
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"❌ Erro ao enfileirar replicação na outbox do Líder {lider_origem}: {e}")
+        return []
+    finally:
+        liberar_conexao(conn)
+
+
+def _juntar_lotes(lotes):
+    """Concatena lotes na ordem da outbox; duplicatas por id ficam com a maior versão (montar_sql_lote) e o LWW no destino."""
+    combinado = novo_lote()
+    for lote in lotes:
+        for chave, linhas in lote.items():
+            combinado.setdefault(chave, []).extend(linhas)
+    return combinado
+
+
+# Entrada com mudança de status de uma matrícula que o destino ainda não tem: fica pendente até a linha chegar
+ERRO_SEM_BASE = "matrícula ainda não replicada no destino"
+
+
+def _resumo_erro(erro):
+    return str(erro).strip().splitlines()[0] if str(erro).strip() else type(erro).__name__
+
+
+def _enviar(destino, pendentes):
+    """
+    Aplica as entradas (id, lote) no destino. Primeiro tenta todas juntas num único round trip; se o destino
+    recusar o lote (ex.: FK de uma disciplina que ainda não chegou), aplica entrada por entrada para que uma
+    entrada problemática não bloqueie as demais. Entradas com mudança de status de uma matrícula que o destino
+    ainda não tem também não contam como entregues (ERRO_SEM_BASE): o resto foi aplicado e reaplicar é
+    inofensivo (LWW). Retorna {id: erro} das que não foram entregues.
+    """
+    conn_destino = connect_to_db(destino)
+    if not conn_destino:
+        return {id_: "líder offline" for id_, _ in pendentes}
+    try:
+        try:
+            faltando = aplicar_lote(conn_destino, _juntar_lotes(lote for _, lote in pendentes))
+            return {id_: ERRO_SEM_BASE for id_, lote in pendentes if status_sem_base(lote, faltando)}
+        except psycopg2.OperationalError as e:
+            return {id_: _resumo_erro(e) for id_, _ in pendentes}
+        except psycopg2.Error as e:
+            if len(pendentes) == 1:
+                return {pendentes[0][0]: _resumo_erro(e)}
+
+        falhas = {}
+        for posicao, (id_, lote) in enumerate(pendentes):
+            try:
+                if aplicar_lote(conn_destino, lote):
+                    falhas[id_] = ERRO_SEM_BASE
+            except psycopg2.OperationalError as e:
+                # Conexão perdida: esta e as seguintes ficam para a próxima rodada
+                falhas.update({id_restante: _resumo_erro(e) for id_restante, _ in pendentes[posicao:]})
+                break
+            except psycopg2.Error as e:
+                falhas[id_] = _resumo_erro(e)
+        return falhas
+    finally:
+        liberar_conexao(conn_destino)
+
+
+def _agrupar_falhas(falhas):
+    agrupadas = {}
+    for id_, erro in falhas.items():
+        agrupadas.setdefault(erro, []).append(id_)
+    return agrupadas
+
+
+def drenar_destino(conn_local, destino):
+    """
+    Envia ao destino, em um único round trip (normalmente), todas as entradas pendentes (até OUTBOX_LOTE_MAXIMO) e as remove da outbox.
+    As linhas ficam travadas (FOR UPDATE SKIP LOCKED) enquanto isso, então vários processos podem drenar a
+    mesma outbox. Em caso de falha as entradas ganham backoff exponencial. Retorna quantas foram entregues.
+    """
+    cursor = conn_local.cursor()
+    try:
+        cursor.execute("""
+            SELECT id, lote FROM replication_outbox
+            WHERE destino = %s AND proxima_tentativa <= (NOW() AT TIME ZONE 'UTC')
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (destino, OUTBOX_LOTE_MAXIMO))
+        pendentes = cursor.fetchall()
+        if not pendentes:
+            conn_local.rollback()
+            return 0
+        falhas = _enviar(destino, pendentes)
+        entregues = [id_ for id_, _ in pendentes if id_ not in falhas]
+        if entregues:
+            cursor.execute("DELETE FROM replication_outbox WHERE id = ANY(%s)", (entregues,))
+        for erro, ids in _agrupar_falhas(falhas).items():
+            cursor.execute("""
+                UPDATE replication_outbox SET
+                    tentativas = tentativas + 1,
+                    ultimo_erro = %s,
+                    proxima_tentativa = (NOW() AT TIME ZONE 'UTC')
+                        + LEAST(%s * POWER(2, tentativas), %s) * INTERVAL '1 second'
+                WHERE id = ANY(%s)
+            """, (erro, OUTBOX_BACKOFF_INICIAL, OUTBOX_BACKOFF_MAXIMO, ids))
+            print(f"❌ Outbox: replicação de {len(ids)} entradas para o Líder {destino} falhou ({erro}). Nova tentativa com backoff.")
+        conn_local.commit()
+        return len(entregues)
+    except psycopg2.Error:
+        conn_local.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def drenar_outbox(servidor_local=None):
+    """Uma rodada completa do expedidor: drena a outbox do líder local para cada peer. Retorna {destino: entregues}."""
+    servidor_local = servidor_local or LOCAL_SERVERS[0]
+    garantir_tabela_outbox(servidor_local)
+    conn_local = connect_to_db(servidor_local)
+    if not conn_local:
+        return {}
+    entregues = {}
+    try:
+        for destino in ALL_SERVERS:
+            if destino == servidor_local or circuito_aberto(destino):
+                continue
+            total = 0
+            with medir('outbox_drenar', destino):
+                while True:
+                    enviados = drenar_destino(conn_local, destino)
+                    total += enviados
+                    if enviados < OUTBOX_LOTE_MAXIMO:
+                        break
+            if total:
+                print(f"📤 Outbox: {total} entradas replicadas para o Líder {destino}.")
+            entregues[destino] = total
+    finally:
+        liberar_conexao(conn_local)
+    return entregues
+
+
+def pendencias_outbox(servidor_local=None):
+    """Retorna {destino: (pendentes, tentativas_max, ultimo_erro)} da outbox do líder local."""
+    servidor_local = servidor_local or LOCAL_SERVERS[0]
+    garantir_tabela_outbox(servidor_local)
+    conn = connect_to_db(servidor_local)
+    if not conn:
+        return {}
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT destino, COUNT(*), MAX(tentativas),
+                   (ARRAY_AGG(ultimo_erro ORDER BY id DESC))[1]
+            FROM replication_outbox GROUP BY destino ORDER BY destino
+        """)
+        return {destino: (qtd, tentativas, erro) for destino, qtd, tentativas, erro in cursor.fetchall()}
+    finally:
+        cursor.close()
+        liberar_conexao(conn)
+
+
+def exibir_outbox():
+    pendencias = pendencias_outbox()
+    print("\n--- Outbox de Replicação ---")
+    if not pendencias:
+        print("✅ Nenhuma replicação pendente.")
+        return
+    for destino, (qtd, tentativas, erro) in pendencias.items():
+        linha = f"Líder {destino}: {qtd} pendentes | tentativas={tentativas}"
+        if erro:
+            linha += f" | último erro: {erro}"
+        print(linha)
+
+
+class ExpedidorOutbox(threading.Thread):
+    """Thread em segundo plano que drena a outbox a cada OUTBOX_INTERVALO segundos ou quando notificada."""
+
+    def __init__(self):
+        super().__init__(name="expedidor-outbox", daemon=True)
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+
+    def notificar(self):
+        self._acordar.set()
+
+    def parar(self, timeout=5):
+        self._parar.set()
+        self._acordar.set()
+        self.join(timeout)
+
+    def run(self):
+        while not self._parar.is_set():
+            self._acordar.wait(OUTBOX_INTERVALO)
+            self._acordar.clear()
+            if self._parar.is_set():
+                break
+            try:
+                drenar_outbox()
+            except Exception as e:
+                print(f"❌ Outbox: erro no expedidor: {e}")
+
+
+_expedidor = None
+_expedidor_lock = threading.Lock()
+
+
+def iniciar_expedidor():
+    global _expedidor
+    with _expedidor_lock:
+        if _expedidor is None or not _expedidor.is_alive():
+            _expedidor = ExpedidorOutbox()
+            _expedidor.start()
+    return _expedidor
+
+
+def notificar_expedidor():
+    """Acorda o expedidor logo após um commit local (sem ele, a entrega fica para a próxima rodada/processo)."""
+    if _expedidor is not None:
+        _expedidor.notificar()
+
+
+def parar_expedidor():
+    if _expedidor is not None and _expedidor.is_alive():
+        _expedidor.parar()
+
+
+atexit.register(parar_expedidor)
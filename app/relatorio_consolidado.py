@@ -1,63 +1,230 @@
 import psycopg2
-from prettytable import PrettyTable
-from collections import defaultdict
-from app.config import SERVERS, ALL_SERVERS 
-
-def connect_to_any_db(servidores_ids):
-    for servidor_id in servidores_ids:
-        config = SERVERS.get(servidor_id)
-        if not config: continue
-        connect_args = {k: v for k, v in config.items() if k != 'tipo'}
-        connect_args['connect_timeout'] = 3
-        try:
-            conn = psycopg2.connect(**connect_args)
-            print(f"✅ Conectado com sucesso ao Líder {servidor_id} para leitura de consolidação.")
-            return conn, servidor_id
-        except psycopg2.OperationalError:
-            continue
-    return None, None
-
-def gerar_relatorio(): 
+from app.config import ALL_SERVERS
+from app.conexoes import connect_to_any_db, connect_to_db, liberar_conexao, ultimo_erro_conexao
+from app.fanout import executar_em_lideres
+
+# Ocupação lida dos contadores mantidos por trigger (app/ocupacao.py): uma linha por disciplina, sem varrer matrículas
+SQL_RELATORIO = """
+    SELECT d.id, d.nome, d.vagas_totais, COALESCE(o.aceitas, 0)
+    FROM disciplinas d
+    LEFT JOIN disciplina_ocupacao o ON o.disciplina_id = d.id
+    WHERE (d.is_deleted IS NULL OR d.is_deleted = false)
+    ORDER BY d.id;
+"""
+
+# Líder ainda sem a migração dos contadores: contagem feita no servidor, uma linha por disciplina trafega
+SQL_RELATORIO_CONTAGEM = """
+    SELECT d.id, d.nome, d.vagas_totais, COALESCE(c.ocupadas, 0)
+    FROM disciplinas d
+    LEFT JOIN (
+        SELECT disciplina_id, COUNT(*) AS ocupadas
+        FROM matriculas WHERE status = 'ACEITA'
+        GROUP BY disciplina_id
+    ) c ON c.disciplina_id = d.id
+    WHERE (d.is_deleted IS NULL OR d.is_deleted = false)
+    ORDER BY d.id;
+"""
+
+# Modo consolidado: por disciplina, a versão do catálogo, a contagem de ACEITA e um digest
+# (id, status, versão) de todas as matrículas. Líderes com o mesmo digest têm a mesma fila.
+SQL_DIGESTS_DISCIPLINAS = """
+    SELECT d.id, d.nome, d.vagas_totais, COALESCE(d.is_deleted, false), d.data_ultima_modificacao,
+           COALESCE(c.ocupadas, 0), COALESCE(c.digest, '')
+    FROM disciplinas d
+    LEFT JOIN (
+        SELECT disciplina_id,
+               COUNT(*) FILTER (WHERE status = 'ACEITA') AS ocupadas,
+               md5(string_agg(
+                   id::text || ':' || status || ':'
+                   || (EXTRACT(EPOCH FROM data_ultima_modificacao) * 1000000)::bigint::text,
+                   ',' ORDER BY id
+               )) AS digest
+        FROM matriculas
+        GROUP BY disciplina_id
+    ) c ON c.disciplina_id = d.id;
+"""
+
+
+def _exibir_tabela(linhas, com_divergencias=False):
+    from prettytable import PrettyTable
+    table = PrettyTable()
+    table.field_names = ["ID", "Disciplina", "Vagas Totais", "Vagas Ocupadas", "Vagas Disponíveis"] + (
+        ["Divergências"] if com_divergencias else []
+    )
+    table.align = "l"
+    for linha in linhas:
+        table.add_row(linha)
+    print(table)
+    print("----------------------------------------------------------------\n")
+
+
+def dados_relatorio():
+    """
+    Lê o relatório de um líder qualquer.
+    Retorna {'lider', 'disciplinas': [{'id', 'nome', 'vagas_totais', 'ocupadas', 'disponiveis'}], 'erro'}.
+    """
     conn, servidor_id = connect_to_any_db(ALL_SERVERS)
     if not conn:
-        print("\n❌ Não foi possível conectar a nenhum líder para gerar o relatório consolidado.")
-        return
+        return {'lider': None, 'disciplinas': [], 'erro': "nenhum líder acessível"}
     cursor = conn.cursor()
-    print(f"\n--- Relatório Consolidado (Fonte de Dados: Líder {servidor_id}) ---")
     try:
-        
-        cursor.execute("""
-            SELECT id, nome, vagas_totais  FROM disciplinas 
-            WHERE (is_deleted IS NULL OR is_deleted = false) ORDER BY id;
-        """)
-        disciplinas_info = {row[0]: {'nome': row[1], 'vagas_totais': row[2]} for row in cursor.fetchall()}
-        if not disciplinas_info:
-            print("Nenhuma disciplina encontrada no catálogo.")
-            return
-        
-        
-        cursor.execute("SELECT disciplina_id, status FROM matriculas WHERE status = 'ACEITA';")
-        matriculas_aceitas = cursor.fetchall()
-
-        vagas_ocupadas = defaultdict(int)
-        for disc_id, status in matriculas_aceitas:
-            vagas_ocupadas[disc_id] += 1
-
-        table = PrettyTable()
-        table.field_names = ["ID", "Disciplina", "Vagas Totais", "Vagas Ocupadas", "Vagas Disponíveis"]
-        table.align = "l"
-        for disc_id, info in disciplinas_info.items():
-            if disc_id not in vagas_ocupadas:
-                vagas_ocupadas[disc_id] = 0
-            nome = info['nome']
-            vagas_totais = info['vagas_totais']
-            ocupadas = vagas_ocupadas[disc_id]
-            disponiveis = vagas_totais - ocupadas
-            table.add_row([disc_id, nome, vagas_totais, ocupadas, disponiveis])
-        print(table)
-        print("----------------------------------------------------------------\n")
+        try:
+            cursor.execute(SQL_RELATORIO)
+        except psycopg2.errors.UndefinedTable:
+            conn.rollback()
+            cursor.execute(SQL_RELATORIO_CONTAGEM)
+        disciplinas = [
+            {'id': disc_id, 'nome': nome, 'vagas_totais': vagas_totais, 'ocupadas': ocupadas,
+             'disponiveis': vagas_totais - ocupadas}
+            for disc_id, nome, vagas_totais, ocupadas in cursor.fetchall()
+        ]
+        return {'lider': servidor_id, 'disciplinas': disciplinas, 'erro': None}
     except psycopg2.Error as e:
-        print(f"❌ Erro SQL: {e}")
+        return {'lider': servidor_id, 'disciplinas': [], 'erro': str(e)}
     finally:
         if cursor: cursor.close()
-        if conn: conn.close()
\ No newline at end of file
+        liberar_conexao(conn)
+
+
+def gerar_relatorio():
+    relatorio = dados_relatorio()
+    if relatorio['lider'] is None:
+        print("\n❌ Não foi possível conectar a nenhum líder para gerar o relatório consolidado.")
+        return relatorio
+    servidor_id = relatorio['lider']
+    print(f"✅ Conectado com sucesso ao Líder {servidor_id} para leitura de consolidação.")
+    print(f"\n--- Relatório Consolidado (Fonte de Dados: Líder {servidor_id}) ---")
+    if relatorio['erro']:
+        print(f"❌ Erro SQL: {relatorio['erro']}")
+    elif not relatorio['disciplinas']:
+        print("Nenhuma disciplina encontrada no catálogo.")
+    else:
+        _exibir_tabela(
+            [d['id'], d['nome'], d['vagas_totais'], d['ocupadas'], d['disponiveis']]
+            for d in relatorio['disciplinas']
+        )
+    return relatorio
+
+
+def _consultar(servidor_id, sql, params=None):
+    conn = connect_to_db(servidor_id)
+    if not conn:
+        raise ConnectionError(ultimo_erro_conexao(servidor_id))
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+        liberar_conexao(conn)
+
+
+def _merge_filas_lww(linhas_por_lider):
+    """
+    linhas_por_lider: {servidor_id: [(disciplina_id, matricula_id, status, versao)]}.
+    Retorna ({disciplina_id: {matricula_id: (versao, status)}} vencedor por LWW,
+             {disciplina_id: set(líderes com alguma linha ausente ou mais antiga)}).
+    """
+    vencedoras = {}
+    por_lider = {}
+    for servidor_id, linhas in linhas_por_lider.items():
+        for disciplina_id, matricula_id, status, versao in linhas:
+            por_lider.setdefault(servidor_id, {})[(disciplina_id, matricula_id)] = versao
+            fila = vencedoras.setdefault(disciplina_id, {})
+            atual = fila.get(matricula_id)
+            if atual is None or versao > atual[0]:
+                fila[matricula_id] = (versao, status)
+
+    desatualizados = {}
+    for disciplina_id, fila in vencedoras.items():
+        for servidor_id in linhas_por_lider:
+            versoes = por_lider.get(servidor_id, {})
+            if any(versoes.get((disciplina_id, mid)) != versao for mid, (versao, _) in fila.items()):
+                desatualizados.setdefault(disciplina_id, set()).add(servidor_id)
+    return vencedoras, desatualizados
+
+
+def gerar_relatorio_multilider(exibir=True):
+    """
+    Relatório realmente consolidado: consulta todos os líderes em paralelo e junta as respostas.
+    - O catálogo de disciplinas é mesclado por LWW (data_ultima_modificacao).
+    - Para cada disciplina, se todos os líderes devolvem o mesmo digest da fila, a contagem feita no
+      servidor é usada diretamente; só as disciplinas divergentes têm as linhas (id, status, versão)
+      buscadas para um merge LWW, e os líderes desatualizados são apontados no relatório.
+    Retorna {'lideres', 'sem_resposta', 'disciplinas': [{..., 'divergencias'}]}; com exibir=False só monta o resultado.
+    """
+    print("\n--- Relatório Consolidado Multi-Líder (merge LWW) ---")
+    fanout = executar_em_lideres(
+        ALL_SERVERS, lambda s: _consultar(s, SQL_DIGESTS_DISCIPLINAS), contexto="relatório consolidado"
+    )
+    respostas = fanout['resultados']
+    fora = sorted(set(fanout['falharam']) | set(fanout['expirados']) | set(fanout['ignorados']))
+    resultado = {'lideres': sorted(respostas), 'sem_resposta': fora, 'disciplinas': []}
+    if not respostas:
+        print("\n❌ Não foi possível consultar nenhum líder para gerar o relatório consolidado.")
+        return resultado
+    lideres = sorted(respostas)
+    print(f"Líderes consultados: {', '.join(lideres)}")
+    if fora:
+        print(f"⚠️ Resultado parcial: sem resposta de {', '.join(fora)}.")
+
+    catalogo = {}
+    digests = {}
+    for servidor_id, linhas in respostas.items():
+        for disc_id, nome, vagas, removida, versao, ocupadas, digest in linhas:
+            atual = catalogo.get(disc_id)
+            if atual is None or versao > atual['versao']:
+                catalogo[disc_id] = {'nome': nome, 'vagas': vagas, 'removida': removida, 'versao': versao}
+            digests.setdefault(disc_id, {})[servidor_id] = (ocupadas, digest, versao)
+
+    ativas = sorted(disc_id for disc_id, info in catalogo.items() if not info['removida'])
+    if not ativas:
+        print("Nenhuma disciplina encontrada no catálogo.")
+        return resultado
+
+    divergentes = [
+        disc_id for disc_id in ativas
+        if len(digests[disc_id]) < len(lideres) or len({d[1] for d in digests[disc_id].values()}) > 1
+    ]
+    vencedoras, desatualizados = {}, {}
+    if divergentes:
+        print(f"🔎 {len(divergentes)} disciplina(s) com filas diferentes entre os líderes: mesclando por LWW...")
+        detalhe = executar_em_lideres(
+            lideres,
+            lambda s: _consultar(
+                s,
+                "SELECT disciplina_id, id, status, data_ultima_modificacao FROM matriculas WHERE disciplina_id = ANY(%s::uuid[])",
+                ([str(d) for d in divergentes],),
+            ),
+            contexto="relatório consolidado (divergências)",
+        )
+        vencedoras, desatualizados = _merge_filas_lww(detalhe['resultados'])
+
+    linhas = []
+    for disc_id in ativas:
+        info = catalogo[disc_id]
+        notas = []
+        if disc_id in divergentes:
+            fila = vencedoras.get(disc_id, {})
+            ocupadas = sum(1 for _, status in fila.values() if status == 'ACEITA')
+            faltando = sorted(set(lideres) - set(digests[disc_id]))
+            if faltando:
+                notas.append(f"sem a disciplina: {', '.join(faltando)}")
+            if desatualizados.get(disc_id):
+                notas.append(f"fila desatualizada: {', '.join(sorted(desatualizados[disc_id]))}")
+        else:
+            ocupadas = next(iter(digests[disc_id].values()))[0]
+        catalogo_antigo = sorted(s for s, (_, _, versao) in digests[disc_id].items() if versao != info['versao'])
+        if catalogo_antigo:
+            notas.append(f"catálogo desatualizado: {', '.join(catalogo_antigo)}")
+        linhas.append([disc_id, info['nome'], info['vagas'], ocupadas, info['vagas'] - ocupadas, '; '.join(notas) or '✅'])
+        resultado['disciplinas'].append({
+            'id': disc_id, 'nome': info['nome'], 'vagas_totais': info['vagas'], 'ocupadas': ocupadas,
+            'disponiveis': info['vagas'] - ocupadas, 'divergencias': notas,
+        })
+
+    if exibir:
+        _exibir_tabela(linhas, com_divergencias=True)
+        if divergentes:
+            print("(Rode a Opção 10 'Heal' para convergir os líderes apontados.)")
+    return resultado
@@ -1,150 +1,207 @@
+import os
 import psycopg2
-from app.config import SERVERS, ALL_SERVERS, LOCAL_SERVERS
-from app.matricular import reavaliar_posicao
-
-def connect_to_db(servidor_id):
-    """Conecta ao banco de dados específico. Retorna None em caso de falha."""
-    config = SERVERS.get(servidor_id) 
-    if not config:
-        return None
-    connect_args = {k: v for k, v in config.items() if k != 'tipo'}
-    connect_args['connect_timeout'] = 10 
-    try:
-        conn = psycopg2.connect(**connect_args)
-        return conn
-    except psycopg2.OperationalError:
-        return None
-
-def obter_disciplina_id(conn, disciplina_nome):
-    """Busca o ID e o total de vagas da disciplina pelo nome."""
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-            SELECT id, vagas_totais FROM disciplinas 
-            WHERE nome = %s AND (is_deleted IS NULL OR is_deleted = false)
-        """, (disciplina_nome,))
-        result = cursor.fetchone()
-        if result:
-            return result[0], result[1]
-        return None, None
-    finally:
-        cursor.close()
+from app.config import LOCAL_SERVERS, REAVALIACAO_NO_SERVIDOR
+from app.replicacao import novo_lote
+from app.matricular import reavaliar_posicao, consultar_estado_global_detalhado, fila_local_completa, atribuir_vagas
+from app.importar_matriculas import ler_registros
+from app.hlc import agora_hlc
+from app.armazenamento import backend_padrao
+from app.instrumentacao import medir
 
-def remover_aluno(lider_destino, aluno, disciplina_nome):
+@medir('remocao')
+def remover_aluno(lider_destino, aluno, disciplina_nome, backend=None):
     """
     Remove (Soft Delete) a matrícula E reavalia a fila de espera.
+    'backend' (app/armazenamento.py) padrão: os líderes PostgreSQL.
+    Retorna {'aluno', 'disciplina', 'lider', 'removida', 'promocoes', 'erro'}.
     """
-    conn = connect_to_db(lider_destino)
-    if not conn:
+    backend = backend or backend_padrao()
+    retorno = {'aluno': aluno, 'disciplina': disciplina_nome, 'lider': lider_destino,
+                 'removida': False, 'promocoes': 0, 'erro': None}
+    sessao = backend.abrir_sessao(lider_destino)
+    if not sessao:
         print(f"❌ Remoção falhou em {lider_destino} devido à falha de conexão.")
-        return
-
-    cursor = conn.cursor()
-    
-    disciplina_id, vagas_totais = obter_disciplina_id(conn, disciplina_nome)
-    
-    if not disciplina_id:
-        print(f"❌ Falha: Disciplina '{disciplina_nome}' não encontrada ou foi removida no líder {lider_destino}.")
-        conn.close()
-        return
+        retorno['erro'] = f"líder {lider_destino} offline"
+        return retorno
 
+    trava = None
     try:
+        disciplina_id, vagas_totais = sessao.disciplina_por_nome(disciplina_nome)
+
+        if not disciplina_id:
+            print(f"❌ Falha: Disciplina '{disciplina_nome}' não encontrada ou foi removida no líder {lider_destino}.")
+            retorno['erro'] = "disciplina não encontrada"
+            return retorno
+
+        # Seção crítica da disciplina até o commit (ver app/coordenacao.py)
+        trava = sessao.travar([disciplina_id])
+
         # --- ETAPA 1: ENCONTRAR O ALUNO ---
         
-        cursor.execute("""
-            SELECT id FROM matriculas 
-            WHERE nome_aluno = %s AND disciplina_id = %s AND status != 'REMOVIDA'
-            """, (aluno, disciplina_id))
-        resultado = cursor.fetchone()
+        id_a_remover = sessao.matricula_ativa(aluno, disciplina_id)
         
-        if not resultado:
+        if not id_a_remover:
             print(f"⚠️ Aviso: Aluno '{aluno}' não encontrado (ou já removido) em '{disciplina_nome}' no líder {lider_destino}.")
-            conn.rollback()
-            return
-            
-        id_a_remover = resultado[0]
-        cursor.execute("SELECT (NOW() AT TIME ZONE 'UTC')")
-        timestamp_agora = cursor.fetchone()[0]
+            sessao.desfazer()
+            retorno['erro'] = "matrícula não encontrada"
+            return retorno
 
         # --- ETAPA 2: REAVALIAR A FILA (ANTES DE REMOVER) ---
         print("\n--- Reavaliação de Fila de Espera ---")
         
-        
-        status_final_dummy, pos_dummy, updates_a_replicar = reavaliar_posicao(
-            lider_destino, disciplina_id, vagas_totais, 
-            nova_tentativa=None, 
-            id_a_ignorar=id_a_remover 
-        )
-        # --- FIM DA CORREÇÃO ---
+        registros_globais, fanout = consultar_estado_global_detalhado(disciplina_id, backend=backend)
+        # Versão HLC depois da leitura global: supera as versões de todas as linhas que vão mudar
+        timestamp_agora = agora_hlc()
+        # Se o líder já tem a fila global completa, a reavaliação é feita no servidor (ETAPA 3c)
+        reavaliar_no_servidor = REAVALIACAO_NO_SERVIDOR and fila_local_completa(lider_destino, registros_globais, fanout)
 
-        if updates_a_replicar:
-            print(f"Promovendo {len(updates_a_replicar)} alunos da fila de espera...")
-        else:
-            print("Nenhuma promoção na fila de espera necessária.")
+        if not reavaliar_no_servidor:
+            status_final_dummy, pos_dummy, updates_a_replicar = reavaliar_posicao(
+                lider_destino, disciplina_id, vagas_totais, 
+                nova_tentativa=None, 
+                id_a_ignorar=id_a_remover,
+                registros_atuais=registros_globais
+            )
             
         # --- ETAPA 3: APLICAR TODAS AS MUDANÇAS (1 TRANSAÇÃO) ---
         
-        # 3a. Remove o aluno
-        update_query_remocao = """
-            UPDATE matriculas SET status = 'REMOVIDA', data_ultima_modificacao = %s
-            WHERE id = %s
-        """
-        cursor.execute(update_query_remocao, (timestamp_agora, id_a_remover))
-        
-        # 3b. Registra o "Tombstone"
-        tombstone_query = """
-            INSERT INTO deleted_matriculas (id, timestamp) VALUES (%s, %s)
-            ON CONFLICT (id) DO UPDATE SET timestamp = EXCLUDED.timestamp
-        """
-        cursor.execute(tombstone_query, (id_a_remover, timestamp_agora))
+        # 3a/3b. Remove o aluno e registra o "Tombstone"
+        remocao = novo_lote()
+        remocao['status'].append((id_a_remover, 'REMOVIDA', timestamp_agora))
+        remocao['tombstones_matriculas'].append((id_a_remover, timestamp_agora))
+        sessao.aplicar_lote(remocao)
 
         # 3c. Aplica as promoções da fila
-        update_query_fila = "UPDATE matriculas SET status = %s, data_ultima_modificacao = (NOW() AT TIME ZONE 'UTC') WHERE id = %s"
-        for old_id, nome, novo_status, ts in updates_a_replicar:
-             cursor.execute(update_query_fila, (novo_status, old_id))
-        
-        # 3d. Salva tudo (Commit 1)
-        conn.commit() 
-        print(f"✅ Remoção e reavaliação da fila salvas em {lider_destino}.")
+        if reavaliar_no_servidor:
+            updates_a_replicar = []
+            for old_id, nome, novo_status, ts, status_antigo, posicao in sessao.reavaliar_fila(
+                disciplina_id, vagas_totais, timestamp_agora
+            ):
+                updates_a_replicar.append((old_id, nome, novo_status, ts))
+                print(f"Status Atualizado: {nome} mudou de {status_antigo} para {novo_status}")
+        promocoes = novo_lote()
+        promocoes['status'] = [(old_id, novo_status, timestamp_agora) for old_id, nome, novo_status, ts in updates_a_replicar]
+        if not reavaliar_no_servidor:
+            sessao.aplicar_lote(promocoes)
 
+        if updates_a_replicar:
+            print(f"Promovendo {len(updates_a_replicar)} alunos da fila de espera...")
+        else:
+            print("Nenhuma promoção na fila de espera necessária.")
         
-        # --- ETAPA 4: REPLICAÇÃO ---
+        # 3d + ETAPA 4: salva tudo (Commit 1) e replica remoção, tombstone e promoções num único lote
         print("\n--- Replicação de Remoção e Promoção da Fila ---")
-        
-        for servidor_id in ALL_SERVERS:
-            if servidor_id == lider_destino: continue 
-            replica_conn = connect_to_db(servidor_id)
-            if replica_conn:
-                replica_cursor = replica_conn.cursor()
-                try:
-                    # a) Replica o Soft Delete
-                    replica_cursor.execute(update_query_remocao, (timestamp_agora, id_a_remover))
-                    # b) Replica o Tombstone
-                    replica_cursor.execute(tombstone_query, (id_a_remover, timestamp_agora))
-                    
-                    # c) Replica as promoções da fila
-                    for old_id, nome, novo_status, ts in updates_a_replicar:
-                        replica_cursor.execute(update_query_fila, (novo_status, old_id))
-
-                    replica_conn.commit()
-                    print(f"➡️ Replicação sucesso (Remoção + {len(updates_a_replicar)} promoções) para o servidor {servidor_id}.")
-                except Exception as e:
-                    print(f"❌ Erro ao replicar para {servidor_id}: {e}")
-                    replica_conn.rollback()
-                finally:
-                    if replica_cursor: replica_cursor.close()
-                    if replica_conn: replica_conn.close()
-            else:
-                print(f"❌ Falha de Conexão: Líder {servidor_id} inacessível para replicação.")
+        remocao['status'] += promocoes['status']
+        sessao.comitar_e_replicar(remocao, f"Remoção + {len(updates_a_replicar)} promoções")
+        print(f"✅ Remoção e reavaliação da fila salvas em {lider_destino}.")
+        retorno.update(removida=True, promocoes=len(updates_a_replicar))
             
     except psycopg2.Error as e:
-        conn.rollback()
+        sessao.desfazer()
         print(f"❌ Erro PostgreSQL durante a remoção: {e}")
+        retorno['erro'] = str(e)
+    except Exception as e:
+        sessao.desfazer()
+        print(f"❌ Erro inesperado: {e}")
+        retorno['erro'] = str(e)
+    finally:
+        sessao.fechar()
+        if trava: trava.liberar()
+    return retorno
+
+@medir('remocao_em_lote')
+def remover_alunos_em_lote(lider_destino, remocoes, backend=None):
+    """
+    Remoção em lote. 'remocoes' é uma lista de (aluno, disciplina_nome); disciplina_nome None remove o
+    aluno de TODAS as disciplinas. Todas as remoções e tombstones entram numa transação, cada disciplina
+    afetada tem a fila lida e reavaliada UMA vez, e remoções + promoções vão num único lote de replicação.
+    Retorna o resumo {'removidas', 'nao_encontradas', 'promocoes', 'disciplinas', 'erro'}; as contagens
+    só são preenchidas depois do commit.
+    """
+    backend = backend or backend_padrao()
+    resumo = {'removidas': 0, 'nao_encontradas': [], 'promocoes': 0, 'disciplinas': 0, 'erro': None}
+    pares = {(aluno, disciplina) for aluno, disciplina in remocoes if disciplina}
+    alunos_todas = {aluno for aluno, disciplina in remocoes if not disciplina}
+    if not pares and not alunos_todas:
+        return resumo
+    sessao = backend.abrir_sessao(lider_destino)
+    if not sessao:
+        print(f"❌ Remoção em lote falhou em {lider_destino} devido à falha de conexão.")
+        resumo['erro'] = f"líder {lider_destino} offline"
+        return resumo
+    trava = None
+    try:
+        # Todas as disciplinas afetadas ficam travadas (em ordem) até o commit. Os alvos são relidos sob a
+        # trava: outra remoção concorrente pode ter removido (e promovido) alguns deles entre as duas leituras
+        candidatos = sessao.matriculas_ativas_para_remover(pares, alunos_todas)
+        travadas = {disciplina_id for _, _, _, disciplina_id, _ in candidatos}
+        if travadas:
+            trava = sessao.travar(travadas)
+            alvos = [alvo for alvo in sessao.matriculas_ativas_para_remover(pares, alunos_todas) if alvo[3] in travadas]
+        else:
+            alvos = []
+        encontrados = {(aluno, disciplina) for _, aluno, disciplina, _, _ in alvos}
+        alunos_encontrados = {aluno for _, aluno, _, _, _ in alvos}
+        nao_encontradas = sorted(pares - encontrados) + [(a, None) for a in sorted(alunos_todas - alunos_encontrados)]
+        resumo['nao_encontradas'] = nao_encontradas
+        for aluno, disciplina in nao_encontradas:
+            print(f"⚠️ Aviso: Aluno '{aluno}' não encontrado (ou já removido) em '{disciplina or 'nenhuma disciplina'}' no líder {lider_destino}.")
+        if not alvos:
+            sessao.desfazer()
+            resumo['erro'] = "matrícula não encontrada"
+            return resumo
+
+        removidas_por_disciplina = {}
+        for matricula_id, aluno, disciplina_nome, disciplina_id, vagas_totais in alvos:
+            removidas_por_disciplina.setdefault((disciplina_id, disciplina_nome, vagas_totais), set()).add(matricula_id)
+        # Filas globais lidas antes de gerar a versão HLC, que assim supera as versões de tudo que vai mudar
+        filas = {disciplina_id: consultar_estado_global_detalhado(disciplina_id, backend=backend)
+                 for disciplina_id, _, _ in removidas_por_disciplina}
+        timestamp_agora = agora_hlc()
+
+        # Remove todas as matrículas e grava os tombstones num comando de cada
+        lote = novo_lote()
+        for matricula_id, _, _, _, _ in alvos:
+            lote['status'].append((matricula_id, 'REMOVIDA', timestamp_agora))
+            lote['tombstones_matriculas'].append((matricula_id, timestamp_agora))
+        sessao.aplicar_lote(lote)
+
+        print("\n--- Reavaliação das Filas de Espera ---")
+        promocoes = novo_lote()
+        total_promocoes = 0
+        for (disciplina_id, disciplina_nome, vagas_totais), ids_removidos in removidas_por_disciplina.items():
+            registros_globais, fanout = filas[disciplina_id]
+            if REAVALIACAO_NO_SERVIDOR and fila_local_completa(lider_destino, registros_globais, fanout):
+                # As remoções já estão aplicadas nesta transação: o servidor reposiciona a fila restante
+                mudancas = [(old_id, novo_status) for old_id, _, novo_status, _, _, _ in sessao.reavaliar_fila(
+                    disciplina_id, vagas_totais, timestamp_agora
+                )]
+                lote['status'] += [(old_id, novo_status, timestamp_agora) for old_id, novo_status in mudancas]
+            else:
+                restantes = [r for r in registros_globais if r[0] not in ids_removidos]
+                _, mudancas = atribuir_vagas(restantes, [], vagas_totais)
+                promocoes['status'] += [(old_id, novo_status, timestamp_agora) for old_id, novo_status in mudancas]
+            print(f"{disciplina_nome}: {len(ids_removidos)} removida(s), {len(mudancas)} status reavaliado(s).")
+            total_promocoes += len(mudancas)
+        sessao.aplicar_lote(promocoes)
+        lote['status'] += promocoes['status']
+
+        print("\n--- Replicação de Remoções e Promoções ---")
+        sessao.comitar_e_replicar(lote, f"Remoção em lote: {len(alvos)} matrículas + {total_promocoes} promoções")
+        resumo.update(removidas=len(alvos), promocoes=total_promocoes, disciplinas=len(removidas_por_disciplina))
+        print(f"✅ {len(alvos)} matrícula(s) removida(s) em {len(removidas_por_disciplina)} disciplina(s) no líder {lider_destino}.")
+    except psycopg2.Error as e:
+        sessao.desfazer()
+        print(f"❌ Erro PostgreSQL durante a remoção em lote: {e}")
+        resumo['erro'] = str(e)
     except Exception as e:
+        sessao.desfazer()
         print(f"❌ Erro inesperado: {e}")
+        resumo['erro'] = str(e)
     finally:
-        if cursor: cursor.close()
-        if conn: conn.close()
+        sessao.fechar()
+        if trava: trava.liberar()
+    return resumo
 
 def remover_matricula_menu():
     if not LOCAL_SERVERS:
@@ -157,4 +214,30 @@ def remover_matricula_menu():
         return
     lider_destino = LOCAL_SERVERS[0]
     print(f"\n⏳ Tentando remover {aluno} de '{disciplina}' via Líder {lider_destino}...")
-    remover_aluno(lider_destino, aluno, disciplina)
\ No newline at end of file
+    remover_aluno(lider_destino, aluno, disciplina)
+
+def remover_em_lote_menu():
+    if not LOCAL_SERVERS:
+        print("❌ ERRO DE CONFIGURAÇÃO: LOCAL_SERVERS não está definido no config.py.")
+        return
+    print("1. Remover um aluno de TODAS as disciplinas")
+    print("2. Remover a lista de um arquivo (.csv com colunas aluno,disciplina ou .jsonl; sem disciplina = todas)")
+    modo = input("Escolha: ").strip()
+    if modo == '1':
+        aluno = input("Digite o NOME do aluno: ").strip()
+        remocoes = [(aluno, None)] if aluno else []
+    elif modo == '2':
+        caminho = input("Caminho do arquivo: ").strip()
+        if not os.path.isfile(caminho):
+            print("❌ Remoção cancelada: arquivo não encontrado.")
+            return
+        remocoes = [(aluno, disciplina) for aluno, disciplina in ler_registros(caminho) if aluno]
+    else:
+        print("Opção inválida.")
+        return
+    if not remocoes:
+        print("❌ Remoção cancelada: nenhuma matrícula informada.")
+        return
+    lider_destino = LOCAL_SERVERS[0]
+    print(f"\n⏳ Removendo {len(remocoes)} entrada(s) via Líder {lider_destino}...")
+    remover_alunos_em_lote(lider_destino, remocoes)
@@ -1,18 +1,20 @@
 import psycopg2
-from app.config import SERVERS, ALL_SERVERS
+from app.config import ALL_SERVERS, REPLICACAO_MODO
+from app.conexoes import connect_to_db, liberar_conexao, obter_pool, ultimo_erro_conexao
+from app.saude_lideres import filtrar_lideres_disponiveis
+from app.replicacao import novo_lote
+from app.outbox import enfileirar_pendentes
+from app.hlc import agora_hlc
 
 def remover_disciplina_no_servidor(servidor_id, disciplina_nome, timestamp_agora):
     """Conecta e remove (Soft Delete) a disciplina em um único servidor."""
-    config = SERVERS.get(servidor_id)
-    if not config:
+    if not obter_pool(servidor_id):
         return False, f"Configuração do servidor {servidor_id} não encontrada."
-        
-    connect_args = {k: v for k, v in config.items() if k != 'tipo'}
-    connect_args['connect_timeout'] = 5 
-    
-    conn = None
+
+    conn = connect_to_db(servidor_id)
+    if not conn:
+        return False, f"FALHA DE CONEXÃO (servidor offline: {ultimo_erro_conexao(servidor_id)})."
     try:
-        conn = psycopg2.connect(**connect_args)
         cursor = conn.cursor()
         
         # 1. Encontra o ID da disciplina
@@ -48,12 +50,39 @@ def remover_disciplina_no_servidor(servidor_id, disciplina_nome, timestamp_agora
         return True, "SUCESSO (Soft Delete)"
 
     except psycopg2.OperationalError:
+        liberar_conexao(conn, descartar=True)
+        conn = None
         return False, "FALHA DE CONEXÃO (servidor offline)."
     except Exception as e:
         conn.rollback() # Garante rollback em caso de erro
         return False, f"ERRO INESPERADO: {e}"
     finally:
-        if conn: conn.close()
+        liberar_conexao(conn)
+
+def lote_remocao_disciplina(servidor_id, disciplina_nome, timestamp_agora):
+    """Monta, a partir de um líder onde a remoção já foi aplicada, o lote que a reproduz nos demais."""
+    conn = connect_to_db(servidor_id)
+    if not conn:
+        return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT id, nome, vagas_totais FROM disciplinas
+            WHERE nome = %s AND is_deleted = true AND data_ultima_modificacao = %s
+            """, (disciplina_nome, timestamp_agora))
+        disciplina = cursor.fetchone()
+        if not disciplina:
+            return None
+        disciplina_id, nome, vagas = disciplina
+        lote = novo_lote()
+        lote['disciplinas'].append((disciplina_id, nome, vagas, True, timestamp_agora))
+        lote['tombstones_disciplinas'].append((disciplina_id, timestamp_agora))
+        cursor.execute("SELECT id FROM matriculas WHERE disciplina_id = %s", (disciplina_id,))
+        lote['status'] = [(matricula_id, 'REMOVIDA', timestamp_agora) for (matricula_id,) in cursor.fetchall()]
+        return lote
+    finally:
+        cursor.close()
+        liberar_conexao(conn)
 
 # Função principal
 def remover_disciplina():
@@ -75,15 +104,14 @@ def remover_disciplina():
     
     all_results = {}
     
-    # Gera um timestamp único para esta operação ser replicada
-    conn_local = psycopg2.connect(**{k: v for k, v in SERVERS[local_id].items() if k != 'tipo'})
-    cursor_local = conn_local.cursor()
-    cursor_local.execute("SELECT (NOW() AT TIME ZONE 'UTC')")
-    timestamp_agora = cursor_local.fetchone()[0]
-    cursor_local.close()
-    conn_local.close()
+    # Gera um timestamp único (HLC, app/hlc.py) para esta operação ser replicada
+    timestamp_agora = agora_hlc()
 
-    for servidor_id in ALL_SERVERS:
+    lideres_disponiveis, lideres_ignorados = filtrar_lideres_disponiveis(ALL_SERVERS, "remoção da disciplina")
+    for servidor_id in lideres_ignorados:
+        all_results[servidor_id] = {'sucesso': False, 'mensagem': ultimo_erro_conexao(servidor_id)}
+
+    for servidor_id in lideres_disponiveis:
         sucesso, mensagem = remover_disciplina_no_servidor(servidor_id, disciplina_nome, timestamp_agora)
         all_results[servidor_id] = {'sucesso': sucesso, 'mensagem': mensagem}
 
@@ -95,9 +123,17 @@ def remover_disciplina():
         print("✅ Disciplina removida (Soft Delete) com sucesso no líder local.")
         
         # Verifica se houve falha na replicação
+        falhos = []
         for servidor_id, res in all_results.items():
             if servidor_id != local_id and not res['sucesso']:
                 print(f"⚠️ Aviso: Falha na replicação para o {servidor_id}. (Motivo: {res['mensagem']})")
+                falhos.append(servidor_id)
+
+        # No modo outbox a remoção fica guardada para os líderes que falharam
+        if falhos and REPLICACAO_MODO == 'outbox':
+            lote = lote_remocao_disciplina(local_id, disciplina_nome, timestamp_agora)
+            if lote:
+                enfileirar_pendentes(local_id, lote, falhos, f"Remoção da disciplina {disciplina_nome}")
                 
     else:
         msg = local_result['mensagem'] if local_result else "ID do servidor local não encontrado no config."
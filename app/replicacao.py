@@ -0,0 +1,165 @@
+import psycopg2
+from datetime import datetime
+from app.config import ALL_SERVERS
+from app.conexoes import connect_to_db, liberar_conexao
+from app.saude_lideres import filtrar_lideres_disponiveis
+from app.instrumentacao import medir
+
+COLUNAS_MATRICULAS = ('id', 'disciplina_id', 'nome_aluno', 'timestamp_matricula', 'status', 'data_ultima_modificacao')
+COLUNAS_DISCIPLINAS = ('id', 'nome', 'vagas_totais', 'is_deleted', 'data_ultima_modificacao')
+
+
+def novo_lote():
+    """
+    Lote de replicação: tudo o que uma operação precisa aplicar em cada líder.
+    - 'disciplinas' / 'matriculas': linhas completas (upsert LWW por data_ultima_modificacao)
+    - 'status': (id, novo_status, versao) de matrículas existentes (remoções, promoções, rebaixamentos)
+    - 'tombstones_matriculas' / 'tombstones_disciplinas': (id, timestamp) para deleted_matriculas / deleted_disciplinas
+    """
+    return {'disciplinas': [], 'matriculas': [], 'status': [], 'tombstones_matriculas': [], 'tombstones_disciplinas': []}
+
+
+def lote_vazio(lote):
+    return not any(lote.values())
+
+
+def _valores(cursor, template, linhas):
+    return b",".join(cursor.mogrify(template, linha) for linha in linhas)
+
+
+def _sem_duplicatas(linhas):
+    """
+    Mantém uma entrada por id, a de maior versão (última coluna), como o LWW faria; num empate fica a última.
+    Um UPDATE ... FROM VALUES com ids repetidos é ambíguo, e na junção de entradas da outbox a ordem das
+    entradas não é a ordem das versões.
+    """
+    por_id = {}
+    for linha in linhas:
+        atual = por_id.get(linha[0])
+        if atual is None or _versao(linha[-1]) >= _versao(atual[-1]):
+            por_id[linha[0]] = linha
+    return list(por_id.values())
+
+
+def _versao(valor):
+    # Lotes que passaram pela outbox chegam com as versões em texto (json.dumps(default=str))
+    return datetime.fromisoformat(valor) if isinstance(valor, str) else valor
+
+
+def montar_sql_lote(cursor, lote):
+    """
+    Converte o lote em poucos comandos multi-linha (um por tipo de mudança), concatenados num único
+    texto SQL. Todos os comandos respeitam LWW, então reaplicar o mesmo lote é inofensivo.
+    """
+    comandos = []
+    if lote.get('disciplinas'):
+        comandos.append(
+            b"INSERT INTO disciplinas (" + ", ".join(COLUNAS_DISCIPLINAS).encode() + b") VALUES "
+            + _valores(cursor, "(%s::uuid, %s, %s, %s, %s::timestamptz)", _sem_duplicatas(lote['disciplinas']))
+            + b""" ON CONFLICT (id) DO UPDATE SET
+                nome = EXCLUDED.nome, vagas_totais = EXCLUDED.vagas_totais,
+                is_deleted = EXCLUDED.is_deleted, data_ultima_modificacao = EXCLUDED.data_ultima_modificacao
+                WHERE disciplinas.data_ultima_modificacao < EXCLUDED.data_ultima_modificacao"""
+        )
+    if lote.get('matriculas'):
+        comandos.append(
+            b"INSERT INTO matriculas (" + ", ".join(COLUNAS_MATRICULAS).encode() + b") VALUES "
+            + _valores(cursor, "(%s::uuid, %s::uuid, %s, %s::timestamptz, %s, %s::timestamptz)", _sem_duplicatas(lote['matriculas']))
+            + b""" ON CONFLICT (id) DO UPDATE SET
+                disciplina_id = EXCLUDED.disciplina_id, nome_aluno = EXCLUDED.nome_aluno,
+                timestamp_matricula = EXCLUDED.timestamp_matricula, status = EXCLUDED.status,
+                data_ultima_modificacao = EXCLUDED.data_ultima_modificacao
+                WHERE matriculas.data_ultima_modificacao < EXCLUDED.data_ultima_modificacao"""
+        )
+    if lote.get('tombstones_matriculas'):
+        comandos.append(
+            b"INSERT INTO deleted_matriculas (id, timestamp) VALUES "
+            + _valores(cursor, "(%s::uuid, %s::timestamptz)", _sem_duplicatas(lote['tombstones_matriculas']))
+            + b" ON CONFLICT (id) DO UPDATE SET timestamp = EXCLUDED.timestamp WHERE deleted_matriculas.timestamp < EXCLUDED.timestamp"
+        )
+    if lote.get('tombstones_disciplinas'):
+        comandos.append(
+            b"INSERT INTO deleted_disciplinas (id, timestamp) VALUES "
+            + _valores(cursor, "(%s::uuid, %s::timestamptz)", _sem_duplicatas(lote['tombstones_disciplinas']))
+            + b" ON CONFLICT (id) DO UPDATE SET timestamp = EXCLUDED.timestamp WHERE deleted_disciplinas.timestamp < EXCLUDED.timestamp"
+        )
+    if lote.get('status'):
+        # Sempre o último comando: devolve os ids sem a linha base no destino (o UPDATE não teve o que atualizar)
+        comandos.append(
+            b"WITH v(id, status, versao) AS (VALUES "
+            + _valores(cursor, "(%s::uuid, %s, %s::timestamptz)", _sem_duplicatas(lote['status']))
+            + b"""), atualizadas AS (
+                UPDATE matriculas AS m SET status = v.status, data_ultima_modificacao = v.versao
+                FROM v WHERE m.id = v.id AND m.data_ultima_modificacao < v.versao
+            )
+            SELECT v.id FROM v WHERE NOT EXISTS (SELECT 1 FROM matriculas m WHERE m.id = v.id)"""
+        )
+    return b";\n".join(comandos)
+
+
+def status_sem_base(lote, faltando):
+    """True se alguma mudança de status do lote aponta para uma matrícula em 'faltando' (retorno de aplicar_lote)."""
+    return bool(faltando) and any(str(entrada[0]) in faltando for entrada in lote.get('status', ()))
+
+
+def aplicar_lote(conn, lote, commit=True):
+    """
+    Aplica o lote numa conexão.
+    Com commit=True o texto inteiro vai em UMA ida ao servidor, em modo autocommit: o PostgreSQL executa
+    múltiplos comandos de uma mesma mensagem como uma transação implícita (tudo ou nada).
+    Com commit=False os comandos entram na transação já aberta de quem chama.
+    Retorna os ids (texto) das mudanças de 'status' cuja matrícula ainda não existe no destino: o resto do
+    lote foi aplicado, mas quem entrega deve manter essas mudanças pendentes até a linha base chegar.
+    """
+    if lote_vazio(lote):
+        return set()
+    cursor = conn.cursor()
+    autocommit_anterior = conn.autocommit
+    try:
+        sql = montar_sql_lote(cursor, lote)
+        if commit:
+            conn.autocommit = True
+        cursor.execute(sql)
+        return {str(linha[0]) for linha in cursor.fetchall()} if lote.get('status') else set()
+    finally:
+        cursor.close()
+        if commit:
+            conn.autocommit = autocommit_anterior
+
+
+def replicar_lote(lote, lider_origem, descricao="lote"):
+    """
+    Envia o lote a todos os outros líderes: um único round trip por peer.
+    Retorna {servidor_id: True (replicado) | False (erro/offline)}.
+    """
+    resultados = {}
+    lideres_replica, lideres_ignorados = filtrar_lideres_disponiveis(
+        [s for s in ALL_SERVERS if s != lider_origem], "replicação"
+    )
+    for servidor_id in lideres_ignorados:
+        print(f"❌ Líder {servidor_id} indisponível. (Replicação pendente)")
+        resultados[servidor_id] = False
+
+    for servidor_id in lideres_replica:
+        replica_conn = connect_to_db(servidor_id)
+        if not replica_conn:
+            print(f"❌ Falha de Conexão: Líder {servidor_id} offline. (Replicação pendente)")
+            resultados[servidor_id] = False
+            continue
+        try:
+            with medir('replicar', servidor_id):
+                faltando = aplicar_lote(replica_conn, lote)
+            if faltando:
+                # Sem outbox não há nova tentativa: a mudança de status fica para o heal
+                resultados[servidor_id] = False
+                print(f"⚠️ Replicação parcial ({descricao}) para o Líder {servidor_id}: {len(faltando)} matrícula(s) "
+                      f"ainda não replicada(s) lá. (Status pendente até o heal)")
+                continue
+            resultados[servidor_id] = True
+            print(f"➡ Replicação SUCESSO ({descricao}) para o Líder {servidor_id}.")
+        except psycopg2.Error as e:
+            resultados[servidor_id] = False
+            print(f"❌ Erro ao replicar para {servidor_id}: {e}")
+        finally:
+            liberar_conexao(replica_conn)
+    return resultados
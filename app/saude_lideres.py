@@ -0,0 +1,180 @@
+import threading
+import time
+from app.config import CIRCUITO_FALHAS_PARA_ABRIR, CIRCUITO_BACKOFF_INICIAL, CIRCUITO_BACKOFF_MAXIMO
+
+FECHADO = 'FECHADO'
+ABERTO = 'ABERTO'
+SEMI_ABERTO = 'SEMI_ABERTO'
+
+
+class CircuitoLider:
+    """
+    Circuit breaker de UM líder.
+    FECHADO: conexões normais. Após N falhas seguidas passa a ABERTO.
+    ABERTO: o líder é ignorado sem tentar conexão até o fim do backoff.
+    SEMI_ABERTO: uma única sondagem é liberada; sucesso fecha o circuito, falha reabre com o dobro do backoff.
+    """
+
+    def __init__(self, servidor_id):
+        self.servidor_id = servidor_id
+        self.estado = FECHADO
+        self.falhas_consecutivas = 0
+        self.backoff = CIRCUITO_BACKOFF_INICIAL
+        self.reabrir_em = 0.0
+        self.sondagem_em_andamento = False
+        self.ultimo_sucesso = None
+        self.ultima_falha = None
+        self.ultimo_erro = None
+        self.ignorados = 0
+
+    def bloqueado(self, agora):
+        if self.estado == ABERTO:
+            return agora < self.reabrir_em
+        if self.estado == SEMI_ABERTO:
+            return self.sondagem_em_andamento
+        return False
+
+    def descricao(self, agora):
+        if self.estado == ABERTO and agora < self.reabrir_em:
+            return f"circuito aberto, nova sondagem em {self.reabrir_em - agora:.1f}s"
+        if self.estado == SEMI_ABERTO:
+            return "circuito semi-aberto, sondagem em andamento"
+        return "circuito fechado"
+
+
+_circuitos = {}
+_lock = threading.Lock()
+
+
+def _circuito(servidor_id):
+    circuito = _circuitos.get(servidor_id)
+    if circuito is None:
+        circuito = _circuitos.setdefault(servidor_id, CircuitoLider(servidor_id))
+    return circuito
+
+
+def permitir_conexao(servidor_id):
+    """
+    Decide se uma conexão NOVA pode ser tentada agora.
+    Quando o backoff de um circuito aberto expira, libera exatamente uma sondagem (SEMI_ABERTO).
+    """
+    agora = time.monotonic()
+    with _lock:
+        circuito = _circuito(servidor_id)
+        if circuito.estado == FECHADO:
+            return True
+        if circuito.estado == ABERTO and agora >= circuito.reabrir_em:
+            circuito.estado = SEMI_ABERTO
+        if circuito.estado == SEMI_ABERTO and not circuito.sondagem_em_andamento:
+            circuito.sondagem_em_andamento = True
+            return True
+        circuito.ignorados += 1
+        return False
+
+
+def registrar_sucesso(servidor_id):
+    with _lock:
+        circuito = _circuito(servidor_id)
+        if circuito.estado != FECHADO:
+            print(f"🟢 Líder {servidor_id} voltou a responder. Circuito fechado.")
+        circuito.estado = FECHADO
+        circuito.falhas_consecutivas = 0
+        circuito.backoff = CIRCUITO_BACKOFF_INICIAL
+        circuito.sondagem_em_andamento = False
+        circuito.ultimo_sucesso = time.time()
+
+
+def registrar_falha(servidor_id, erro=None):
+    agora = time.monotonic()
+    with _lock:
+        circuito = _circuito(servidor_id)
+        circuito.falhas_consecutivas += 1
+        circuito.ultima_falha = time.time()
+        circuito.ultimo_erro = erro
+        if circuito.estado == SEMI_ABERTO:
+            # A sondagem falhou: reabre com backoff exponencial
+            circuito.backoff = min(circuito.backoff * 2, CIRCUITO_BACKOFF_MAXIMO)
+            circuito.estado = ABERTO
+            circuito.reabrir_em = agora + circuito.backoff
+            circuito.sondagem_em_andamento = False
+        elif circuito.estado == FECHADO and circuito.falhas_consecutivas >= CIRCUITO_FALHAS_PARA_ABRIR:
+            circuito.estado = ABERTO
+            circuito.reabrir_em = agora + circuito.backoff
+            print(f"🔴 Líder {servidor_id} marcado como indisponível após {circuito.falhas_consecutivas} falhas "
+                  f"(circuito aberto por {circuito.backoff:.0f}s).")
+
+
+def cancelar_sondagem(servidor_id):
+    """Libera a sondagem do estado SEMI_ABERTO quando ela não chegou a testar o líder."""
+    with _lock:
+        circuito = _circuitos.get(servidor_id)
+        if circuito:
+            circuito.sondagem_em_andamento = False
+
+
+def circuito_fechado(servidor_id):
+    with _lock:
+        circuito = _circuitos.get(servidor_id)
+        return circuito is None or circuito.estado == FECHADO
+
+
+def circuito_aberto(servidor_id):
+    """Consulta sem efeitos colaterais: True se o líder seria ignorado agora."""
+    with _lock:
+        circuito = _circuitos.get(servidor_id)
+        return bool(circuito and circuito.bloqueado(time.monotonic()))
+
+
+def descricao_circuito(servidor_id):
+    with _lock:
+        circuito = _circuitos.get(servidor_id)
+        return circuito.descricao(time.monotonic()) if circuito else "circuito fechado"
+
+
+def filtrar_lideres_disponiveis(servidores_ids, contexto=""):
+    """
+    Separa os líderes em (disponiveis, ignorados) segundo o circuit breaker,
+    reportando cada líder ignorado. Não consome a sondagem do estado SEMI_ABERTO.
+    """
+    disponiveis, ignorados = [], []
+    for servidor_id in servidores_ids:
+        if circuito_aberto(servidor_id):
+            ignorados.append(servidor_id)
+            with _lock:
+                _circuito(servidor_id).ignorados += 1
+            sufixo = f" em {contexto}" if contexto else ""
+            print(f"⏭️ Líder {servidor_id} ignorado{sufixo} ({descricao_circuito(servidor_id)}).")
+        else:
+            disponiveis.append(servidor_id)
+    return disponiveis, ignorados
+
+
+def estado_lideres():
+    """Retorna {servidor_id: dados do circuito} para diagnóstico."""
+    agora = time.monotonic()
+    with _lock:
+        return {
+            servidor_id: {
+                'estado': c.estado,
+                'falhas_consecutivas': c.falhas_consecutivas,
+                'backoff': c.backoff,
+                'reabre_em': max(0.0, c.reabrir_em - agora) if c.estado == ABERTO else 0.0,
+                'ignorados': c.ignorados,
+                'ultimo_sucesso': c.ultimo_sucesso,
+                'ultima_falha': c.ultima_falha,
+                'ultimo_erro': c.ultimo_erro,
+            }
+            for servidor_id, c in _circuitos.items()
+        }
+
+
+def exibir_estado_lideres():
+    estados = estado_lideres()
+    if not estados:
+        return
+    print("\n--- Saúde dos Líderes (Circuit Breaker) ---")
+    for servidor_id, dados in estados.items():
+        linha = f"Líder {servidor_id}: {dados['estado']} | falhas seguidas={dados['falhas_consecutivas']} ignorados={dados['ignorados']}"
+        if dados['estado'] == ABERTO:
+            linha += f" | nova sondagem em {dados['reabre_em']:.1f}s"
+        print(linha)
@@ -0,0 +1,329 @@
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from app.config import (
+    LOCAL_SERVERS, REPLICACAO_MODO, HTTP_HOST, HTTP_PORTA, HTTP_WORKERS, HTTP_FILA_MAXIMA, HTTP_AMOSTRAS_LATENCIA,
+    ANTI_ENTROPIA_ATIVA
+)
+from app.conexoes import aquecer_pools, estatisticas_pool
+from app.instrumentacao import metricas, metricas_prometheus
+
+
+class LatenciaEndpoints:
+    """Contagem, erros e as últimas HTTP_AMOSTRAS_LATENCIA latências de cada endpoint (percentis sob demanda)."""
+
+    def __init__(self, amostras=HTTP_AMOSTRAS_LATENCIA):
+        self._amostras = amostras
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def registrar(self, endpoint, segundos, erro=False):
+        with self._lock:
+            dados = self._endpoints.get(endpoint)
+            if dados is None:
+                dados = self._endpoints[endpoint] = {
+                    'requisicoes': 0, 'erros': 0, 'total': 0.0, 'amostras': deque(maxlen=self._amostras)
+                }
+            dados['requisicoes'] += 1
+            dados['erros'] += int(erro)
+            dados['total'] += segundos
+            dados['amostras'].append(segundos)
+
+    def resumo(self):
+        with self._lock:
+            copia = {endpoint: dict(dados, amostras=sorted(dados['amostras'])) for endpoint, dados in self._endpoints.items()}
+        resumo = {}
+        for endpoint, dados in copia.items():
+            amostras = dados['amostras']
+            def percentil(p):
+                return round(amostras[min(len(amostras) - 1, int(p * len(amostras)))] * 1000, 2)
+            resumo[endpoint] = {
+                'requisicoes': dados['requisicoes'],
+                'erros': dados['erros'],
+                'media_ms': round(dados['total'] / dados['requisicoes'] * 1000, 2),
+                'p50_ms': percentil(0.50),
+                'p95_ms': percentil(0.95),
+                'p99_ms': percentil(0.99),
+                'max_ms': round(amostras[-1] * 1000, 2),
+            }
+        return resumo
+
+
+def operacoes_postgres(lider_entrada=None):
+    """
+    Operações expostas pelo serviço, sobre os líderes PostgreSQL. Cada uma recebe o corpo/consulta da
+    requisição (dict) e devolve o dict de resultado das funções do app ('erro' preenchido quando falha).
+    Outro conjunto com as mesmas chaves pode ser passado a criar_servidor (p.ex. para testes).
+    """
+    from app.matricular import _processar_matricula
+    from app.remover import remover_aluno, remover_alunos_em_lote
+    from app.adicionar_disciplina import _adicionar_disciplina_core
+    from app.relatorio_consolidado import dados_relatorio, gerar_relatorio_multilider
+    from app.consultar_estado import estado_detalhado
+    from app.sincronizacao import sincronizar_ao_iniciar
+    from app.anti_entropia import progresso_anti_entropia
+    lider_entrada = lider_entrada or LOCAL_SERVERS[0]
+
+    def remover(dados):
+        if dados.get('disciplina'):
+            return remover_aluno(lider_entrada, dados['aluno'], dados['disciplina'])
+        return remover_alunos_em_lote(lider_entrada, [(dados['aluno'], None)])
+
+    return {
+        'matricular': lambda dados: _processar_matricula(lider_entrada, dados['aluno'], dados['disciplina']),
+        'remover': remover,
+        'adicionar_disciplina': lambda dados: _adicionar_disciplina_core(dados['nome'], dados['vagas']),
+        'relatorio': lambda dados: (
+            gerar_relatorio_multilider(exibir=False) if dados.get('multilider') else dados_relatorio()
+        ),
+        'estado': lambda dados: estado_detalhado(),
+        'heal': lambda dados: sincronizar_ao_iniciar(modo=dados.get('modo')),
+        'anti_entropia': lambda dados: progresso_anti_entropia(),
+    }
+
+
+def operacoes_memoria(backend=None, lider_entrada=None):
+    """
+    As mesmas operações sobre líderes simulados em memória (BackendMemoria): a matrícula, a remoção e o
+    heal rodam o mesmo código de operacoes_postgres; relatório e estado devolvem as contagens por líder.
+    """
+    from app.armazenamento import BackendMemoria
+    from app.matricular import _processar_matricula
+    from app.remover import remover_aluno, remover_alunos_em_lote
+    from app.sincronizacao import sincronizar_ao_iniciar
+    from app.anti_entropia import progresso_anti_entropia
+    backend = backend or BackendMemoria()
+    lider_entrada = lider_entrada or LOCAL_SERVERS[0]
+
+    def remover(dados):
+        if dados.get('disciplina'):
+            return remover_aluno(lider_entrada, dados['aluno'], dados['disciplina'], backend=backend)
+        return remover_alunos_em_lote(lider_entrada, [(dados['aluno'], None)], backend=backend)
+
+    def adicionar_disciplina(dados):
+        disciplina_id = backend.criar_disciplina(dados['nome'], dados['vagas'])
+        return {'disciplina_id': disciplina_id, 'nome': dados['nome'], 'vagas': dados['vagas']}
+
+    return {
+        'matricular': lambda dados: _processar_matricula(lider_entrada, dados['aluno'], dados['disciplina'], backend=backend),
+        'remover': remover,
+        'adicionar_disciplina': adicionar_disciplina,
+        'relatorio': lambda dados: backend.resumo(),
+        'estado': lambda dados: backend.resumo(),
+        'heal': lambda dados: sincronizar_ao_iniciar(modo=dados.get('modo'), backend=backend),
+        'anti_entropia': lambda dados: progresso_anti_entropia(),
+    }
+
+
+def _texto(valor):
+    if not isinstance(valor, str) or not valor.strip():
+        raise ValueError("deve ser um texto não vazio")
+    return valor.strip()
+
+
+def _inteiro_positivo(valor):
+    # Aceita 10 e "10" (consulta ou JSON); recusa "x", 2.5, true e valores <= 0
+    if isinstance(valor, (bool, float)) or not isinstance(valor, (int, str)):
+        raise ValueError("deve ser um número inteiro positivo")
+    try:
+        numero = int(valor)
+    except ValueError:
+        raise ValueError("deve ser um número inteiro positivo") from None
+    if numero <= 0:
+        raise ValueError("deve ser um número inteiro positivo")
+    return numero
+
+
+# (método, caminho) -> (operação, campos obrigatórios, {campo: validação})
+# A validação converte o valor ou levanta ValueError, que vira 400 antes de a operação rodar.
+ROTAS = {
+    ('POST', '/matriculas'): ('matricular', ('aluno', 'disciplina'), {'aluno': _texto, 'disciplina': _texto}),
+    ('DELETE', '/matriculas'): ('remover', ('aluno',), {'aluno': _texto, 'disciplina': _texto}),
+    ('POST', '/disciplinas'): ('adicionar_disciplina', ('nome', 'vagas'), {'nome': _texto, 'vagas': _inteiro_positivo}),
+    ('GET', '/relatorio'): ('relatorio', (), {}),
+    ('GET', '/estado'): ('estado', (), {}),
+    ('POST', '/heal'): ('heal', (), {'modo': _texto}),
+    ('GET', '/anti-entropia'): ('anti_entropia', (), {}),
+}
+
+
+class ManipuladorHTTP(BaseHTTPRequestHandler):
+    server_version = "LabMultiLider/1.0"
+
+    def log_message(self, formato, *args):
+        # Uma linha por requisição atrapalharia sob carga; as latências ficam em GET /metricas
+        pass
+
+    def _responder(self, codigo, corpo):
+        dados = json.dumps(corpo, default=str, ensure_ascii=False).encode('utf-8')
+        self.send_response(codigo)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def _responder_texto(self, codigo, texto, tipo='text/plain; version=0.0.4; charset=utf-8'):
+        dados = texto.encode('utf-8')
+        self.send_response(codigo)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def _ler_dados(self, url):
+        dados = {campo: valores[-1] for campo, valores in parse_qs(url.query).items()}
+        tamanho = int(self.headers.get('Content-Length') or 0)
+        if tamanho:
+            corpo = json.loads(self.rfile.read(tamanho))
+            if not isinstance(corpo, dict):
+                raise ValueError("o corpo deve ser um objeto JSON")
+            dados.update(corpo)
+        return dados
+
+    def _despachar(self, metodo):
+        inicio = time.monotonic()
+        url = urlparse(self.path)
+        endpoint = f"{metodo} {url.path}"
+        codigo = 500
+        try:
+            if (metodo, url.path) == ('GET', '/metricas'):
+                codigo = 200
+                self._responder(codigo, {'latencias': self.server.latencias.resumo(), 'pools': estatisticas_pool(),
+                                         'workers': self.server.workers, 'fila_maxima': self.server.fila_maxima,
+                                         'instrumentacao': metricas()})
+                return
+            if (metodo, url.path) == ('GET', '/metricas/prometheus'):
+                codigo = 200
+                self._responder_texto(codigo, metricas_prometheus())
+                return
+            rota = ROTAS.get((metodo, url.path))
+            if rota is None:
+                codigo = 404
+                self._responder(codigo, {'erro': f"rota desconhecida: {endpoint}"})
+                endpoint = "404 (rota desconhecida)"  # caminhos arbitrários não viram entradas novas nas métricas
+                return
+            operacao, obrigatorios, validacoes = rota
+            try:
+                dados = self._ler_dados(url)
+            except ValueError as e:
+                codigo = 400
+                self._responder(codigo, {'erro': f"JSON inválido: {e}"})
+                return
+            faltando = [campo for campo in obrigatorios if dados.get(campo) in (None, '')]
+            if faltando:
+                codigo = 400
+                self._responder(codigo, {'erro': f"campos obrigatórios ausentes: {', '.join(faltando)}"})
+                return
+            invalidos = []
+            for campo, validar in validacoes.items():
+                if dados.get(campo) in (None, ''):
+                    continue
+                try:
+                    dados[campo] = validar(dados[campo])
+                except ValueError as e:
+                    invalidos.append(f"'{campo}' {e}")
+            if invalidos:
+                codigo = 400
+                self._responder(codigo, {'erro': f"campos inválidos: {'; '.join(invalidos)}"})
+                return
+            resultado = self.server.operacoes[operacao](dados)
+            # 'erro' no resultado é uma recusa de negócio (duplicada, disciplina inexistente, líder offline...)
+            codigo = 422 if isinstance(resultado, dict) and resultado.get('erro') else 200
+            self._responder(codigo, resultado)
+        except Exception as e:
+            codigo = 500
+            self._responder(codigo, {'erro': f"erro interno: {e}"})
+        finally:
+            self.server.latencias.registrar(endpoint, time.monotonic() - inicio, erro=codigo >= 400)
+
+    def do_GET(self):
+        self._despachar('GET')
+
+    def do_POST(self):
+        self._despachar('POST')
+
+    def do_DELETE(self):
+        self._despachar('DELETE')
+
+
+class ServidorHTTP(HTTPServer):
+    """
+    HTTPServer cujas requisições rodam num pool de 'workers' threads. Até 'fila_maxima' conexões esperam
+    por um worker; além disso a resposta é 503 imediato, em vez de acumular threads e conexões ao banco.
+    """
+
+    def __init__(self, endereco, operacoes, workers=HTTP_WORKERS, fila_maxima=HTTP_FILA_MAXIMA):
+        super().__init__(endereco, ManipuladorHTTP)
+        self.operacoes = operacoes
+        self.workers = workers
+        self.fila_maxima = fila_maxima
+        self.latencias = LatenciaEndpoints()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="http")
+        self._vagas = threading.BoundedSemaphore(workers + fila_maxima)
+
+    def process_request(self, request, client_address):
+        if not self._vagas.acquire(blocking=False):
+            corpo = b'{"erro": "servidor ocupado, tente novamente"}'
+            try:
+                request.sendall(
+                    b"HTTP/1.0 503 Service Unavailable\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(corpo)}\r\nRetry-After: 1\r\n\r\n".encode() + corpo
+                )
+            except OSError:
+                pass
+            self.latencias.registrar("503 (fila cheia)", 0.0, erro=True)
+            self.shutdown_request(request)
+            return
+        self._executor.submit(self._atender, request, client_address)
+
+    def _atender(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._vagas.release()
+
+    def server_close(self):
+        super().server_close()
+        self._executor.shutdown(wait=True)
+
+
+def criar_servidor(host=HTTP_HOST, porta=HTTP_PORTA, operacoes=None, workers=HTTP_WORKERS, fila_maxima=HTTP_FILA_MAXIMA):
+    return ServidorHTTP((host, porta), operacoes or operacoes_postgres(), workers, fila_maxima)
+
+
+def servir(host=HTTP_HOST, porta=HTTP_PORTA, workers=HTTP_WORKERS, fila_maxima=HTTP_FILA_MAXIMA, memoria=False):
+    """
+    Serviço de longa duração: pools aquecidos, replicação em segundo plano e requisições até Ctrl+C.
+    memoria=True atende sobre líderes simulados em memória (sem banco, migrações nem expedidor).
+    """
+    if memoria:
+        operacoes, backend = operacoes_memoria(), "backend em memória"
+    else:
+        from app.migracoes import aplicar_migracoes
+        aplicar_migracoes()
+        aquecer_pools()
+        if REPLICACAO_MODO == 'outbox':
+            from app.outbox import iniciar_expedidor
+            iniciar_expedidor()
+        elif REPLICACAO_MODO == 'captura':
+            from app.captura_mudancas import iniciar_captura
+            iniciar_captura()
+        if ANTI_ENTROPIA_ATIVA:
+            from app.anti_entropia import iniciar_anti_entropia
+            iniciar_anti_entropia()
+        operacoes, backend = operacoes_postgres(), "PostgreSQL"
+    servidor = criar_servidor(host, porta, operacoes=operacoes, workers=workers, fila_maxima=fila_maxima)
+    print(f"🌐 Serviço HTTP em http://{host}:{porta} ({workers} workers, fila de {fila_maxima}, {backend}). Ctrl+C para parar.")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        print("\nEncerrando o serviço HTTP...")
+    finally:
+        servidor.server_close()
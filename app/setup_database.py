@@ -1,6 +1,7 @@
 import psycopg2
-from psycopg2 import OperationalError
 from app.config import SERVERS 
+from app.conexoes import connect_to_db, liberar_conexao, ultimo_erro_conexao, exibir_estatisticas_pool
+from app.saude_lideres import exibir_estado_lideres
 
 
 def verificar_conexao_servidor(servidor_id, config):
@@ -14,15 +15,16 @@ def verificar_conexao_servidor(servidor_id, config):
     conn = None
 
     try:
-        # Tenta estabelecer a conexão com um timeout de 5 segundos
-        conn = psycopg2.connect(
-            host=host,
-            port=port,
-            dbname=config['dbname'],
-            user=config['user'],
-            password=config['password'],
-            connect_timeout=5
-        )
+        # Obtém a conexão pelo pool (o timeout de handshake vem de CONNECT_TIMEOUT no config.py)
+        conn = connect_to_db(servidor_id, ignorar_circuito=True)
+        if not conn:
+            print(f"❌ FALHA! Não foi possível conectar ao Servidor {servidor_id}.")
+            print(f"   Detalhes do erro: {ultimo_erro_conexao(servidor_id)}")
+            print("\n   *Possíveis Soluções:*")
+            print("   - Verifique se a máquina (host) está ligada.")
+            print("   - Verifique as configurações de rede (Firewall/pg_hba.conf) ou credenciais.")
+            return
+
         print(f"✅ SUCESSO! Conexão com o Servidor {servidor_id} estabelecida.")
 
         # Teste rápido de consulta para garantir que o banco está operacional
@@ -31,12 +33,11 @@ def verificar_conexao_servidor(servidor_id, config):
         print(f"   Status do DB: Responde a consultas SQL básicas.")
         cursor.close()
 
-    except OperationalError as e:
-        print(f"❌ FALHA! Não foi possível conectar ao Servidor {servidor_id}.")
+    except psycopg2.OperationalError as e:
+        print(f"❌ FALHA! O Servidor {servidor_id} não respondeu à consulta de teste.")
         print(f"   Detalhes do erro: {e}")
-        print("\n   *Possíveis Soluções:*")
-        print("   - Verifique se a máquina (host) está ligada.")
-        print("   - Verifique as configurações de rede (Firewall/pg_hba.conf) ou credenciais.")
+        liberar_conexao(conn, descartar=True)
+        conn = None
 
     except Exception as e:
         print(
@@ -44,8 +45,8 @@ def verificar_conexao_servidor(servidor_id, config):
 
     finally:
         if conn:
-            conn.close()
-            print(f"   Conexão com {servidor_id} fechada.")
+            liberar_conexao(conn)
+            print(f"   Conexão com {servidor_id} devolvida ao pool.")
 
 
 def verificar_conexao_menu():
@@ -61,4 +62,6 @@ def verificar_conexao_menu():
     for servidor_id, config in SERVERS.items():
         verificar_conexao_servidor(servidor_id, config)
 
+    exibir_estatisticas_pool()
+    exibir_estado_lideres()
     print("\n*** VERIFICAÇÃO CONCLUÍDA ***")
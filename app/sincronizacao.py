@@ -1,66 +1,152 @@
+import threading
 import psycopg2
+from contextlib import contextmanager
+from datetime import timedelta
 from psycopg2.extras import execute_values
-from app.config import SERVERS, LOCAL_SERVERS, ALL_SERVERS
+from app.config import (
+    LOCAL_SERVERS, SYNC_MODO_PADRAO, SYNC_MARGEM_WATERMARK_SEGUNDOS,
+    MERKLE_LIMITE_FOLHA, MERKLE_PROFUNDIDADE_MAXIMA, SYNC_STREAMING_ITERSIZE, SYNC_STREAMING_LOTE
+)
+from app.saude_lideres import filtrar_lideres_disponiveis
+from app.hlc import observar_hlc
+from app.armazenamento import backend_padrao
+from app.instrumentacao import medir
 
-def connect_to_db(servidor_id):
-    """Conecta ao banco de dados específico."""
-    config = SERVERS.get(servidor_id)
-    if not config:
-        return None
-    
-    connect_args = {k: v for k, v in config.items() if k != 'tipo'}
-    connect_args['connect_timeout'] = 5
-    
+MODO_INCREMENTAL = 'incremental'
+MODO_COMPLETO = 'completo'
+MODO_MERKLE = 'merkle'
+MODO_STREAMING = 'streaming'
+
+# Colunas, coluna de versão (LWW) e regra de update de cada tabela sincronizada
+TABELAS_SYNC = {
+    'disciplinas': {
+        'colunas': ('id', 'nome', 'vagas_totais', 'is_deleted', 'data_ultima_modificacao'),
+        'coluna_versao': 'data_ultima_modificacao',
+        'tombstones': 'deleted_disciplinas',
+    },
+    'matriculas': {
+        'colunas': ('id', 'disciplina_id', 'nome_aluno', 'timestamp_matricula', 'status', 'data_ultima_modificacao'),
+        'coluna_versao': 'data_ultima_modificacao',
+        'tombstones': 'deleted_matriculas',
+    },
+    'deleted_disciplinas': {
+        'colunas': ('id', 'timestamp'),
+        'coluna_versao': 'timestamp',
+        'tombstones': None,
+    },
+    'deleted_matriculas': {
+        'colunas': ('id', 'timestamp'),
+        'coluna_versao': 'timestamp',
+        'tombstones': None,
+    },
+}
+
+# Deleções primeiro, depois os dados
+ORDEM_SYNC = ['deleted_disciplinas', 'deleted_matriculas', 'disciplinas', 'matriculas']
+
+# As mensagens do heal vão para o terminal; a anti-entropia em segundo plano (app/anti_entropia.py) roda em
+# silêncio na própria thread para não se misturar ao menu, e o progresso dela fica em progresso_anti_entropia().
+_silencio = threading.local()
+
+def _log(*args, **kwargs):
+    if not getattr(_silencio, 'ativo', False):
+        print(*args, **kwargs)
+
+@contextmanager
+def em_silencio():
+    anterior = getattr(_silencio, 'ativo', False)
+    _silencio.ativo = True
     try:
-        conn = psycopg2.connect(**connect_args)
-        return conn
-    except psycopg2.OperationalError:
-        return None
+        yield
+    finally:
+        _silencio.ativo = anterior
 
-def fetch_all_data_from_server(conn, tabela):
-    """Busca todos os dados (id e timestamp) de uma tabela."""
+SQL_TABELA_WATERMARKS = """
+    CREATE TABLE IF NOT EXISTS sync_watermarks (
+        peer_id VARCHAR(20) NOT NULL,
+        tabela VARCHAR(50) NOT NULL,
+        direcao VARCHAR(10) NOT NULL,
+        watermark TIMESTAMPTZ NOT NULL,
+        atualizado_em TIMESTAMPTZ DEFAULT (NOW() AT TIME ZONE 'UTC'),
+        PRIMARY KEY (peer_id, tabela, direcao)
+    )
+"""
+
+def fetch_all_data_from_server(conn, tabela, desde=None):
+    """
+    Busca os dados (id e timestamp de versão) de uma tabela.
+    Com 'desde', busca só as linhas modificadas depois dessa marca (modo incremental).
+    """
+    coluna_versao = TABELAS_SYNC[tabela]['coluna_versao']
     cursor = conn.cursor()
     try:
-        if tabela == 'disciplinas':
-            # Usa data_ultima_modificacao para LWW
-            cursor.execute(f"SELECT id, data_ultima_modificacao FROM {tabela}")
-        elif tabela == 'matriculas':
-            # Usa data_ultima_modificacao para LWW
-            cursor.execute(f"SELECT id, data_ultima_modificacao FROM {tabela}")
-        elif tabela == 'deleted_disciplinas' or tabela == 'deleted_matriculas':
-            cursor.execute(f"SELECT id, timestamp FROM {tabela}")
-        
+        if desde is None:
+            cursor.execute(f"SELECT id, {coluna_versao} FROM {tabela}")
+        else:
+            cursor.execute(f"SELECT id, {coluna_versao} FROM {tabela} WHERE {coluna_versao} > %s", (desde,))
+
         return {row[0]: row[1:] for row in cursor.fetchall()}
-    
+
     except psycopg2.Error as e:
-        print(f"Erro ao buscar dados da tabela {tabela}: {e}")
+        _log(f"Erro ao buscar dados da tabela {tabela}: {e}")
         return {}
     finally:
         cursor.close()
 
-def merge_data(conn_local, conn_remoto, tabela, deleted_ids_local=set()):
+def fetch_data_by_ids(conn, tabela, ids):
+    """Busca (id e timestamp de versão) apenas dos IDs informados."""
+    if not ids:
+        return {}
+    coluna_versao = TABELAS_SYNC[tabela]['coluna_versao']
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT id, {coluna_versao} FROM {tabela} WHERE id = ANY(%s::uuid[])", (list(ids),))
+        return {row[0]: row[1:] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+@medir('merge_data')
+def merge_data(conn_local, conn_remoto, tabela, deleted_ids_local=set(), desde=None, backend=None, dados_remotos=None):
     """
     Executa o "merge" (LWW) dos dados do remoto para o local.
+    Com 'desde' (watermark), só as linhas do remoto modificadas depois dela são comparadas,
+    então o custo cresce com o volume de mudanças e não com o tamanho da tabela.
+    'dados_remotos' ({id: (versao,)}) evita buscar de novo as versões que quem chama já leu do remoto.
+    Retorna a maior versão vista no remoto (nova watermark) ou None se nada foi lido / o merge falhou.
+    """
+    _log(f"🔄 Sincronizando tabela '{tabela}'...")
+
+    backend = backend or backend_padrao()
+    if dados_remotos is None:
+        dados_remotos = backend.versoes(conn_remoto, tabela, desde=desde)
+    if desde is None:
+        dados_locais = backend.versoes(conn_local, tabela)
+    else:
+        dados_locais = backend.versoes(conn_local, tabela, ids=dados_remotos.keys())
+
+    maior_versao = max((ts_tuple[0] for ts_tuple in dados_remotos.values()), default=None)
+    observar_hlc(maior_versao)
+
+    if not _aplicar_lww(conn_local, conn_remoto, tabela, dados_locais, dados_remotos, deleted_ids_local, backend):
+        return None
+    return maior_versao
+
+def _aplicar_lww(conn_local, conn_remoto, tabela, dados_locais, dados_remotos, deleted_ids_local, backend=None):
+    """
+    Compara as versões {id: (timestamp,)} dos dois lados, busca no remoto as linhas completas
+    que são novas ou mais recentes e aplica no local. Retorna False se o merge falhou.
     """
-    print(f"🔄 Sincronizando tabela '{tabela}'...")
-    
-    dados_locais = fetch_all_data_from_server(conn_local, tabela)
-    dados_remotos = fetch_all_data_from_server(conn_remoto, tabela)
-    
-    cursor_local = conn_local.cursor()
-    cursor_remoto = conn_remoto.cursor()
-    
     ids_para_sincronizar = []
 
     # 1. Encontrar dados que o Remoto tem e o Local não, ou que são mais novos no Remoto
     for uuid, dados_remotos_ts_tuple in dados_remotos.items():
-        
+
         # LÓGICA ANTI-RESSURREIÇÃO (Ignora se o item foi deletado localmente)
         if uuid in deleted_ids_local:
-            continue 
+            continue
 
         dados_locais_ts_tuple = dados_locais.get(uuid)
-        
+
         # Pega o timestamp (é o primeiro item da tupla)
         dados_remotos_ts = dados_remotos_ts_tuple[0]
         dados_locais_ts = dados_locais_ts_tuple[0] if dados_locais_ts_tuple else None
@@ -70,142 +156,441 @@ def merge_data(conn_local, conn_remoto, tabela, deleted_ids_local=set()):
             ids_para_sincronizar.append(uuid)
 
     if not ids_para_sincronizar:
-        print(f"✅ Tabela '{tabela}' já está sincronizada.")
-        cursor_local.close()
-        cursor_remoto.close()
-        return
+        _log(f"✅ Tabela '{tabela}' já está sincronizada.")
+        return True
 
-    print(f"Merging {len(ids_para_sincronizar)} registros da tabela '{tabela}'...")
+    _log(f"Merging {len(ids_para_sincronizar)} registros da tabela '{tabela}'...")
+    if not (backend or backend_padrao()).copiar_linhas(conn_local, conn_remoto, tabela, ids_para_sincronizar):
+        return False
+    _log(f"✅ Merge da tabela '{tabela}' concluído.")
+    return True
 
-    # 2. Buscar os dados completos dos IDs selecionados do Remoto
+def _copiar_linhas(conn_local, conn_remoto, tabela, ids):
+    """
+    Busca no remoto as linhas completas dos 'ids' e aplica no local com INSERT ... ON CONFLICT
+    (o WHERE do LWW descarta as que o local já tem mais novas). Faz o commit no local.
+    Retorna False se falhou (o local sofre rollback).
+    """
+    cursor_local = conn_local.cursor()
+    cursor_remoto = conn_remoto.cursor()
     try:
-        # Define as colunas e regras de update para cada tabela
-        if tabela == 'disciplinas':
-            cursor_remoto.execute(f"SELECT * FROM disciplinas WHERE id = ANY(%s::uuid[])", (ids_para_sincronizar,))
-            colunas_query = "(id, nome, vagas_totais, is_deleted, data_ultima_modificacao)" # 5 COLUNAS
-            update_set = """
-                nome = EXCLUDED.nome, 
-                vagas_totais = EXCLUDED.vagas_totais, 
-                is_deleted = EXCLUDED.is_deleted, 
-                data_ultima_modificacao = EXCLUDED.data_ultima_modificacao
-            """
-            update_where = "disciplinas.data_ultima_modificacao < EXCLUDED.data_ultima_modificacao"
-            
-        elif tabela == 'matriculas':
-            cursor_remoto.execute(f"SELECT * FROM matriculas WHERE id = ANY(%s::uuid[])", (ids_para_sincronizar,))
-            colunas_query = "(id, disciplina_id, nome_aluno, timestamp_matricula, status, data_ultima_modificacao)" # 6 COLUNAS
-            update_set = """
-                disciplina_id = EXCLUDED.disciplina_id, 
-                nome_aluno = EXCLUDED.nome_aluno, 
-                timestamp_matricula = EXCLUDED.timestamp_matricula, 
-                status = EXCLUDED.status, 
-                data_ultima_modificacao = EXCLUDED.data_ultima_modificacao
-            """
-            update_where = "matriculas.data_ultima_modificacao < EXCLUDED.data_ultima_modificacao"
-        
-        elif tabela == 'deleted_disciplinas' or tabela == 'deleted_matriculas':
-            cursor_remoto.execute(f"SELECT * FROM {tabela} WHERE id = ANY(%s::uuid[])", (ids_para_sincronizar,))
-            colunas_query = "(id, timestamp)"
-            update_set = "timestamp = EXCLUDED.timestamp"
-            update_where = f"{tabela}.timestamp < EXCLUDED.timestamp"
+        colunas = TABELAS_SYNC[tabela]['colunas']
+        coluna_versao = TABELAS_SYNC[tabela]['coluna_versao']
+        colunas_query = f"({', '.join(colunas)})"
+        update_set = ", ".join(f"{coluna} = EXCLUDED.{coluna}" for coluna in colunas if coluna != 'id')
+        update_where = f"{tabela}.{coluna_versao} < EXCLUDED.{coluna_versao}"
 
+        # 2. Buscar os dados completos dos IDs selecionados do Remoto
+        cursor_remoto.execute(
+            f"SELECT {', '.join(colunas)} FROM {tabela} WHERE id = ANY(%s::uuid[])", (list(ids),)
+        )
         registros_completos = cursor_remoto.fetchall()
 
         # 3. Aplicar no banco Local usando "INSERT ... ON CONFLICT"
         if registros_completos:
-            
+
             # Query unificada que usa o 'placeholder %s' para execute_values
             query = f"""
                 INSERT INTO {tabela} {colunas_query}
-                VALUES %s 
+                VALUES %s
                 ON CONFLICT (id) DO UPDATE SET {update_set}
                 WHERE {update_where};
             """
-            
+
             execute_values(cursor_local, query, registros_completos)
             conn_local.commit()
-            print(f"✅ Merge da tabela '{tabela}' concluído.")
+        return True
 
     except Exception as e:
         conn_local.rollback()
-        print(f"❌ ERRO durante o merge da tabela '{tabela}': {e}")
+        _log(f"❌ ERRO durante o merge da tabela '{tabela}': {e}")
+        return False
     finally:
         cursor_local.close()
         cursor_remoto.close()
 
-def fetch_deleted_ids(conn, tabela_tombstone):
-    """Busca todos os IDs da tabela de deleção."""
+# --- Merge em streaming (cursores nomeados ordenados por id) ---
+
+def _abrir_fluxo(conn, tabela, nome, manter=False):
+    """Cursor nomeado (server-side) com (id, versão) da tabela inteira ordenada por id."""
+    coluna_versao = TABELAS_SYNC[tabela]['coluna_versao']
+    cursor = conn.cursor(name=nome, withhold=manter)
+    cursor.itersize = SYNC_STREAMING_ITERSIZE
+    cursor.execute(f"SELECT id::text, {coluna_versao} FROM {tabela} ORDER BY id")
+    return cursor
+
+def _fechar_fluxo(conn, cursor):
+    try:
+        cursor.close()
+    except psycopg2.Error:
+        conn.rollback()
+
+@medir('merge_streaming')
+def merge_streaming(conn_local, conn_remoto, tabela):
+    """
+    Merge LWW de remoto -> local com memória limitada: os dois lados são lidos por cursores nomeados
+    ordenados por id (SYNC_STREAMING_ITERSIZE linhas por ida ao servidor) e percorridos como um
+    merge-join. Os ids novos ou mais recentes no remoto são aplicados em lotes de SYNC_STREAMING_LOTE
+    (tombstones do local conferidos por lote, um commit por lote), então nem as tabelas nem a lista de
+    diferenças ficam inteiras em memória.
+    O cursor do local é WITH HOLD para sobreviver aos commits dos lotes; a comparação usa o snapshot
+    da abertura e o WHERE do upsert (LWW) protege contra o que mudou depois.
+    Retorna (maior versão vista no remoto, estatísticas) ou (None, estatísticas) se um lote falhou.
+    """
+    _log(f"🔄 Sincronizando tabela '{tabela}' (streaming)...")
+    tombstones = TABELAS_SYNC[tabela]['tombstones']
+    estatisticas = {'remotas': 0, 'locais': 0, 'aplicadas': 0, 'ignoradas_deletadas': 0, 'lotes': 0}
+    maior_versao = None
+    pendentes = []
+
+    def emitir():
+        ids = pendentes[:]
+        pendentes.clear()
+        if tombstones:
+            deletados = fetch_deleted_ids(conn_local, tombstones, ids=ids)
+            estatisticas['ignoradas_deletadas'] += len(deletados)
+            ids = [i for i in ids if i not in deletados]
+        if not ids:
+            return True
+        estatisticas['lotes'] += 1
+        estatisticas['aplicadas'] += len(ids)
+        return _copiar_linhas(conn_local, conn_remoto, tabela, ids)
+
+    fluxo_remoto = _abrir_fluxo(conn_remoto, tabela, f"sync_remoto_{tabela}")
+    fluxo_local = _abrir_fluxo(conn_local, tabela, f"sync_local_{tabela}", manter=True)
+    try:
+        remotas, locais = iter(fluxo_remoto), iter(fluxo_local)
+        remota, local = next(remotas, None), next(locais, None)
+        while remota is not None:
+            if local is not None and local[0] < remota[0]:
+                estatisticas['locais'] += 1
+                local = next(locais, None)
+                continue
+            estatisticas['remotas'] += 1
+            if maior_versao is None or remota[1] > maior_versao:
+                maior_versao = remota[1]
+            # Lógica LWW (Last Write Wins): ausente no local, ou mais nova no remoto
+            if local is None or local[0] != remota[0] or remota[1] > local[1]:
+                pendentes.append(remota[0])
+                if len(pendentes) >= SYNC_STREAMING_LOTE and not emitir():
+                    return None, estatisticas
+            remota = next(remotas, None)
+        if pendentes and not emitir():
+            return None, estatisticas
+    finally:
+        _fechar_fluxo(conn_local, fluxo_local)
+        _fechar_fluxo(conn_remoto, fluxo_remoto)
+        conn_local.commit()
+        conn_remoto.rollback()
+
+    observar_hlc(maior_versao)
+    if estatisticas['aplicadas']:
+        _log(f"✅ '{tabela}': {estatisticas['remotas']} linhas remotas percorridas, {estatisticas['aplicadas']} "
+             f"aplicadas em {estatisticas['lotes']} lote(s) ({estatisticas['ignoradas_deletadas']} deletadas no local).")
+    else:
+        _log(f"✅ Tabela '{tabela}' já está sincronizada ({estatisticas['remotas']} linhas remotas percorridas).")
+    return maior_versao, estatisticas
+
+# --- Anti-entropia por digests (árvore de Merkle sobre prefixos do UUID) ---
+
+def _intervalo_prefixo(prefixo):
+    """Converte um prefixo hexadecimal do UUID em (inicio, fim) para uma busca por faixa no índice da PK."""
+    hex_prefixo = prefixo.replace('-', '')
+    inicio = hex_prefixo.ljust(32, '0')
+    if not hex_prefixo or set(hex_prefixo) == {'f'}:
+        return _formatar_uuid(inicio), None
+    proximo = format(int(hex_prefixo, 16) + 1, 'x').rjust(len(hex_prefixo), '0')
+    return _formatar_uuid(inicio), _formatar_uuid(proximo.ljust(32, '0'))
+
+def _formatar_uuid(hex32):
+    return f"{hex32[:8]}-{hex32[8:12]}-{hex32[12:16]}-{hex32[16:20]}-{hex32[20:]}"
+
+def _filtro_prefixos(prefixos):
+    """Monta o WHERE (por faixas de UUID, que usam o índice da PK) que restringe a consulta aos prefixos."""
+    condicoes, params = [], []
+    for prefixo in prefixos:
+        inicio, fim = _intervalo_prefixo(prefixo)
+        if fim is None:
+            condicoes.append("id >= %s::uuid")
+            params.append(inicio)
+        else:
+            condicoes.append("(id >= %s::uuid AND id < %s::uuid)")
+            params.extend([inicio, fim])
+    return " OR ".join(condicoes) or "true", params
+
+def calcular_digests(conn, tabela, prefixos, tamanho_prefixo):
+    """
+    Calcula no servidor, para cada bucket (prefixo do UUID com 'tamanho_prefixo' caracteres)
+    dentro dos 'prefixos' pais, a quantidade de linhas e um md5 de (id, versão) ordenado por id.
+    Retorna {bucket: (quantidade, digest)}.
+    """
+    coluna_versao = TABELAS_SYNC[tabela]['coluna_versao']
+    filtro, params = _filtro_prefixos([p for p in prefixos if p])
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT left(id::text, %s) AS bucket, count(*),
+                   md5(string_agg(id::text || ':' || (extract(epoch FROM {coluna_versao}) * 1000000)::bigint,
+                                  ',' ORDER BY id))
+            FROM {tabela}
+            WHERE {filtro}
+            GROUP BY 1
+        """, [tamanho_prefixo] + params)
+        return {bucket: (quantidade, digest) for bucket, quantidade, digest in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+def fetch_data_by_prefixos(conn, tabela, prefixos):
+    """Busca (id e timestamp de versão) das linhas cujos UUIDs estão nos buckets informados."""
+    if not prefixos:
+        return {}
+    coluna_versao = TABELAS_SYNC[tabela]['coluna_versao']
+    filtro, params = _filtro_prefixos(prefixos)
     cursor = conn.cursor()
     try:
-        cursor.execute(f"SELECT id FROM {tabela_tombstone}")
+        cursor.execute(f"SELECT id, {coluna_versao} FROM {tabela} WHERE {filtro}", params)
+        return {row[0]: row[1:] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+def encontrar_buckets_divergentes(conn_local, conn_remoto, tabela):
+    """
+    Desce a árvore de digests dos dois líderes a partir da raiz (prefixos de 1 caractere),
+    abrindo apenas os buckets cujos digests diferem. Para quando o bucket divergente é pequeno
+    (MERKLE_LIMITE_FOLHA linhas) ou atinge MERKLE_PROFUNDIDADE_MAXIMA.
+    Retorna (buckets_folha, estatisticas).
+    """
+    folhas = []
+    prefixos = ['']
+    tamanho = 1
+    estatisticas = {'niveis': 0, 'buckets_comparados': 0}
+    while prefixos:
+        digests_local = calcular_digests(conn_local, tabela, prefixos, tamanho)
+        digests_remoto = calcular_digests(conn_remoto, tabela, prefixos, tamanho)
+        estatisticas['niveis'] += 1
+        estatisticas['buckets_comparados'] += len(set(digests_local) | set(digests_remoto))
+
+        proximos = []
+        for bucket in set(digests_local) | set(digests_remoto):
+            local, remoto = digests_local.get(bucket), digests_remoto.get(bucket)
+            if local == remoto:
+                continue
+            quantidade = max(local[0] if local else 0, remoto[0] if remoto else 0)
+            if quantidade <= MERKLE_LIMITE_FOLHA or tamanho >= MERKLE_PROFUNDIDADE_MAXIMA:
+                folhas.append(bucket)
+            else:
+                proximos.append(bucket)
+        prefixos = proximos
+        tamanho += 1
+        # O 9º caractere do UUID textual é sempre '-': pula direto para o próximo dígito
+        if tamanho == 9:
+            tamanho = 10
+    return folhas, estatisticas
+
+def coletar_diferencas_merkle(conn_local, conn_remoto, tabela):
+    """Retorna (dados_locais, dados_remotos) restritos aos buckets em que os líderes divergem."""
+    folhas, estatisticas = encontrar_buckets_divergentes(conn_local, conn_remoto, tabela)
+    dados_locais = fetch_data_by_prefixos(conn_local, tabela, folhas)
+    dados_remotos = fetch_data_by_prefixos(conn_remoto, tabela, folhas)
+    _log(f"🌳 '{tabela}': {estatisticas['buckets_comparados']} buckets comparados em {estatisticas['niveis']} níveis, "
+         f"{len(folhas)} divergentes ({len(dados_remotos)} versões remotas / {len(dados_locais)} locais transferidas).")
+    return dados_locais, dados_remotos
+
+def fetch_deleted_ids(conn, tabela_tombstone, ids=None):
+    """Busca os IDs da tabela de deleção (todos, ou só os que estiverem em 'ids')."""
+    cursor = conn.cursor()
+    try:
+        if ids is None:
+            cursor.execute(f"SELECT id FROM {tabela_tombstone}")
+        else:
+            cursor.execute(f"SELECT id FROM {tabela_tombstone} WHERE id = ANY(%s::uuid[])", (list(ids),))
         return {row[0] for row in cursor.fetchall()}
     except psycopg2.Error:
+        conn.rollback()
         return set()
     finally:
         cursor.close()
 
-def sincronizar_ao_iniciar():
-    """Função principal de "cura" (healing) para ser chamada pelo main.py."""
-    
-    print("\n" + "="*50)
-    print("INICIANDO PROCESSO DE SINCRONIZAÇÃO (HEALING)")
-    print("="*50)
+def resumo_tabelas(conn):
+    """{tabela: (linhas, maior versão)} das tabelas sincronizadas, numa consulta: o bastante para saber se há o que trocar."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(" UNION ALL ".join(
+            f"SELECT '{tabela}', COUNT(*), MAX({TABELAS_SYNC[tabela]['coluna_versao']}) FROM {tabela}"
+            for tabela in ORDEM_SYNC
+        ))
+        return {tabela: (linhas, versao) for tabela, linhas, versao in cursor.fetchall()}
+    finally:
+        conn.rollback()
+        cursor.close()
+
+def garantir_tabela_watermarks(conn):
+    """Cria a tabela de watermarks em bancos inicializados antes dela existir no init.sql."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(SQL_TABELA_WATERMARKS)
+        conn.commit()
+    finally:
+        cursor.close()
+
+def carregar_watermarks(conn, peer_id, direcao):
+    """Retorna {tabela: watermark} da última troca bem-sucedida com o peer nessa direção."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT tabela, watermark FROM sync_watermarks WHERE peer_id = %s AND direcao = %s",
+            (peer_id, direcao),
+        )
+        return dict(cursor.fetchall())
+    finally:
+        cursor.close()
+
+def salvar_watermark(conn, peer_id, tabela, direcao, watermark):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            INSERT INTO sync_watermarks (peer_id, tabela, direcao, watermark, atualizado_em)
+            VALUES (%s, %s, %s, %s, (NOW() AT TIME ZONE 'UTC'))
+            ON CONFLICT (peer_id, tabela, direcao) DO UPDATE
+            SET watermark = GREATEST(sync_watermarks.watermark, EXCLUDED.watermark),
+                atualizado_em = EXCLUDED.atualizado_em
+        """, (peer_id, tabela, direcao, watermark))
+        conn.commit()
+    finally:
+        cursor.close()
+
+def _sincronizar_direcao(conn_destino, conn_origem, conn_metadados, peer_id, direcao, modo, backend, tabelas=ORDEM_SYNC):
+    """
+    Sincroniza origem -> destino para as 'tabelas' (padrão: as 4, sempre na ordem de ORDEM_SYNC).
+    As watermarks ficam SEMPRE no líder local (conn_metadados), indexadas por (peer, tabela, direção):
+    'pull' marca versões do peer já trazidas; 'push' marca versões locais já enviadas ao peer.
+    No modo 'merkle' as watermarks não são usadas: só os buckets com digests divergentes são comparados.
+    O modo 'streaming' compara todas as linhas, como o 'completo', mas com memória limitada (merge_streaming),
+    e grava as watermarks para as rodadas incrementais seguintes.
+    """
+    tabelas = [tabela for tabela in ORDEM_SYNC if tabela in tabelas]
+    if modo == MODO_STREAMING:
+        for tabela in tabelas:
+            nova_watermark, _ = merge_streaming(conn_destino, conn_origem, tabela)
+            if nova_watermark is not None:
+                backend.salvar_watermark(conn_metadados, peer_id, tabela, direcao, nova_watermark)
+        return
+
+    if modo == MODO_MERKLE:
+        diferencas = {tabela: coletar_diferencas_merkle(conn_destino, conn_origem, tabela) for tabela in tabelas}
+        for tabela in tabelas:
+            dados_destino, dados_origem = diferencas[tabela]
+            tombstones = TABELAS_SYNC[tabela]['tombstones']
+            # IDs deletados no destino ANTES de sincronizar (anti-ressurreição), só entre os divergentes
+            deleted_ids = fetch_deleted_ids(conn_destino, tombstones, ids=dados_origem.keys()) if tombstones and dados_origem else set()
+            _log(f"🔄 Sincronizando tabela '{tabela}'...")
+            _aplicar_lww(conn_destino, conn_origem, tabela, dados_destino, dados_origem, deleted_ids)
+        return
+
+    watermarks = backend.carregar_watermarks(conn_metadados, peer_id, direcao) if modo == MODO_INCREMENTAL else {}
+    margem = timedelta(seconds=SYNC_MARGEM_WATERMARK_SEGUNDOS)
+    desde = {tabela: (wm - margem) for tabela, wm in watermarks.items()}
+
+    # IDs deletados no destino ANTES de sincronizar (anti-ressurreição).
+    # No modo incremental, só interessam os IDs que de fato mudaram na origem: as versões alteradas são
+    # lidas uma vez só, aqui, e reaproveitadas pelo merge_data.
+    deleted_ids, alteradas = {}, {}
+    for tabela in ('disciplinas', 'matriculas'):
+        if tabela not in tabelas:
+            continue
+        tombstones = TABELAS_SYNC[tabela]['tombstones']
+        if modo == MODO_INCREMENTAL and tabela in desde:
+            alteradas[tabela] = backend.versoes(conn_origem, tabela, desde=desde[tabela])
+            candidatos = alteradas[tabela].keys()
+            deleted_ids[tabela] = backend.ids_deletados(conn_destino, tombstones, ids=candidatos) if candidatos else set()
+        else:
+            deleted_ids[tabela] = backend.ids_deletados(conn_destino, tombstones)
+
+    for tabela in tabelas:
+        nova_watermark = merge_data(
+            conn_destino, conn_origem, tabela,
+            deleted_ids_local=deleted_ids.get(tabela, set()),
+            desde=desde.get(tabela),
+            backend=backend,
+            dados_remotos=alteradas.get(tabela),
+        )
+        if nova_watermark is not None:
+            backend.salvar_watermark(conn_metadados, peer_id, tabela, direcao, nova_watermark)
+
+def sincronizar_peer(conn_local, conn_remoto, lider_local_id, remoto_id, modo, backend, tabelas=ORDEM_SYNC):
+    """Sincronização bidirecional do líder local com um peer, restrita às 'tabelas'."""
+    # 1. Puxar dados do Remoto (ex: B) para o Local (ex: A)
+    _log(f"\n[{lider_local_id} <- {remoto_id}] Puxando dados do {remoto_id} para {lider_local_id}...")
+    _sincronizar_direcao(conn_local, conn_remoto, conn_local, remoto_id, 'pull', modo, backend, tabelas)
+
+    # 2. Empurrar dados do Local (ex: A) para o Remoto (ex: B)
+    _log(f"\n[{lider_local_id} -> {remoto_id}] Empurrando dados do {lider_local_id} para {remoto_id}...")
+    _sincronizar_direcao(conn_remoto, conn_local, conn_local, remoto_id, 'push', modo, backend, tabelas)
+
+@medir('heal')
+def sincronizar_ao_iniciar(modo=None, backend=None):
+    """
+    Função principal de "cura" (healing) para ser chamada pelo main.py.
+    modo='incremental' (padrão em SYNC_MODO_PADRAO) troca apenas o que mudou desde a última
+    sincronização com cada peer; modo='completo' refaz a comparação de todas as linhas (fallback);
+    modo='merkle' compara digests por faixas de UUID e só transfere as linhas dos buckets divergentes;
+    modo='streaming' compara todas as linhas com cursores nomeados, sem carregar as tabelas em memória.
+    'backend' (app/armazenamento.py) padrão: os líderes PostgreSQL; modos que o backend não implementa
+    ('merkle'/'streaming' no backend em memória) caem para 'completo'.
+    Retorna {'modo', 'lider_local', 'sincronizados', 'falharam'} (falharam: {líder: motivo}).
+    """
+    backend = backend or backend_padrao()
+    modo = modo or SYNC_MODO_PADRAO
+    if modo not in backend.modos_sync:
+        _log(f"⚠️ Modo '{modo}' não disponível neste backend. Usando sincronização completa.")
+        modo = MODO_COMPLETO
+
+    _log("\n" + "="*50)
+    _log(f"INICIANDO PROCESSO DE SINCRONIZAÇÃO (HEALING) - MODO {modo.upper()}")
+    _log("="*50)
 
     lider_local_id = LOCAL_SERVERS[0]
-    lideres_remotos_ids = [s for s in ALL_SERVERS if s != lider_local_id]
+    lideres_remotos_ids = [s for s in backend.lideres if s != lider_local_id]
 
-    conn_local = connect_to_db(lider_local_id)
+    conn_local = backend.conectar(lider_local_id)
     if not conn_local:
-        print(f"❌ Falha crítica: Não foi possível conectar ao banco de dados local ({lider_local_id}). Sincronização abortada.")
-        return
+        _log(f"❌ Falha crítica: Não foi possível conectar ao banco de dados local ({lider_local_id}). Sincronização abortada.")
+        return {'modo': modo, 'lider_local': lider_local_id, 'sincronizados': [], 'falharam': {lider_local_id: "offline"}}
 
-    # Busca os IDs deletados localmente ANTES de sincronizar
-    deleted_disciplinas_local = fetch_deleted_ids(conn_local, 'deleted_disciplinas')
-    deleted_matriculas_local = fetch_deleted_ids(conn_local, 'deleted_matriculas')
+    try:
+        backend.preparar_sincronizacao(conn_local)
+    except psycopg2.Error as e:
+        conn_local.rollback()
+        if modo == MODO_INCREMENTAL:
+            _log(f"⚠️ Tabela de watermarks indisponível ({e}). Usando sincronização completa.")
+            modo = MODO_COMPLETO
 
+    resultado = {'modo': modo, 'lider_local': lider_local_id, 'sincronizados': [], 'falharam': {}}
+    lideres_remotos_ids, ignorados = filtrar_lideres_disponiveis(lideres_remotos_ids, "sincronização")
+    resultado['falharam'].update({remoto_id: "circuito aberto" for remoto_id in ignorados})
     for remoto_id in lideres_remotos_ids:
-        print(f"\n--- Tentando sincronizar com o Líder {remoto_id} ---")
-        conn_remoto = connect_to_db(remoto_id)
-        
+        _log(f"\n--- Tentando sincronizar com o Líder {remoto_id} ---")
+        conn_remoto = backend.conectar(remoto_id)
+
         if not conn_remoto:
-            print(f"⚠️ Líder {remoto_id} está OFFLINE. Pulando sincronização.")
+            _log(f"⚠️ Líder {remoto_id} está OFFLINE. Pulando sincronização.")
+            resultado['falharam'][remoto_id] = "offline"
             continue
 
-        deleted_disciplinas_remoto = fetch_deleted_ids(conn_remoto, 'deleted_disciplinas')
-        deleted_matriculas_remoto = fetch_deleted_ids(conn_remoto, 'deleted_matriculas')
-            
         try:
-            # Sincronização Bi-Direcional:
-            
-            # 1. Puxar dados do Remoto (ex: B) para o Local (ex: A)
-            print(f"\n[{lider_local_id} <- {remoto_id}] Puxando dados do {remoto_id} para {lider_local_id}...")
-            # Sincroniza deleções primeiro
-            merge_data(conn_local, conn_remoto, 'deleted_disciplinas') 
-            merge_data(conn_local, conn_remoto, 'deleted_matriculas')
-            
-            merge_data(conn_local, conn_remoto, 'disciplinas', deleted_ids_local=deleted_disciplinas_local)
-            merge_data(conn_local, conn_remoto, 'matriculas', deleted_ids_local=deleted_matriculas_local)
-            
-            # 2. Empurrar dados do Local (ex: A) para o Remoto (ex: B)
-            print(f"\n[{lider_local_id} -> {remoto_id}] Empurrando dados do {lider_local_id} para {remoto_id}...")
-            # Sincroniza deleções primeiro
-            merge_data(conn_remoto, conn_local, 'deleted_disciplinas') 
-            merge_data(conn_remoto, conn_local, 'deleted_matriculas')
-
-            merge_data(conn_remoto, conn_local, 'disciplinas', deleted_ids_local=deleted_disciplinas_remoto)
-            merge_data(conn_remoto, conn_local, 'matriculas', deleted_ids_local=deleted_matriculas_remoto)
-            
-            print(f"\n✅ Sincronização com {remoto_id} concluída.")
+            sincronizar_peer(conn_local, conn_remoto, lider_local_id, remoto_id, modo, backend)
+            _log(f"\n✅ Sincronização com {remoto_id} concluída.")
+            resultado['sincronizados'].append(remoto_id)
 
         except Exception as e:
-            print(f"❌ Erro inesperado durante a sincronização com {remoto_id}: {e}")
+            _log(f"❌ Erro inesperado durante a sincronização com {remoto_id}: {e}")
+            resultado['falharam'][remoto_id] = str(e)
         finally:
-            if conn_remoto:
-                conn_remoto.close()
-
-    if conn_local:
-        conn_local.close()
-        
-    print("="*50)
-    print("SINCRONIZAÇÃO CONCLUÍDA")
-    print("="*50)
\ No newline at end of file
+            backend.liberar(conn_remoto)
+
+    backend.liberar(conn_local)
+
+    _log("="*50)
+    _log("SINCRONIZAÇÃO CONCLUÍDA")
+    _log("="*50)
+    return resultado
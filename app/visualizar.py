@@ -1,21 +1,11 @@
 import psycopg2
-from app.config import SERVERS, LOCAL_SERVERS 
-from prettytable import PrettyTable
+from app.config import LOCAL_SERVERS 
+from app.conexoes import connect_to_db, liberar_conexao
 from collections import defaultdict
 from datetime import timezone
 
-def connect_to_db(servidor_id):
-    config = SERVERS.get(servidor_id)
-    if not config: return None
-    connect_args = {k: v for k, v in config.items() if k != 'tipo'}
-    connect_args['connect_timeout'] = 5
-    try:
-        conn = psycopg2.connect(**connect_args)
-        return conn
-    except psycopg2.OperationalError:
-        return None
-
 def visualizar_alunos():
+    from prettytable import PrettyTable
     print("\n--- Opção 5: Visualização de Matrículas (Modo Diagnóstico) ---")
     for servidor_id in LOCAL_SERVERS:
         conn = connect_to_db(servidor_id)
@@ -63,7 +53,7 @@ def visualizar_alunos():
                 print(f"❌ Erro SQL ao consultar matrículas em {servidor_id}: {e}")
             finally:
                 if cursor: cursor.close()
-                if conn: conn.close()
+                liberar_conexao(conn)
         else:
             print(f"\n=== Servidor: {servidor_id} ===")
             print("❌ Servidor inacessível ou offline.")
\ No newline at end of file
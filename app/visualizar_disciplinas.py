@@ -1,42 +1,40 @@
 import psycopg2
-from app.config import SERVERS, ALL_SERVERS 
-from prettytable import PrettyTable
-
-def connect_to_any_db(servidores_ids):
-    for servidor_id in servidores_ids:
-        config = SERVERS.get(servidor_id)
-        if not config: continue
-        connect_args = {k: v for k, v in config.items() if k != 'tipo'}
-        connect_args['connect_timeout'] = 3 
-        try:
-            conn = psycopg2.connect(**connect_args)
-            return conn, servidor_id
-        except psycopg2.OperationalError:
-            continue
-    return None, None
+from app.config import ALL_SERVERS 
+from app.conexoes import connect_to_any_db, liberar_conexao
 
 def visualizar_disciplinas():
+    from prettytable import PrettyTable
     conn, servidor_id = connect_to_any_db(ALL_SERVERS)
     if not conn:
         print("\n❌ Não foi possível conectar a nenhum servidor para visualizar disciplinas.")
         return
     cursor = conn.cursor()
     try:
-        
-        cursor.execute("""
-            SELECT id, nome, vagas_totais 
-            FROM disciplinas 
-            WHERE (is_deleted IS NULL OR is_deleted = false) 
-            ORDER BY nome;
-        """)
+        # Vagas disponíveis vêm do contador por disciplina (app/ocupacao.py), sem contar matrículas
+        try:
+            cursor.execute("""
+                SELECT d.id, d.nome, d.vagas_totais, d.vagas_totais - COALESCE(o.aceitas, 0)
+                FROM disciplinas d
+                LEFT JOIN disciplina_ocupacao o ON o.disciplina_id = d.id
+                WHERE (d.is_deleted IS NULL OR d.is_deleted = false)
+                ORDER BY d.nome;
+            """)
+        except psycopg2.errors.UndefinedTable:
+            conn.rollback()
+            cursor.execute("""
+                SELECT id, nome, vagas_totais, NULL
+                FROM disciplinas 
+                WHERE (is_deleted IS NULL OR is_deleted = false) 
+                ORDER BY nome;
+            """)
         rows = cursor.fetchall()
         if not rows:
             print("Nenhuma disciplina encontrada no catálogo.")
             return
         table = PrettyTable()
-        table.field_names = ["ID", "Disciplina", "Vagas Totais"]
+        table.field_names = ["ID", "Disciplina", "Vagas Totais", "Vagas Disponíveis"]
         for row in rows:
-            table.add_row(row)
+            table.add_row([valor if valor is not None else '-' for valor in row])
         table.align = "l"
         print(f"\n=== Catálogo de Disciplinas (Fonte: Servidor {servidor_id}) ===")
         print(table)
@@ -45,4 +43,4 @@ def visualizar_disciplinas():
         print(f"❌ Erro SQL ao buscar disciplinas: {e}")
     finally:
         if cursor: cursor.close()
-        if conn: conn.close()
\ No newline at end of file
+        liberar_conexao(conn)
\ No newline at end of file
@@ -26,4 +26,92 @@ CREATE TABLE IF NOT EXISTS deleted_disciplinas (
 CREATE TABLE IF NOT EXISTS deleted_matriculas (
     id UUID PRIMARY KEY,
     timestamp TIMESTAMPTZ DEFAULT (NOW() AT TIME ZONE 'UTC')
-);
\ No newline at end of file
+);
+-- Watermarks da sincronização incremental (app/sincronizacao.py):
+-- última versão trocada com cada peer, por tabela e direção ('pull' = peer -> local, 'push' = local -> peer)
+CREATE TABLE IF NOT EXISTS sync_watermarks (
+    peer_id VARCHAR(20) NOT NULL,
+    tabela VARCHAR(50) NOT NULL,
+    direcao VARCHAR(10) NOT NULL,
+    watermark TIMESTAMPTZ NOT NULL,
+    atualizado_em TIMESTAMPTZ DEFAULT (NOW() AT TIME ZONE 'UTC'),
+    PRIMARY KEY (peer_id, tabela, direcao)
+);
+-- Outbox de replicação (app/outbox.py): gravada na mesma transação da escrita local,
+-- drenada para cada peer por um expedidor em segundo plano
+CREATE TABLE IF NOT EXISTS replication_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    destino VARCHAR(20) NOT NULL,
+    descricao TEXT,
+    lote JSONB NOT NULL,
+    criado_em TIMESTAMPTZ DEFAULT (NOW() AT TIME ZONE 'UTC'),
+    tentativas INT NOT NULL DEFAULT 0,
+    proxima_tentativa TIMESTAMPTZ NOT NULL DEFAULT (NOW() AT TIME ZONE 'UTC'),
+    ultimo_erro TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_replication_outbox_destino ON replication_outbox (destino, id);
+-- Índices das consultas quentes (mesmos da app/migracoes.py, que os cria em bancos já existentes)
+CREATE INDEX IF NOT EXISTS idx_matriculas_fila
+    ON matriculas (disciplina_id, timestamp_matricula, id) WHERE status != 'REMOVIDA';
+CREATE INDEX IF NOT EXISTS idx_matriculas_versao ON matriculas (data_ultima_modificacao, id);
+CREATE INDEX IF NOT EXISTS idx_disciplinas_versao ON disciplinas (data_ultima_modificacao, id);
+CREATE INDEX IF NOT EXISTS idx_disciplinas_nome ON disciplinas (nome);
+-- Matrícula ativa (não REMOVIDA) do aluno na disciplina. Sem UNIQUE: matrículas do mesmo aluno feitas em
+-- líderes diferentes têm ids diferentes e precisam replicar (os upserts só resolvem conflito por id)
+CREATE INDEX IF NOT EXISTS idx_matriculas_aluno_ativo
+    ON matriculas (disciplina_id, nome_aluno) WHERE status != 'REMOVIDA';
+-- Contadores de ocupação por disciplina (mesmos da app/ocupacao.py), mantidos por triggers de comando
+CREATE TABLE IF NOT EXISTS disciplina_ocupacao (
+    disciplina_id UUID PRIMARY KEY REFERENCES disciplinas(id) ON DELETE CASCADE,
+    aceitas INT NOT NULL DEFAULT 0,
+    em_espera INT NOT NULL DEFAULT 0,
+    pendentes INT NOT NULL DEFAULT 0,
+    removidas INT NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION atualizar_disciplina_ocupacao() RETURNS trigger AS $$
+DECLARE
+    delta TEXT;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        delta := 'SELECT disciplina_id, status, COUNT(*) AS n FROM novas GROUP BY 1, 2';
+    ELSIF TG_OP = 'UPDATE' THEN
+        delta := 'SELECT disciplina_id, status, COUNT(*) AS n FROM novas GROUP BY 1, 2
+                  UNION ALL
+                  SELECT disciplina_id, status, -COUNT(*) FROM antigas GROUP BY 1, 2';
+    ELSE
+        delta := 'SELECT disciplina_id, status, -COUNT(*) AS n FROM antigas GROUP BY 1, 2';
+    END IF;
+
+    -- Ordenado por disciplina para que transações concorrentes travem os contadores na mesma ordem
+    EXECUTE format($sql$
+        INSERT INTO disciplina_ocupacao AS o (disciplina_id, aceitas, em_espera, pendentes, removidas)
+        SELECT disciplina_id,
+               COALESCE(SUM(n) FILTER (WHERE status = 'ACEITA'), 0),
+               COALESCE(SUM(n) FILTER (WHERE status = 'REJEITADA'), 0),
+               COALESCE(SUM(n) FILTER (WHERE status = 'PENDENTE'), 0),
+               COALESCE(SUM(n) FILTER (WHERE status = 'REMOVIDA'), 0)
+        FROM (%s) delta
+        WHERE disciplina_id IS NOT NULL
+        GROUP BY disciplina_id
+        HAVING bool_or(n <> 0)
+        ORDER BY disciplina_id
+        ON CONFLICT (disciplina_id) DO UPDATE SET
+            aceitas = o.aceitas + EXCLUDED.aceitas,
+            em_espera = o.em_espera + EXCLUDED.em_espera,
+            pendentes = o.pendentes + EXCLUDED.pendentes,
+            removidas = o.removidas + EXCLUDED.removidas
+    $sql$, delta);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_ocupacao_insert ON matriculas;
+DROP TRIGGER IF EXISTS trg_ocupacao_update ON matriculas;
+DROP TRIGGER IF EXISTS trg_ocupacao_delete ON matriculas;
+CREATE TRIGGER trg_ocupacao_insert AFTER INSERT ON matriculas
+    REFERENCING NEW TABLE AS novas FOR EACH STATEMENT EXECUTE FUNCTION atualizar_disciplina_ocupacao();
+CREATE TRIGGER trg_ocupacao_update AFTER UPDATE ON matriculas
+    REFERENCING OLD TABLE AS antigas NEW TABLE AS novas FOR EACH STATEMENT EXECUTE FUNCTION atualizar_disciplina_ocupacao();
+CREATE TRIGGER trg_ocupacao_delete AFTER DELETE ON matriculas
+    REFERENCING OLD TABLE AS antigas FOR EACH STATEMENT EXECUTE FUNCTION atualizar_disciplina_ocupacao();
@@ -1,18 +1,12 @@
-try:
-    from app.adicionar_disciplina import adicionar_disciplina 
-    from app.remover_disciplina import remover_disciplina 
-    from app.matricular import matricular_aluno_menu
-    from app.visualizar_disciplinas import visualizar_disciplinas
-    from app.relatorio_consolidado import gerar_relatorio 
-    from app.consultar_estado import consultar_estado
-    from app.remover import remover_matricula_menu 
-    from app.visualizar import visualizar_alunos 
-    from app.setup_database import verificar_conexao_menu 
-    from app.sincronizacao import sincronizar_ao_iniciar ### NOVO ###
-except ImportError as e:
-    print(f"❌ ERRO GRAVE DE IMPORTAÇÃO: O módulo não foi encontrado ou a função não existe.")
-    print(f"Detalhe: {e}. Verifique se a função principal existe em seu respectivo arquivo, e se app/config.py e app/__init__.py estão no lugar.")
-    exit()
+import argparse
+import json
+import sys
+import threading
+from contextlib import redirect_stdout
+from app.config import (
+    LOCAL_SERVERS, REPLICACAO_MODO, SYNC_AO_INICIAR, HTTP_HOST, HTTP_PORTA, HTTP_WORKERS, HTTP_FILA_MAXIMA,
+    MONITOR_INTERVALO, ANTI_ENTROPIA_ATIVA, ANTI_ENTROPIA_INTERVALO
+)
 
 def exibir_menu():
     print("\n" + "="*50)
@@ -29,14 +23,76 @@ def exibir_menu():
     print("8.  Consultar Estado Detalhado")
     print("9.  Verificar Conexões de DB")
     print("10. Forçar Sincronização Manual (Heal)") ### NOVO ###
+    print("11. Sincronização Completa (Rescan de todas as linhas)")
+    print("12. Sincronização por Digests (Anti-Entropia Merkle)")
+    print("13. Ver Outbox de Replicação (pendências por líder)")
+    print("14. Ver Captura de Mudanças (slots de replicação lógica)")
+    print("15. Verificar Índices das Consultas (EXPLAIN)")
+    print("16. Relatório Consolidado Multi-Líder (merge LWW entre líderes)")
+    print("17. Verificar/Reconstruir Contadores de Ocupação")
+    print("18. Importar Matrículas em Lote (CSV/JSONL)")
+    print("19. Remover Matrículas em Lote (aluno em todas as disciplinas / arquivo)")
+    print("20. Sincronização Completa em Streaming (memória limitada)")
+    print("21. Métricas de Instrumentação (tempo por etapa, comandos por líder)")
+    print("22. Monitor de Divergência entre Líderes (atraso, filas divergentes, outbox)")
+    print("23. Progresso da Anti-Entropia em Segundo Plano")
     print("-" * 50)
     print("0. Sair")
     print("="*50)
 
-def main():
-    
-    # ### NOVO ###: Executa a sincronização uma vez ao iniciar o app
-    sincronizar_ao_iniciar() 
+def menu_interativo(heal=SYNC_AO_INICIAR):
+    # Os módulos do menu só são carregados aqui: os subcomandos da CLI importam apenas o que usam
+    try:
+        from app.adicionar_disciplina import adicionar_disciplina 
+        from app.remover_disciplina import remover_disciplina 
+        from app.matricular import matricular_aluno_menu
+        from app.visualizar_disciplinas import visualizar_disciplinas
+        from app.relatorio_consolidado import gerar_relatorio, gerar_relatorio_multilider
+        from app.consultar_estado import consultar_estado
+        from app.remover import remover_matricula_menu, remover_em_lote_menu
+        from app.visualizar import visualizar_alunos 
+        from app.setup_database import verificar_conexao_menu 
+        from app.sincronizacao import sincronizar_ao_iniciar ### NOVO ###
+        from app.outbox import iniciar_expedidor, exibir_outbox
+        from app.captura_mudancas import iniciar_captura, exibir_captura
+        from app.migracoes import aplicar_migracoes, verificar_planos_menu
+        from app.ocupacao import verificar_ocupacao_menu
+        from app.importar_matriculas import importar_matriculas_menu
+        from app.instrumentacao import exibir_metricas
+        from app.monitor_divergencia import monitor_divergencia_menu, precisa_heal
+        from app.anti_entropia import iniciar_anti_entropia, anti_entropia_menu
+    except ImportError as e:
+        print(f"❌ ERRO GRAVE DE IMPORTAÇÃO: O módulo não foi encontrado ou a função não existe.")
+        print(f"Detalhe: {e}. Verifique se a função principal existe em seu respectivo arquivo, e se app/config.py e app/__init__.py estão no lugar.")
+        sys.exit(1)
+
+    # ### NOVO ###: Executa a sincronização uma vez ao iniciar o app (SYNC_AO_INICIAR / --heal / --sem-heal)
+    if heal:
+        # Início bloqueante pedido: o heal depende do schema em dia, então as migrações vêm antes dele
+        aplicar_migracoes()
+        if heal == 'se_divergente':
+            heal = precisa_heal()
+            if not heal:
+                print("✅ Monitor de divergência: nenhum peer precisa de heal.")
+        if heal:
+            sincronizar_ao_iniciar()
+        migracoes_pendentes = None
+    else:
+        # Índices/restrições/contadores que ainda faltam (schema_migrations) em segundo plano: um líder
+        # offline custaria o connect_timeout antes do menu. O init.sql já cria o schema completo num banco novo.
+        migracoes_pendentes = aplicar_migracoes
+    # Anti-entropia contínua: a primeira rodada começa já, em segundo plano; o menu abre sem esperar por ela
+    if ANTI_ENTROPIA_ATIVA:
+        iniciar_anti_entropia(preparar=migracoes_pendentes)
+    elif migracoes_pendentes:
+        threading.Thread(target=migracoes_pendentes, name="migracoes", daemon=True).start()
+
+    # Expedidor da outbox: entrega em segundo plano as replicações gravadas junto com cada commit local
+    if REPLICACAO_MODO == 'outbox':
+        iniciar_expedidor()
+    # Captura de mudanças: consumidores dos slots lógicos do líder local propagam cada commit aos peers
+    elif REPLICACAO_MODO == 'captura':
+        iniciar_captura()
     
     while True:
         exibir_menu()
@@ -72,6 +128,45 @@ def main():
             elif opcao == '10': ### NOVO ###
                 print("\n-> FORÇAR SINCRONIZAÇÃO MANUAL (HEAL)")
                 sincronizar_ao_iniciar()
+            elif opcao == '11':
+                print("\n-> SINCRONIZAÇÃO COMPLETA (RESCAN)")
+                sincronizar_ao_iniciar(modo='completo')
+            elif opcao == '12':
+                print("\n-> SINCRONIZAÇÃO POR DIGESTS (MERKLE)")
+                sincronizar_ao_iniciar(modo='merkle')
+            elif opcao == '13':
+                print("\n-> OUTBOX DE REPLICAÇÃO")
+                exibir_outbox()
+            elif opcao == '14':
+                print("\n-> CAPTURA DE MUDANÇAS")
+                exibir_captura()
+            elif opcao == '15':
+                print("\n-> VERIFICAR ÍNDICES DAS CONSULTAS (EXPLAIN)")
+                verificar_planos_menu()
+            elif opcao == '16':
+                print("\n-> RELATÓRIO CONSOLIDADO MULTI-LÍDER")
+                gerar_relatorio_multilider()
+            elif opcao == '17':
+                print("\n-> VERIFICAR CONTADORES DE OCUPAÇÃO")
+                verificar_ocupacao_menu()
+            elif opcao == '18':
+                print("\n-> IMPORTAR MATRÍCULAS EM LOTE")
+                importar_matriculas_menu()
+            elif opcao == '19':
+                print("\n-> REMOVER MATRÍCULAS EM LOTE")
+                remover_em_lote_menu()
+            elif opcao == '20':
+                print("\n-> SINCRONIZAÇÃO COMPLETA EM STREAMING")
+                sincronizar_ao_iniciar(modo='streaming')
+            elif opcao == '21':
+                print("\n-> MÉTRICAS DE INSTRUMENTAÇÃO")
+                exibir_metricas()
+            elif opcao == '22':
+                print("\n-> MONITOR DE DIVERGÊNCIA ENTRE LÍDERES")
+                monitor_divergencia_menu()
+            elif opcao == '23':
+                print("\n-> PROGRESSO DA ANTI-ENTROPIA")
+                anti_entropia_menu()
             elif opcao == '0':
                 print("Saindo do sistema. Até logo!")
                 break
@@ -82,5 +177,196 @@ def main():
             print("Pressione Enter para continuar...")
             input()
 
+
+# --- CLI não interativa: um comando por execução, para scripts, cron e testes de carga ---
+
+def _cmd_matricular(args):
+    from app.matricular import _processar_matricula
+    return _processar_matricula(args.lider, args.aluno, args.disciplina)
+
+def _cmd_remover(args):
+    if args.disciplina:
+        from app.remover import remover_aluno
+        return remover_aluno(args.lider, args.aluno, args.disciplina)
+    from app.remover import remover_alunos_em_lote
+    return remover_alunos_em_lote(args.lider, [(args.aluno, None)])
+
+def _cmd_adicionar_disciplina(args):
+    if args.vagas <= 0:
+        return {'erro': "o número de vagas deve ser positivo"}
+    from app.adicionar_disciplina import _adicionar_disciplina_core
+    return _adicionar_disciplina_core(args.nome, args.vagas)
+
+def _cmd_relatorio(args):
+    from app.relatorio_consolidado import gerar_relatorio, gerar_relatorio_multilider, dados_relatorio
+    if args.multilider:
+        return gerar_relatorio_multilider(exibir=not args.json)
+    return dados_relatorio() if args.json else gerar_relatorio()
+
+def _cmd_heal(args):
+    from app.sincronizacao import sincronizar_ao_iniciar
+    resultado = sincronizar_ao_iniciar(modo=args.modo)
+    # Qualquer peer (ou o líder local) que falhou torna o heal um erro: código de saída 1
+    if resultado.get('falharam') and not resultado.get('erro'):
+        resultado['erro'] = "heal incompleto: " + ", ".join(f"{lider} ({motivo})" for lider, motivo in resultado['falharam'].items())
+    return resultado
+
+def _cmd_estado(args):
+    from app.consultar_estado import consultar_estado, estado_detalhado
+    return estado_detalhado() if args.json else consultar_estado()
+
+def _cmd_servir(args):
+    from app.servidor_http import servir
+    servir(args.host, args.porta, args.workers, args.fila_maxima, memoria=args.memoria)
+
+def _cmd_benchmark_contencao(args):
+    from app.benchmark_contencao import benchmark_contencao, exibir_benchmark_contencao
+    resultado = benchmark_contencao(args.disciplinas, args.vagas, args.matriculas, args.clientes, args.lider)
+    if not args.json:
+        exibir_benchmark_contencao(resultado)
+    return resultado
+
+def _cmd_benchmark(args):
+    from app.benchmark import executar_benchmark, exibir_benchmark
+    resultado = executar_benchmark(args.carga, args.clientes, args.operacoes, args.disciplinas, args.vagas,
+                                   memoria=args.memoria, latencia=args.latencia, entrada=args.entrada or args.lider, semente=args.semente)
+    if args.saida and not resultado.get('erro'):
+        with open(args.saida, 'w', encoding='utf-8') as arquivo:
+            json.dump(resultado, arquivo, default=str, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"💾 Resultado salvo em {args.saida}")
+    if not args.json and not resultado.get('erro'):
+        exibir_benchmark(resultado)
+    return resultado
+
+def _cmd_monitor(args):
+    from app.monitor_divergencia import medir_divergencia, exibir_divergencia, monitorar
+    if args.continuo:
+        return monitorar(args.intervalo, args.rodadas, arquivo_metricas=args.metricas, lider_local=args.lider)
+    resultado = medir_divergencia(args.lider)
+    if not args.json:
+        exibir_divergencia(resultado)
+    return resultado
+
+def _cmd_anti_entropia(args):
+    from app.anti_entropia import rodar_anti_entropia
+    return rodar_anti_entropia(args.intervalo, args.rodadas)
+
+# Comandos que gravam: no modo outbox, a execução só termina depois de uma rodada de entrega aos peers
+COMANDOS_DE_ESCRITA = {'matricular', 'remover', 'adicionar-disciplina'}
+
+def _executar_comando(args):
+    if args.consultas_lentas is not None:
+        from app.instrumentacao import configurar_consultas_lentas
+        configurar_consultas_lentas(args.consultas_lentas)
+    if args.heal and args.comando != 'heal':
+        from app.sincronizacao import sincronizar_ao_iniciar
+        sincronizar_ao_iniciar()
+    resultado = args.funcao(args)
+    if args.comando in COMANDOS_DE_ESCRITA and REPLICACAO_MODO == 'outbox':
+        from app.outbox import drenar_outbox
+        drenar_outbox(args.lider)
+    if args.metricas:
+        from app.instrumentacao import exportar_metricas
+        exportar_metricas(args.metricas)
+        print(f"📊 Métricas gravadas em {args.metricas}")
+    return resultado
+
+def criar_parser():
+    parser = argparse.ArgumentParser(
+        description="Sistema de matrículas multi-líder. Sem subcomando, abre o menu interativo."
+    )
+    parser.add_argument('--heal', dest='heal', action='store_true', default=None,
+                        help="menu: sincroniza com os peers ao iniciar (padrão: SYNC_AO_INICIAR)")
+    parser.add_argument('--sem-heal', dest='heal', action='store_false', help="menu: não sincroniza ao iniciar")
+
+    comum = argparse.ArgumentParser(add_help=False)
+    comum.add_argument('--json', action='store_true', help="resultado em JSON no stdout (mensagens vão para o stderr)")
+    comum.add_argument('--heal', action='store_true', help="sincroniza com os peers antes do comando")
+    comum.add_argument('--lider', default=LOCAL_SERVERS[0] if LOCAL_SERVERS else None, help="líder de entrada")
+    comum.add_argument('--metricas', metavar='ARQUIVO',
+                       help="grava as métricas de instrumentação ao final (.prom/.txt: Prometheus; senão JSON)")
+    comum.add_argument('--consultas-lentas', type=float, metavar='MS',
+                       help="registra em CONSULTA_LENTA_ARQUIVO os comandos mais lentos que MS milissegundos")
+
+    sub = parser.add_subparsers(dest='comando')
+    p = sub.add_parser('matricular', aliases=['enroll'], parents=[comum], help="matricula um aluno")
+    p.add_argument('aluno')
+    p.add_argument('disciplina')
+    p.set_defaults(funcao=_cmd_matricular, comando='matricular')
+
+    p = sub.add_parser('remover', aliases=['remove'], parents=[comum], help="remove a matrícula (sem disciplina: de todas)")
+    p.add_argument('aluno')
+    p.add_argument('disciplina', nargs='?')
+    p.set_defaults(funcao=_cmd_remover, comando='remover')
+
+    p = sub.add_parser('adicionar-disciplina', aliases=['add-discipline'], parents=[comum], help="cria uma disciplina")
+    p.add_argument('nome')
+    p.add_argument('vagas', type=int)
+    p.set_defaults(funcao=_cmd_adicionar_disciplina, comando='adicionar-disciplina')
+
+    p = sub.add_parser('relatorio', aliases=['report'], parents=[comum], help="relatório consolidado de vagas")
+    p.add_argument('--multilider', action='store_true', help="consulta todos os líderes e mescla por LWW")
+    p.set_defaults(funcao=_cmd_relatorio, comando='relatorio')
+
+    p = sub.add_parser('heal', parents=[comum], help="sincronização entre o líder local e os peers")
+    p.add_argument('--modo', choices=['incremental', 'completo', 'merkle', 'streaming'], default=None)
+    p.set_defaults(funcao=_cmd_heal, comando='heal')
+
+    p = sub.add_parser('estado', aliases=['state'], parents=[comum], help="estado detalhado das filas em cada líder")
+    p.set_defaults(funcao=_cmd_estado, comando='estado')
+
+    p = sub.add_parser('servir', aliases=['serve'], parents=[comum], help="serviço HTTP/JSON de longa duração")
+    p.add_argument('--host', default=HTTP_HOST)
+    p.add_argument('--porta', type=int, default=HTTP_PORTA)
+    p.add_argument('--workers', type=int, default=HTTP_WORKERS)
+    p.add_argument('--fila-maxima', type=int, default=HTTP_FILA_MAXIMA)
+    p.add_argument('--memoria', action='store_true', help="líderes simulados em memória (app/armazenamento.py), sem PostgreSQL")
+    p.set_defaults(funcao=_cmd_servir, comando='servir')
+
+    p = sub.add_parser('benchmark-contencao', parents=[comum], help="disputa de vagas com e sem coordenação por disciplina")
+    p.add_argument('--disciplinas', type=int, default=2, help="disciplinas quentes disputadas ao mesmo tempo")
+    p.add_argument('--vagas', type=int, default=5)
+    p.add_argument('--matriculas', type=int, default=40, help="matrículas por disciplina")
+    p.add_argument('--clientes', type=int, default=4, help="threads matriculando em paralelo")
+    p.set_defaults(funcao=_cmd_benchmark_contencao, comando='benchmark-contencao')
+
+    p = sub.add_parser('benchmark', parents=[comum], help="carga de ponta a ponta: vazão, percentis, idas e convergência")
+    p.add_argument('carga', choices=['estouro', 'uniforme', 'rotatividade', 'particao'])
+    p.add_argument('--clientes', type=int, default=8, help="threads executando operações em paralelo")
+    p.add_argument('--operacoes', type=int, default=200)
+    p.add_argument('--disciplinas', type=int, default=4, help="disciplinas da carga (a 'estouro' usa uma só)")
+    p.add_argument('--vagas', type=int, default=10, help="vagas de cada disciplina")
+    p.add_argument('--memoria', action='store_true', help="líderes simulados em memória (app/armazenamento.py), sem PostgreSQL")
+    p.add_argument('--latencia', type=float, default=0.0, help="com --memoria: segundos por ida a um líder")
+    p.add_argument('--entrada', default=None, help="líder de entrada ou 'todos' (padrão: --lider)")
+    p.add_argument('--semente', type=int, default=42, help="mesma semente = mesma sequência de operações")
+    p.add_argument('--saida', help="salva o resultado em JSON (chaves ordenadas) para comparar entre versões")
+    p.set_defaults(funcao=_cmd_benchmark, comando='benchmark')
+
+    p = sub.add_parser('monitor', parents=[comum], help="divergência e atraso de replicação entre o --lider e os peers")
+    p.add_argument('--continuo', action='store_true', help="mede a cada --intervalo segundos até Ctrl+C (ou --rodadas)")
+    p.add_argument('--intervalo', type=float, default=MONITOR_INTERVALO)
+    p.add_argument('--rodadas', type=int, default=None)
+    p.set_defaults(funcao=_cmd_monitor, comando='monitor')
+
+    p = sub.add_parser('anti-entropia', parents=[comum], help="rodadas de anti-entropia em primeiro plano (cron/serviço)")
+    p.add_argument('--intervalo', type=float, default=ANTI_ENTROPIA_INTERVALO, help="segundos entre rodadas (± ANTI_ENTROPIA_JITTER)")
+    p.add_argument('--rodadas', type=int, default=None, help="para depois de N rodadas (padrão: até Ctrl+C)")
+    p.set_defaults(funcao=_cmd_anti_entropia, comando='anti-entropia')
+    return parser
+
+def main(argv=None):
+    args = criar_parser().parse_args(argv)
+    if args.comando is None:
+        menu_interativo(SYNC_AO_INICIAR if args.heal is None else args.heal)
+        return 0
+    if not args.json:
+        resultado = _executar_comando(args)
+    else:
+        with redirect_stdout(sys.stderr):
+            resultado = _executar_comando(args)
+        print(json.dumps(resultado, default=str, ensure_ascii=False, indent=2))
+    return 1 if isinstance(resultado, dict) and resultado.get('erro') else 0
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
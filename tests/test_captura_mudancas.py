@@ -0,0 +1,91 @@
+import struct
+
+from app.armazenamento import EstadoLider
+from app.captura_mudancas import DecodificadorPgoutput, MontadorLote, nome_origem
+from app.replicacao import COLUNAS_MATRICULAS, novo_lote, lote_vazio
+
+COLUNAS = {'matriculas': COLUNAS_MATRICULAS, 'deleted_matriculas': ('id', 'timestamp')}
+RELIDS = {'matriculas': 1, 'deleted_matriculas': 2}
+
+
+def _texto(valor):
+    return str(valor).encode() + b'\x00'
+
+
+def _relacao(tabela):
+    colunas = b''.join(b'\x00' + _texto(coluna) + struct.pack('!Ii', 25, -1) for coluna in COLUNAS[tabela])
+    return (b'R' + struct.pack('!I', RELIDS[tabela]) + _texto('public') + _texto(tabela) + b'd'
+            + struct.pack('!h', len(COLUNAS[tabela])) + colunas)
+
+
+def _insert(tabela, linha):
+    valores = b''.join(b't' + struct.pack('!i', len(str(v).encode())) + str(v).encode() for v in linha)
+    return b'I' + struct.pack('!I', RELIDS[tabela]) + b'N' + struct.pack('!h', len(linha)) + valores
+
+
+class PeerMemoria:
+    """Um líder em memória que grava no 'WAL' (mensagens pgoutput) cada linha que um lote realmente mudou."""
+
+    def __init__(self, nome):
+        self.nome = nome
+        self.estado = EstadoLider()
+        self.wal = []
+        self.lsn = 0
+
+    def aplicar(self, lote, origem=None):
+        antes = {tabela: dict(self.estado.tabelas[tabela]) for tabela in COLUNAS}
+        self.estado.aplicar(lote)
+        mudadas = [(tabela, linha) for tabela in COLUNAS
+                   for chave, linha in self.estado.tabelas[tabela].items() if antes[tabela].get(chave) != linha]
+        if not mudadas:
+            return
+        self.lsn += 1
+        self.wal.append(b'B' + struct.pack('!qqi', self.lsn, 0, self.lsn))
+        if origem:
+            self.wal.append(b'O' + struct.pack('!q', self.lsn) + _texto(origem))
+        for tabela, linha in mudadas:
+            self.wal.append(_relacao(tabela))
+            self.wal.append(_insert(tabela, linha))
+        self.wal.append(b'C' + struct.pack('!bqqq', 0, self.lsn, self.lsn, 0))
+
+
+def _consumir(origem, destino):
+    """Um ciclo do consumidor origem->destino; retorna quantas mudanças foram entregues ao destino."""
+    decodificador, montador = DecodificadorPgoutput(), MontadorLote()
+    for mensagem in origem.wal:
+        montador.processar(decodificador.decodificar(mensagem))
+    origem.wal = []
+    lote, _, mudancas = montador.retirar()
+    if not lote_vazio(lote):
+        destino.aplicar(lote, nome_origem(origem.nome))
+    return mudancas
+
+
+def _propagar(a, b, limite=10):
+    entregas = []
+    for _ in range(limite):
+        entregues = _consumir(a, b) + _consumir(b, a)
+        if not entregues:
+            break
+        entregas.append(entregues)
+    return entregas
+
+
+def test_mudanca_para_depois_de_um_salto():
+    a, b = PeerMemoria('A'), PeerMemoria('B')
+    lote = novo_lote()
+    lote['matriculas'].append(('m1', 'd1', 'ana', '2026-01-01 00:00:00+00', 'ACEITA', '2026-01-01 00:00:00+00'))
+    lote['tombstones_matriculas'].append(('m0', '2026-01-01 00:00:00+00'))
+    a.aplicar(lote)
+
+    assert _propagar(a, b) == [2]
+    assert a.estado.tabelas == b.estado.tabelas
+
+
+def test_tombstone_mais_antigo_nao_sobrescreve():
+    estado = EstadoLider()
+    for timestamp in ('2026-01-01 00:00:02+00', '2026-01-01 00:00:01+00'):
+        lote = novo_lote()
+        lote['tombstones_matriculas'].append(('m0', timestamp))
+        estado.aplicar(lote)
+    assert estado.tabelas['deleted_matriculas']['m0'] == ('m0', '2026-01-01 00:00:02+00')
@@ -0,0 +1,24 @@
+from app.instrumentacao import Histograma
+
+
+def test_percentis_abaixo_de_1ms_sao_interpolados():
+    histograma = Histograma()
+    for amostra in range(1, 101):
+        histograma.registrar(amostra / 200)  # 0.005 .. 0.5 ms, tudo na primeira faixa
+
+    resumo = histograma.resumo()
+    assert resumo['p50_ms'] < resumo['p95_ms'] < resumo['max_ms'] == 0.5
+    assert abs(resumo['p50_ms'] - 0.25) <= 0.01
+    assert abs(resumo['p95_ms'] - 0.475) <= 0.01
+
+
+def test_percentil_nao_passa_do_maximo_nem_fica_abaixo_do_minimo():
+    histograma = Histograma()
+    for amostra in (0.3, 0.31):
+        histograma.registrar(amostra)
+
+    assert 0.3 <= histograma.percentil(0.5) <= histograma.percentil(0.99) <= 0.31
+
+
+def test_histograma_vazio():
+    assert Histograma().percentil(0.5) is None
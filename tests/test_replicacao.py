@@ -0,0 +1,18 @@
+from app.armazenamento import BackendMemoria
+from app.replicacao import novo_lote
+
+
+def test_status_sem_linha_base_fica_pendente_ate_ela_chegar():
+    backend = BackendMemoria(['A', 'B'])
+    promocao = novo_lote()
+    promocao['status'].append(('m1', 'ACEITA', '2026-01-01 00:00:02+00'))
+
+    assert backend.replicar('A', promocao) == {'B': False}
+    assert backend.pendentes == {('A', 'B'): [promocao]}
+
+    base = novo_lote()
+    base['matriculas'].append(('m1', 'd1', 'ana', '2026-01-01 00:00:01+00', 'REJEITADA', '2026-01-01 00:00:01+00'))
+    backend.estados['B'].aplicar(base)
+
+    assert backend.entregar_pendentes() == 0
+    assert backend.estados['B'].tabelas['matriculas']['m1'][4] == 'ACEITA'
@@ -0,0 +1,47 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from app.armazenamento import BackendMemoria
+from app.servidor_http import criar_servidor, operacoes_memoria
+
+
+@pytest.fixture
+def servidor():
+    servidor = criar_servidor('127.0.0.1', 0, operacoes=operacoes_memoria(BackendMemoria()), workers=2, fila_maxima=2)
+    thread = threading.Thread(target=servidor.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{servidor.server_address[1]}"
+    servidor.shutdown()
+    servidor.server_close()
+
+
+def _post(url, corpo):
+    requisicao = urllib.request.Request(url, data=json.dumps(corpo).encode(), method='POST',
+                                        headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(requisicao, timeout=5) as resposta:
+            return resposta.status, json.loads(resposta.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_vagas_nao_numericas_devolvem_400(servidor):
+    codigo, corpo = _post(f"{servidor}/disciplinas", {'nome': 'Redes', 'vagas': 'x'})
+    assert codigo == 400
+    assert 'vagas' in corpo['erro']
+
+
+def test_vagas_ausentes_devolvem_400(servidor):
+    codigo, corpo = _post(f"{servidor}/disciplinas", {'nome': 'Redes'})
+    assert codigo == 400
+    assert 'vagas' in corpo['erro']
+
+
+def test_vagas_em_texto_numerico_sao_aceitas(servidor):
+    codigo, corpo = _post(f"{servidor}/disciplinas", {'nome': 'Redes', 'vagas': '3'})
+    assert codigo == 200
+    assert corpo['vagas'] == 3